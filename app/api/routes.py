@@ -1,20 +1,91 @@
+import json
 import os
 import shutil
-from fastapi import FastAPI, UploadFile, File, HTTPException
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Literal
+from fastapi import FastAPI, Request, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from loguru import logger
 
+from app.core.startup import NotReady, Startup
 from app.core.config import settings
-from app.ingestion.pdf_processor import PDFProcessor
+from app.core.executors import ExecutorBusy, ingest_executor, query_executor
+from app.core.tracing import metrics, start_trace
 from app.ingestion.chunker import DocumentChunker
+from app.ingestion.jobs import IngestionJob, JobManager
+from app.ingestion.pdf_processor import shutdown_extraction_pool
+from app.ingestion.pipeline import IngestionPipeline
 from app.retrieval.vector_store import VectorStore
 from app.retrieval.rag_chain import RAGChain
 
+startup = Startup()
+startup.mark("api_import")
+
+
+@dataclass
+class Services:
+    vector_store: VectorStore
+    rag_chain: RAGChain
+    pipeline: IngestionPipeline
+    jobs: JobManager
+
+
+def build_services(startup: Startup) -> Services:
+    # One store shared by the API, the RAG chain and the ingestion pipeline
+    with startup.phase("vector_store"):
+        vector_store = VectorStore()
+    with startup.phase("rag_chain"):
+        rag_chain = RAGChain(vector_store)
+    with startup.phase("jobs"):
+        chunker = DocumentChunker(
+            chunk_size=settings.chunk_size,
+            chunk_overlap=settings.chunk_overlap,
+        )
+        pipeline = IngestionPipeline(vector_store, chunker)
+        jobs = JobManager(pipeline, ingest_executor, settings.job_db_path)
+        jobs.resume()
+
+    # Pay for model loading, the first encode and the first index reads here
+    # rather than on the first user request
+    if settings.warmup_enabled:
+        with startup.phase("warmup_model"):
+            vector_store.embedder.warm_up()
+            if rag_chain.reranker is not None:
+                rag_chain.reranker.warm_up()
+        with startup.phase("warmup_llm_client"):
+            _ = rag_chain.client, rag_chain.async_client
+        with startup.phase("warmup_search"):
+            embedding = vector_store.embedder.embed_query("warm-up query")
+            vector_store.backend.query(query_embeddings=[embedding], n_results=1)
+            vector_store.lexical_index.search("warm-up query", top_n=1)
+    return Services(vector_store, rag_chain, pipeline, jobs)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup.start(build_services)
+    yield
+    await run_in_threadpool(shutdown_extraction_pool)
+
+
+async def get_services() -> Services:
+    # Waits for startup to finish, up to STARTUP_WAIT_SECONDS
+    try:
+        return await startup.aget(settings.startup_wait_seconds)
+    except NotReady as e:
+        raise HTTPException(503, str(e))
+
+
 app = FastAPI(
     title="RAG Document Intelligence API",
     version="1.0.0",
     description="Upload PDFs and ask questions with cited answers",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -24,13 +95,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize components
-chunker = DocumentChunker(
-    chunk_size=settings.chunk_size,
-    chunk_overlap=settings.chunk_overlap,
+request_seconds = metrics.histogram(
+    "rag_http_request_duration_seconds", "API latency by route and status"
 )
-vector_store = VectorStore()
-rag_chain = RAGChain()
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Route templates, not raw paths, so IDs don't explode label cardinality
+    route = request.scope.get("route")
+    request_seconds.observe(
+        time.perf_counter() - start,
+        method=request.method,
+        route=route.path if route is not None else "unmatched",
+        status=response.status_code,
+    )
+    return response
 
 
 # --- Request/Response Models ---
@@ -38,33 +120,80 @@ rag_chain = RAGChain()
 class QueryRequest(BaseModel):
     question: str
     source_filter: str | None = None
+    chunk_type: Literal["text", "table"] | None = None
+    include_timings: bool = False
 
 class QueryResponse(BaseModel):
     answer: str
     sources: list[dict]
     confidence: float
+    rerank: dict | None = None
+    timings: dict | None = None
+
+class BatchQueryRequest(BaseModel):
+    questions: list[str]
+    source_filter: str | None = None
+    chunk_type: Literal["text", "table"] | None = None
+
+class BatchQueryResponse(BaseModel):
+    results: list[QueryResponse]
 
-class UploadResponse(BaseModel):
+class JobResponse(BaseModel):
+    job_id: str
     filename: str
+    status: str
     pages_extracted: int
-    chunks_created: int
-    message: str
+    chunks_embedded: int
+    chunks_stored: int
+    error: str | None = None
+    diff: dict | None = None
+    created_at: float
+    updated_at: float
+
+    @classmethod
+    def from_job(cls, job: IngestionJob) -> "JobResponse":
+        return cls(
+            job_id=job.job_id,
+            filename=job.filename,
+            status=job.status,
+            pages_extracted=job.pages_extracted,
+            chunks_embedded=job.chunks_embedded,
+            chunks_stored=job.chunks_stored,
+            error=job.error,
+            diff=job.diff,
+            created_at=job.created_at,
+            updated_at=job.updated_at,
+        )
 
 class StatsResponse(BaseModel):
     total_chunks: int
     indexed_files: list[str]
+    sources: list[dict] = []
 
 
 # --- Endpoints ---
 
-@app.post("/upload", response_model=UploadResponse)
+@app.post("/upload", response_model=JobResponse, status_code=202)
 async def upload_pdf(file: UploadFile = File(...)):
 
     if not file.filename.endswith(".pdf"):
         raise HTTPException(400, "Only PDF files are accepted")
 
-    # Save uploaded file
+    services = await get_services()
     file_path = os.path.join(settings.upload_dir, file.filename)
+    await run_in_threadpool(_save_upload, file, file_path)
+
+    # Extraction, chunking, embedding and storage run as a background job;
+    # poll /jobs/{job_id} for progress
+    try:
+        job = services.jobs.submit(file.filename, file_path)
+    except ExecutorBusy as e:
+        raise HTTPException(503, f"Server busy, retry later: {e}")
+
+    return JobResponse.from_job(job)
+
+
+def _save_upload(file: UploadFile, file_path: str) -> None:
     os.makedirs(settings.upload_dir, exist_ok=True)
 
     with open(file_path, "wb") as f:
@@ -72,26 +201,21 @@ async def upload_pdf(file: UploadFile = File(...)):
 
     logger.info(f"Saved uploaded file: {file.filename}")
 
-    try:
-        # Extract text
-        pages = PDFProcessor.extract_pages(file_path)
-
-        # Chunk
-        chunks = chunker.chunk_pages(pages)
 
-        # Store in vector DB
-        count = vector_store.add_chunks(chunks)
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    job = (await get_services()).jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, f"Unknown job {job_id}")
+    return JobResponse.from_job(job)
 
-        return UploadResponse(
-            filename=file.filename,
-            pages_extracted=len(pages),
-            chunks_created=count,
-            message=f"Successfully indexed {file.filename}",
-        )
 
-    except Exception as e:
-        logger.error(f"Failed to process {file.filename}: {e}")
-        raise HTTPException(500, f"Processing failed: {str(e)}")
+@app.delete("/jobs/{job_id}", response_model=JobResponse)
+async def cancel_job(job_id: str):
+    job = (await get_services()).jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(404, f"Unknown job {job_id}")
+    return JobResponse.from_job(job)
 
 
 @app.post("/query", response_model=QueryResponse)
@@ -100,32 +224,166 @@ async def query_documents(request: QueryRequest):
     if not request.question.strip():
         raise HTTPException(400, "Question cannot be empty")
 
-    response = rag_chain.query(
-        question=request.question,
-        source_filter=request.source_filter,
-    )
+    services = await get_services()
+    with start_trace() as trace:
+        try:
+            response = await services.rag_chain.aquery(
+                question=request.question,
+                source_filter=request.source_filter,
+                chunk_type=request.chunk_type,
+            )
+        except ExecutorBusy as e:
+            raise HTTPException(503, f"Server busy, retry later: {e}")
 
     return QueryResponse(
         answer=response.answer,
         sources=response.sources,
         confidence=response.confidence,
+        rerank=response.rerank,
+        timings=trace.breakdown() if request.include_timings else None,
     )
 
 
+@app.post("/query/batch", response_model=BatchQueryResponse)
+async def query_documents_batch(request: BatchQueryRequest):
+
+    if not request.questions:
+        raise HTTPException(400, "Questions cannot be empty")
+    if any(not q.strip() for q in request.questions):
+        raise HTTPException(400, "Question cannot be empty")
+    if len(request.questions) > settings.max_batch_questions:
+        raise HTTPException(
+            400, f"At most {settings.max_batch_questions} questions per batch"
+        )
+
+    services = await get_services()
+    try:
+        responses = await services.rag_chain.aquery_many(
+            questions=request.questions,
+            source_filter=request.source_filter,
+            chunk_type=request.chunk_type,
+        )
+    except ExecutorBusy as e:
+        raise HTTPException(503, f"Server busy, retry later: {e}")
+
+    return BatchQueryResponse(results=[
+        QueryResponse(
+            answer=r.answer,
+            sources=r.sources,
+            confidence=r.confidence,
+            rerank=r.rerank,
+        )
+        for r in responses
+    ])
+
+
+@app.post("/query/stream")
+async def query_documents_stream(request: QueryRequest):
+
+    if not request.question.strip():
+        raise HTTPException(400, "Question cannot be empty")
+
+    services = await get_services()
+
+    async def events():
+        try:
+            async for event in services.rag_chain.astream_query(
+                question=request.question,
+                source_filter=request.source_filter,
+                chunk_type=request.chunk_type,
+            ):
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        except ExecutorBusy as e:
+            error = {"type": "error", "message": f"Server busy, retry later: {e}"}
+            yield f"event: error\ndata: {json.dumps(error)}\n\n"
+
+    # Sources and confidence go out first, then answer tokens as Claude
+    # produces them (Server-Sent Events)
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
 @app.get("/sources", response_model=StatsResponse)
 async def list_sources():
+    vector_store = (await get_services()).vector_store
+    try:
+        sources, total_chunks = await query_executor.run(
+            lambda: (vector_store.source_details(), vector_store.get_doc_count())
+        )
+    except ExecutorBusy as e:
+        raise HTTPException(503, f"Server busy, retry later: {e}")
+
     return StatsResponse(
-        total_chunks=vector_store.get_doc_count(),
-        indexed_files=vector_store.list_sources(),
+        total_chunks=total_chunks,
+        indexed_files=[s["source_file"] for s in sources],
+        sources=sources,
     )
 
 
 @app.delete("/sources/{filename}")
 async def delete_source(filename: str):
-    vector_store.delete_source(filename)
+    vector_store = (await get_services()).vector_store
+    try:
+        await ingest_executor.run(vector_store.delete_source, filename)
+    except ExecutorBusy as e:
+        raise HTTPException(503, f"Server busy, retry later: {e}")
     return {"message": f"Deleted {filename} from index"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+@app.get("/health/live")
+async def liveness():
+    # The process is up and serving; says nothing about the index or model
+    return {"status": "alive"}
+
+
+@app.get("/health/ready")
+async def readiness():
+    return JSONResponse(
+        startup.status(), status_code=200 if startup.ready else 503
+    )
+
+
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "chunks_indexed": vector_store.get_doc_count()}
\ No newline at end of file
+    # Always 200 so it stays usable as a liveness check; /health/ready is
+    # the one that gates on startup
+    if not startup.ready:
+        return startup.status()
+    services = startup.get()
+    vector_store, rag_chain = services.vector_store, services.rag_chain
+    # Counting chunks and reading cache sizes hit the store and SQLite
+    try:
+        chunks, backend, embedding_caches = await query_executor.run(
+            lambda: (
+                vector_store.get_doc_count(),
+                vector_store.backend_stats(),
+                vector_store.embedder.cache_stats(),
+            )
+        )
+    except ExecutorBusy:
+        chunks, backend, embedding_caches = None, None, {}
+    return {
+        "status": "healthy",
+        "startup": startup.status()["timings_ms"],
+        "chunks_indexed": chunks,
+        "vector_backend": backend,
+        "caches": {
+            **embedding_caches,
+            "search": vector_store.cache_stats(),
+            "answers": (
+                rag_chain.answer_cache.stats()
+                if rag_chain.answer_cache is not None else None
+            ),
+        },
+        "llm": rag_chain.llm_stats(),
+        "executors": {
+            "ingest": ingest_executor.stats(),
+            "query": query_executor.stats(),
+        },
+    }
\ No newline at end of file
@@ -23,20 +23,154 @@ class Settings(BaseSettings):
 
     # Embedding
     embedding_model: str = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+    embedding_backend: str = os.getenv("EMBEDDING_BACKEND", "torch")  # torch | onnx
+    embedding_quantize: bool = (
+        os.getenv("EMBEDDING_QUANTIZE", "false").lower() == "true"
+    )
+    embedding_threads: int = int(os.getenv("EMBEDDING_THREADS", "0"))  # 0 = default
+    # Batches are packed by padded tokens (longest x count), not by count
+    embedding_batch_tokens: int = int(os.getenv("EMBEDDING_BATCH_TOKENS", "8192"))
+    embedding_max_batch_size: int = int(
+        os.getenv("EMBEDDING_MAX_BATCH_SIZE", "128")
+    )
+    # Concurrent query embeddings are coalesced into one encode call;
+    # QUERY_BATCH_MAX_WAIT_MS=0 encodes each request on its own
+    query_batch_max_wait_ms: float = float(
+        os.getenv("QUERY_BATCH_MAX_WAIT_MS", "2")
+    )
+    query_batch_max_size: int = int(os.getenv("QUERY_BATCH_MAX_SIZE", "32"))
+    onnx_model_dir: str = os.getenv("ONNX_MODEL_DIR", "./data/onnx")
+    onnx_max_drift: float = float(os.getenv("ONNX_MAX_DRIFT", "0.02"))
+    tokenization_cache_size: int = int(
+        os.getenv("TOKENIZATION_CACHE_SIZE", "50000")
+    )
+    embedding_cache_enabled: bool = (
+        os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    )
+    embedding_cache_path: str = os.getenv(
+        "EMBEDDING_CACHE_PATH", "./data/embedding_cache.db"
+    )
+    embedding_cache_max_entries: int = int(
+        os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000")
+    )
 
     # ChromaDB
     chroma_persist_dir: str = os.getenv("CHROMA_PERSIST_DIR", "./data/vectorstore")
     collection_name: str = "documents"
+    manifest_path: str = os.getenv("MANIFEST_PATH", "./data/manifest.db")
+    source_catalog_path: str = os.getenv(
+        "SOURCE_CATALOG_PATH", "./data/source_catalog.db"
+    )
+    lexical_index_path: str = os.getenv(
+        "LEXICAL_INDEX_PATH", "./data/bm25_index.npz"
+    )
+    lexical_save_interval: float = float(
+        os.getenv("LEXICAL_SAVE_INTERVAL", "5")
+    )
+
+    # Vector backend
+    # chroma | numpy | sharded
+    vector_backend: str = os.getenv("VECTOR_BACKEND", "chroma")
+    numpy_index_dir: str = os.getenv("NUMPY_INDEX_DIR", "./data/numpy_index")
+    numpy_vector_dtype: str = os.getenv("NUMPY_VECTOR_DTYPE", "int8")  # int8 | float16
+    numpy_rescore_factor: int = int(os.getenv("NUMPY_RESCORE_FACTOR", "4"))
+    numpy_ivf_lists: int = int(os.getenv("NUMPY_IVF_LISTS", "0"))  # 0 = exact
+    numpy_ivf_probe: int = int(os.getenv("NUMPY_IVF_PROBE", "8"))
+    numpy_ivf_min_rows: int = int(os.getenv("NUMPY_IVF_MIN_ROWS", "50000"))
+    # VECTOR_BACKEND=sharded: SHARD_BACKEND shards, by source hash or tenant
+    shard_backend: str = os.getenv("SHARD_BACKEND", "chroma")  # chroma | numpy
+    shard_by: str = os.getenv("SHARD_BY", "hash")  # hash | tenant
+    shard_count: int = int(os.getenv("SHARD_COUNT", "4"))
+    shard_tenant_separator: str = os.getenv("SHARD_TENANT_SEPARATOR", "__")
+    shard_search_workers: int = int(os.getenv("SHARD_SEARCH_WORKERS", "8"))
 
     # Upload
     upload_dir: str = os.getenv("UPLOAD_DIR", "./data/uploads")
 
+    # Extraction
+    # Size of the spawned process pool shared by all uploads
+    extraction_workers: int = int(os.getenv("EXTRACTION_WORKERS", "1"))
+    # Detect tables and index them as row-grouped chunks instead of flat text
+    extract_tables: bool = os.getenv("EXTRACT_TABLES", "false").lower() == "true"
+    extraction_min_pages_per_worker: int = int(
+        os.getenv("EXTRACTION_MIN_PAGES_PER_WORKER", "16")
+    )
+
     # Chunking
     chunk_size: int = int(os.getenv("CHUNK_SIZE", "500"))
     chunk_overlap: int = int(os.getenv("CHUNK_OVERLAP", "50"))
 
+    # Ingestion pipeline
+    ingest_batch_size: int = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+    ingest_queue_size: int = int(os.getenv("INGEST_QUEUE_SIZE", "4"))
+
+    # Background ingestion jobs
+    job_db_path: str = os.getenv("JOB_DB_PATH", "./data/jobs.db")
+
+    # Concurrency (API)
+    ingest_workers: int = int(os.getenv("INGEST_WORKERS", "2"))
+    ingest_queue_depth: int = int(os.getenv("INGEST_QUEUE_DEPTH", "8"))
+    query_workers: int = int(os.getenv("QUERY_WORKERS", "8"))
+    query_queue_depth: int = int(os.getenv("QUERY_QUEUE_DEPTH", "64"))
+    llm_concurrency: int = int(os.getenv("LLM_CONCURRENCY", "8"))
+    max_batch_questions: int = int(os.getenv("MAX_BATCH_QUESTIONS", "100"))
+
     # Retrieval
     top_k: int = 8
+    retrieval_mode: str = os.getenv("RETRIEVAL_MODE", "dense")  # dense | hybrid
+    hybrid_candidate_multiplier: int = int(
+        os.getenv("HYBRID_CANDIDATE_MULTIPLIER", "4")
+    )
+    rrf_k: int = int(os.getenv("RRF_K", "60"))
+    query_cache_size: int = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+    query_cache_ttl: float = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+    search_cache_size: int = int(os.getenv("SEARCH_CACHE_SIZE", "512"))
+    search_cache_ttl: float = float(os.getenv("SEARCH_CACHE_TTL", "300"))
+
+    # Adaptive top_k (opt-in): retrieve up to ADAPTIVE_MAX_K chunks and cut
+    # at the largest score drop of at least ADAPTIVE_MIN_GAP, keeping at
+    # least ADAPTIVE_MIN_K
+    adaptive_top_k: bool = os.getenv("ADAPTIVE_TOP_K", "false").lower() == "true"
+    adaptive_min_k: int = int(os.getenv("ADAPTIVE_MIN_K", "3"))
+    adaptive_max_k: int = int(os.getenv("ADAPTIVE_MAX_K", "16"))
+    adaptive_min_gap: float = float(os.getenv("ADAPTIVE_MIN_GAP", "0.05"))
+    # Questions whose best chunk has a lower cosine score get a canned
+    # no-answer without an LLM call (0 disables)
+    no_answer_score_floor: float = float(
+        os.getenv("NO_ANSWER_SCORE_FLOOR", "0")
+    )
+
+    # Reranking
+    reranker: str = os.getenv("RERANKER", "none")  # none | cross-encoder
+    reranker_model: str = os.getenv(
+        "RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    )
+    rerank_candidates: int = int(os.getenv("RERANK_CANDIDATES", "50"))
+    rerank_batch_size: int = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+    rerank_budget_ms: float = float(os.getenv("RERANK_BUDGET_MS", "300"))
+
+    # Context packing
+    context_token_budget: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+    context_dedup_threshold: float = float(
+        os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8")
+    )
+
+    # Answer cache (opt-in)
+    answer_cache_enabled: bool = (
+        os.getenv("ANSWER_CACHE_ENABLED", "false").lower() == "true"
+    )
+    answer_cache_threshold: float = float(
+        os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")
+    )
+    answer_cache_max_entries: int = int(
+        os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000")
+    )
+
+    # Startup: the API answers /health/live at once and loads the store,
+    # model and index in the background; requests wait up to
+    # STARTUP_WAIT_SECONDS for readiness before getting a 503
+    warmup_enabled: bool = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+    startup_wait_seconds: float = float(os.getenv("STARTUP_WAIT_SECONDS", "30"))
 
     # LLM
     llm_provider: str = "anthropic"
@@ -0,0 +1,117 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from loguru import logger
+
+
+# Persistent content-addressed store of float32 vectors keyed by
+# hash(model name, text). Backed by SQLite so it survives restarts and is
+# safe to share between the API and the Streamlit process.
+class EmbeddingCache:
+    _BATCH = 500  # stay under SQLite's bound-parameter limit
+
+    def __init__(self, path: str, max_entries: int):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, "
+            "last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_used "
+            "ON embeddings(last_used)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def key(model_name: str, text: str) -> str:
+        return hashlib.sha256(
+            f"{model_name}\0{text}".encode("utf-8")
+        ).hexdigest()
+
+    def get_many(
+        self, keys: list[str], touch: bool = True
+    ) -> dict[str, np.ndarray]:
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        now = time.time()
+
+        with self._lock:
+            for i in range(0, len(unique), self._BATCH):
+                batch = unique[i:i + self._BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings "
+                    f"WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+
+            if found and touch:
+                # Touch hits so eviction is least-recently-used
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, k) for k in found],
+                )
+                self._conn.commit()
+
+            hits = sum(1 for k in keys if k in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+
+        return found
+
+    def put_many(self, items: dict[str, np.ndarray]) -> None:
+        if not items:
+            return
+        now = time.time()
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) "
+                "VALUES (?, ?, ?)",
+                [
+                    (k, np.asarray(v, dtype=np.float32).tobytes(), now)
+                    for k, v in items.items()
+                ],
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        size = self._conn.execute(
+            "SELECT COUNT(*) FROM embeddings"
+        ).fetchone()[0]
+        excess = size - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN ("
+                "SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            logger.debug(f"Embedding cache evicted {excess} entries")
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._conn.execute(
+                "SELECT COUNT(*) FROM embeddings"
+            ).fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
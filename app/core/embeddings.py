@@ -1,32 +1,308 @@
-from sentence_transformers import SentenceTransformer
+import asyncio
+import threading
+import time
+import numpy as np
 from loguru import logger
 from app.core.config import settings
+from app.core.cache import TTLCache, normalize_query
+from app.core.embedding_cache import EmbeddingCache
+from app.core.micro_batcher import MicroBatcher
+from app.core.tracing import cache_events, span
+
+
+# Torch path length estimate. English prose averages ~4 characters per
+# token and tables fewer; erring low overestimates tokens, which only makes
+# batches smaller.
+_CHARS_PER_TOKEN = 3
 
 
 class EmbeddingModel:
     _instance = None  # Singleton — model loads once
+    _load_lock = threading.Lock()
 
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
             cls._instance._model = None
+            cls._instance._cache = None
+            cls._instance._query_batcher = None
+            # Set when the ONNX backend failed to load and torch is used
+            cls._instance._onnx_fallback = False
+            cls._instance._query_cache = TTLCache(
+                max_size=settings.query_cache_size,
+                ttl_seconds=settings.query_cache_ttl,
+            )
         return cls._instance
 
     @property
-    def model(self) -> SentenceTransformer:
+    def model(self):
         if self._model is None:
-            logger.info(f"Loading embedding model: {settings.embedding_model}")
-            self._model = SentenceTransformer(settings.embedding_model)
-            logger.info("Embedding model loaded successfully")
+            with self._load_lock:
+                if self._model is None:
+                    logger.info(
+                        f"Loading embedding model: {settings.embedding_model} "
+                        f"({self.backend})"
+                    )
+                    self._model = self._load_model()
+                    logger.info("Embedding model loaded successfully")
         return self._model
 
-    def embed_texts(self, texts: list[str]) -> list[list[float]]:
-        embeddings = self.model.encode(
-            texts,
-            show_progress_bar=True,
-            batch_size=32,
+    @property
+    def backend(self) -> str:
+        if self._onnx_fallback:
+            return "torch"
+        if settings.embedding_backend == "onnx":
+            return "onnx-int8" if settings.embedding_quantize else "onnx"
+        return settings.embedding_backend
+
+    @property
+    def model_id(self) -> str:
+        # Cache key prefix: ONNX/int8 vectors differ slightly from torch ones.
+        # Loading first settles whether ONNX fell back to torch.
+        if settings.embedding_backend != "torch":
+            _ = self.model
+        if self.backend == "torch":
+            return settings.embedding_model
+        return f"{settings.embedding_model}@{self.backend}"
+
+    def _load_model(self):
+        if settings.embedding_backend == "onnx":
+            try:
+                from app.core import onnx_encoder
+                return onnx_encoder.load(
+                    settings.embedding_model,
+                    root=settings.onnx_model_dir,
+                    quantize=settings.embedding_quantize,
+                    threads=settings.embedding_threads,
+                    max_drift=settings.onnx_max_drift,
+                    tokenization_cache_size=settings.tokenization_cache_size,
+                )
+            except Exception as e:
+                # Missing onnxruntime, a failed export or too much drift
+                logger.warning(
+                    f"ONNX embedding backend unavailable, using torch: {e}"
+                )
+                self._onnx_fallback = True
+        elif settings.embedding_backend != "torch":
+            raise ValueError(
+                f"Unknown embedding backend '{settings.embedding_backend}'. "
+                f"Choose one of: torch, onnx"
+            )
+
+        # Imported here so importing this module doesn't pull in torch
+        from sentence_transformers import SentenceTransformer
+        if settings.embedding_threads:
+            import torch
+            torch.set_num_threads(settings.embedding_threads)
+        return SentenceTransformer(settings.embedding_model)
+
+    @property
+    def cache(self) -> EmbeddingCache | None:
+        if self._cache is None and settings.embedding_cache_enabled:
+            with self._load_lock:
+                if self._cache is None:
+                    self._cache = EmbeddingCache(
+                        path=settings.embedding_cache_path,
+                        max_entries=settings.embedding_cache_max_entries,
+                    )
+        return self._cache
+
+    def embed_texts(
+        self, texts: list[str], write_cache: bool = True
+    ) -> list[list[float]]:
+        cache = self.cache
+        if cache is None:
+            return self._encode(texts).tolist()
+
+        keys = [cache.key(self.model_id, t) for t in texts]
+        # Without write_cache the lookup is read-only too, so processes that
+        # share the file with a writer never take SQLite's write lock
+        found = cache.get_many(keys, touch=write_cache)
+
+        # Encode each distinct missing text once
+        missing = {k: t for k, t in zip(keys, texts) if k not in found}
+        if missing:
+            encoded = self._encode(list(missing.values()))
+            computed = dict(zip(missing.keys(), encoded))
+            if write_cache:
+                cache.put_many(computed)
+            found.update(computed)
+
+        cache_events.inc(len(texts) - len(missing), cache="embedding", result="hit")
+        cache_events.inc(len(missing), cache="embedding", result="miss")
+        logger.info(
+            f"Embedding cache: {len(texts) - len(missing)} hits, "
+            f"{len(missing)} encoded"
         )
-        return embeddings.tolist()
+        return [found[k].tolist() for k in keys]
 
     def embed_query(self, query: str) -> list[float]:
-        return self.model.encode(query).tolist()
\ No newline at end of file
+        key = normalize_query(query)
+        embedding = self._query_cache.get(key)
+        cache_events.inc(
+            cache="query_embedding", result="miss" if embedding is None else "hit"
+        )
+        if embedding is None:
+            with span("embed_query", batch_size=1):
+                embedding = self._encode_queries([query])[0]
+            self._query_cache.set(key, embedding)
+        return embedding
+
+    async def aembed_query(self, query: str) -> list[float]:
+        key = normalize_query(query)
+        embedding = self._query_cache.get(key)
+        cache_events.inc(
+            cache="query_embedding", result="miss" if embedding is None else "hit"
+        )
+        if embedding is None:
+            with span("embed_query", batch_size=1):
+                batcher = self.query_batcher
+                if batcher is not None:
+                    embedding = await batcher.arun(query)
+                else:
+                    embedding = await asyncio.to_thread(
+                        lambda: self._encode_queries([query])[0]
+                    )
+            self._query_cache.set(key, embedding)
+        return embedding
+
+    def embed_queries(self, queries: list[str]) -> list[list[float]]:
+        keys = [normalize_query(q) for q in queries]
+        found = {}
+        missing = {}
+        for key, query in zip(keys, queries):
+            embedding = self._query_cache.get(key)
+            if embedding is not None:
+                found[key] = embedding
+            else:
+                missing.setdefault(key, query)
+
+        cache_events.inc(len(found), cache="query_embedding", result="hit")
+        cache_events.inc(len(missing), cache="query_embedding", result="miss")
+        if missing:
+            with span("embed_query", batch_size=len(missing)):
+                encoded = self._encode_queries(list(missing.values()))
+            for key, embedding in zip(missing, encoded):
+                self._query_cache.set(key, embedding)
+                found[key] = embedding
+
+        return [found[k] for k in keys]
+
+    @property
+    def query_batcher(self) -> MicroBatcher | None:
+        if self._query_batcher is None and settings.query_batch_max_wait_ms > 0:
+            with self._load_lock:
+                if self._query_batcher is None:
+                    self._query_batcher = MicroBatcher(
+                        "query-embedding",
+                        self._encode_query_batch,
+                        max_batch=settings.query_batch_max_size,
+                        max_wait_ms=settings.query_batch_max_wait_ms,
+                    )
+        return self._query_batcher
+
+    def _encode_queries(self, queries: list[str]) -> list[list[float]]:
+        # Concurrent requests share one forward pass through the batcher
+        batcher = self.query_batcher
+        if batcher is None:
+            return self._encode_query_batch(queries)
+        return batcher.run_many(queries)
+
+    def _encode_query_batch(self, queries: list[str]) -> list[list[float]]:
+        with span("embed_query_batch", batch_size=len(queries)):
+            return self._encode_bucketed(queries).tolist()
+
+    def warm_up(self) -> None:
+        # Load the model and push one text through the same path real
+        # encodes take, so the first request doesn't pay for it
+        self._encode_bucketed(["warm-up query"])
+
+    def cache_stats(self) -> dict:
+        cache = self.cache
+        return {
+            "embeddings": cache.stats() if cache is not None else None,
+            "queries": self._query_cache.stats(),
+            "query_batcher": (
+                self._query_batcher.stats()
+                if self._query_batcher is not None else None
+            ),
+            "tokenization": (
+                self._model.cache_stats()
+                if hasattr(self._model, "cache_stats") else None
+            ),
+        }
+
+    def _encode(self, texts: list[str]) -> np.ndarray:
+        with span("embed", batch_size=len(texts)) as current:
+            embeddings = self._encode_bucketed(texts, current)
+        return embeddings
+
+    def _encode_bucketed(self, texts: list[str], current=None) -> np.ndarray:
+        # Longest first, so each batch pads to roughly its own length, then
+        # fill batches up to the padded-token budget. Output keeps input order.
+        model = self.model
+        if not texts:
+            dim = model.get_sentence_embedding_dimension()
+            return np.empty((0, dim), dtype=np.float32)
+        start = time.perf_counter()
+        lengths = self._token_lengths(texts)
+        order = sorted(range(len(texts)), key=lambda i: lengths[i], reverse=True)
+
+        output = np.empty(
+            (len(texts), model.get_sentence_embedding_dimension()), dtype=np.float32
+        )
+        padded = 0
+        batches = 0
+        i = 0
+        while i < len(order):
+            longest = max(lengths[order[i]], 1)
+            size = max(1, min(
+                settings.embedding_max_batch_size,
+                settings.embedding_batch_tokens // longest,
+            ))
+            batch = order[i:i + size]
+            encoded = model.encode(
+                [texts[j] for j in batch],
+                batch_size=len(batch),
+                show_progress_bar=False,
+                convert_to_numpy=True,
+            ).astype(np.float32)
+            output[batch] = encoded
+            padded += longest * len(batch)
+            batches += 1
+            i += size
+
+        elapsed = time.perf_counter() - start
+        tokens = sum(lengths)
+        tokens_per_s = tokens / elapsed if elapsed > 0 else 0.0
+        # Torch path lengths come from the character estimate, not the
+        # tokenizer, and are reported as such
+        estimated = not hasattr(model, "token_lengths")
+        unit = "est. tokens" if estimated else "tokens"
+        # Query batches are encoded per request, so they only log at debug
+        logger.log(
+            "INFO" if current is not None else "DEBUG",
+            f"Embedded {len(texts)} texts in {batches} batches: "
+            f"{'~' if estimated else ''}{tokens} {unit} "
+            f"({padded - tokens} padding) at {tokens_per_s:.0f} {unit}/s"
+        )
+        if current is not None:
+            current.set(
+                tokens=tokens,
+                padding=padded - tokens,
+                batches=batches,
+                tokens_per_s=round(tokens_per_s),
+                tokens_estimated=estimated,
+            )
+        return output
+
+    def _token_lengths(self, texts: list[str]) -> list[int]:
+        model = self.model
+        if hasattr(model, "token_lengths"):
+            return model.token_lengths(texts)  # cached on the ONNX path
+        # SentenceTransformer.encode tokenizes on its own, so estimate from
+        # the character count rather than tokenizing every text twice
+        limit = model.max_seq_length
+        return [
+            min(limit, len(text) // _CHARS_PER_TOKEN + 2) for text in texts
+        ]
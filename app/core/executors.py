@@ -0,0 +1,69 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+from app.core.config import settings
+
+
+class ExecutorBusy(Exception):
+    pass
+
+
+# Thread pool with a hard cap on running + queued work. Blocking calls
+# (pdfplumber, SentenceTransformer, Chroma) go through one of these so they
+# never run on the event loop, and a burst of uploads is rejected instead
+# of piling up behind the query path.
+class BoundedExecutor:
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=name
+        )
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        if not self._slots.acquire(blocking=False):
+            raise ExecutorBusy(
+                f"{self.name} executor is full "
+                f"({self.max_workers} running, {self.max_queue} queued)"
+            )
+        with self._lock:
+            self._in_flight += 1
+
+        # Carry context variables (e.g. request-scoped state) into the worker
+        ctx = contextvars.copy_context()
+        try:
+            future = self._pool.submit(ctx.run, fn, *args, **kwargs)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def _release(self, _future) -> None:
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self._in_flight,
+        }
+
+
+ingest_executor = BoundedExecutor(
+    "ingest", settings.ingest_workers, settings.ingest_queue_depth
+)
+query_executor = BoundedExecutor(
+    "query", settings.query_workers, settings.query_queue_depth
+)
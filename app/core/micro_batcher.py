@@ -0,0 +1,102 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable
+from loguru import logger
+
+
+# Coalesces concurrent single-item calls into one batched call. The first
+# item to arrive opens a batch; it closes after max_wait_ms or once it holds
+# max_batch items, and a single worker thread runs fn over it. Callers block
+# on a Future (threads) or await it (asyncio).
+class MicroBatcher:
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[[list], list],
+        max_batch: int,
+        max_wait_ms: float,
+    ):
+        self.name = name
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self._queue: queue.Queue[tuple[Any, Future]] = queue.Queue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._largest = 0
+
+    def submit(self, item: Any) -> Future:
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def run(self, item: Any) -> Any:
+        return self.submit(item).result()
+
+    def run_many(self, items: list) -> list:
+        futures = [self.submit(item) for item in items]
+        return [f.result() for f in futures]
+
+    async def arun(self, item: Any) -> Any:
+        return await asyncio.wrap_future(self.submit(item))
+
+    def stats(self) -> dict:
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait_ms,
+            "batches": self._batches,
+            "items": self._items,
+            "avg_batch": (
+                round(self._items / self._batches, 2) if self._batches else 0.0
+            ),
+            "largest_batch": self._largest,
+            "pending": self._queue.qsize(),
+        }
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None:
+            with self._start_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(
+                        target=self._loop, name=f"{self.name}-batcher", daemon=True
+                    )
+                    self._worker.start()
+
+    def _loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                try:
+                    if remaining > 0:
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._run_batch(batch)
+
+    def _run_batch(self, batch: list[tuple[Any, Future]]) -> None:
+        # Skip callers that gave up (e.g. a cancelled asyncio task)
+        batch = [(item, f) for item, f in batch if f.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        self._batches += 1
+        self._items += len(batch)
+        self._largest = max(self._largest, len(batch))
+        try:
+            results = self.fn([item for item, _ in batch])
+        except Exception as e:
+            logger.error(f"{self.name} batch of {len(batch)} failed: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
@@ -0,0 +1,300 @@
+import argparse
+import inspect
+import json
+import os
+import numpy as np
+from loguru import logger
+from app.core.cache import TTLCache
+
+# Short mixed-content sample used to measure drift from the torch model
+PARITY_SAMPLE = [
+    "What was total net sales for fiscal 2024?",
+    "Total net sales were $391,035 million, up 2% year over year.",
+    "iPhone | 201,183 | 200,583 | 205,489",
+    "The Company is exposed to credit risk on its trade accounts receivable.",
+    "Research and development expense increased due to headcount-related costs.",
+    "Risk Factors",
+    "Gross margin percentage was 46.2% compared to 44.1% in 2023.",
+    "The effective tax rate includes a one-time charge related to the "
+    "State Aid Decision by the European Commission.",
+]
+
+
+def export_dir_for(model_name: str, root: str) -> str:
+    return os.path.join(root, model_name.strip("/").replace("/", "__"))
+
+
+def cosine_drift(reference: np.ndarray, candidate: np.ndarray) -> dict:
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    cosines = np.sum(reference * candidate, axis=1)
+    return {
+        "mean_cosine": round(float(cosines.mean()), 6),
+        "min_cosine": round(float(cosines.min()), 6),
+        "max_drift": round(float(1 - cosines.min()), 6),
+    }
+
+
+# Drop-in for the subset of SentenceTransformer that EmbeddingModel uses
+# (encode, tokenizer, max_seq_length, get_sentence_embedding_dimension),
+# running the exported transformer on ONNX Runtime. Pooling and
+# normalization are replayed in NumPy from the exported config.
+# Tokenization is cached per text, since re-ingests and repeated queries
+# see the same strings.
+class OnnxEncoder:
+    def __init__(
+        self,
+        export_dir: str,
+        quantized: bool = False,
+        threads: int = 0,
+        tokenization_cache_size: int = 50000,
+    ):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(export_dir, "config.json")) as f:
+            self.config = json.load(f)
+        self.quantized = quantized
+        self.max_seq_length = self.config["max_seq_length"]
+        self.tokenizer = AutoTokenizer.from_pretrained(export_dir)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        model_file = "model-int8.onnx" if quantized else "model.onnx"
+        self.session = ort.InferenceSession(
+            os.path.join(export_dir, model_file),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+        self._input_names = {i.name for i in self.session.get_inputs()}
+        self._token_cache = TTLCache(
+            max_size=tokenization_cache_size, ttl_seconds=float("inf")
+        )
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dim"]
+
+    def tokenize(self, texts: list[str]) -> list[list[int]]:
+        ids = [self._token_cache.get(t) for t in texts]
+        missing = list(dict.fromkeys(t for t, i in zip(texts, ids) if i is None))
+        if missing:
+            encoded = self.tokenizer(
+                missing, truncation=True, max_length=self.max_seq_length
+            )["input_ids"]
+            fresh = dict(zip(missing, encoded))
+            for text, token_ids in fresh.items():
+                self._token_cache.set(text, token_ids)
+            ids = [i if i is not None else fresh[t] for t, i in zip(texts, ids)]
+        return ids
+
+    def token_lengths(self, texts: list[str]) -> list[int]:
+        return [len(ids) for ids in self.tokenize(texts)]
+
+    def encode(
+        self,
+        sentences: str | list[str],
+        batch_size: int = 32,
+        show_progress_bar: bool = False,
+        convert_to_numpy: bool = True,
+        **kwargs,
+    ) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        token_ids = self.tokenize(texts)
+
+        output = np.empty((len(texts), self.config["dim"]), dtype=np.float32)
+        for i in range(0, len(texts), batch_size):
+            output[i:i + batch_size] = self._run(token_ids[i:i + batch_size])
+        return output[0] if single else output
+
+    def cache_stats(self) -> dict:
+        return self._token_cache.stats()
+
+    def _run(self, batch: list[list[int]]) -> np.ndarray:
+        length = max(len(ids) for ids in batch)
+        input_ids = np.full(
+            (len(batch), length), self.tokenizer.pad_token_id, dtype=np.int64
+        )
+        attention_mask = np.zeros((len(batch), length), dtype=np.int64)
+        for row, ids in enumerate(batch):
+            input_ids[row, :len(ids)] = ids
+            attention_mask[row, :len(ids)] = 1
+
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        hidden = self.session.run(None, feeds)[0]
+
+        if self.config["pooling"] == "cls":
+            pooled = hidden[:, 0]
+        else:
+            mask = attention_mask[:, :, None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(
+                mask.sum(axis=1), 1e-9, None
+            )
+        if self.config["normalize"]:
+            pooled = pooled / np.clip(
+                np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None
+            )
+        return pooled.astype(np.float32)
+
+
+def _pooling_mode(config: dict) -> str | None:
+    # Newer sentence-transformers store a single "pooling_mode" string
+    if "pooling_mode" in config:
+        return config["pooling_mode"]
+    if config.get("pooling_mode_cls_token"):
+        return "cls"
+    if config.get("pooling_mode_mean_tokens"):
+        return "mean"
+    return None
+
+
+def _HiddenStates(model, input_names: list[str]):
+    # Positional forward() with fixed input names; transformers' own
+    # signature order varies between versions
+    import torch
+
+    class HiddenStates(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs)))[0]
+
+    return HiddenStates()
+
+
+def export(model_name: str, export_dir: str, quantize: bool) -> dict:
+    # Needs torch + sentence-transformers once; later loads only read the
+    # exported files.
+    import torch
+    from sentence_transformers import SentenceTransformer, models
+
+    reference = SentenceTransformer(model_name, device="cpu")
+    modules = list(reference)
+    if len(modules) < 2 or not isinstance(modules[1], models.Pooling):
+        raise ValueError(f"{model_name} has no pooling layer to replay")
+    pooling = _pooling_mode(modules[1].get_config_dict())
+    if pooling not in ("mean", "cls"):
+        raise ValueError(f"Unsupported pooling mode for ONNX export: {pooling}")
+
+    os.makedirs(export_dir, exist_ok=True)
+    fp32_path = os.path.join(export_dir, "model.onnx")
+    if not os.path.exists(fp32_path):
+        logger.info(f"Exporting {model_name} to ONNX at {export_dir}")
+        sample = reference.tokenizer(["export sample"], return_tensors="pt")
+        input_names = [
+            name for name in ("input_ids", "attention_mask", "token_type_ids")
+            if name in sample
+        ]
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+        dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+        transformer = _HiddenStates(modules[0].auto_model.eval(), input_names)
+        # Newer torch defaults to the dynamo exporter, which ignores
+        # dynamic_axes; releases before 2.5 only have the TorchScript one
+        # and reject the keyword
+        options = {}
+        if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+            options["dynamo"] = False
+        with torch.no_grad():
+            torch.onnx.export(
+                transformer,
+                tuple(sample[name] for name in input_names),
+                fp32_path,
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic_axes,
+                opset_version=17,
+                **options,
+            )
+        reference.tokenizer.save_pretrained(export_dir)
+
+    int8_path = os.path.join(export_dir, "model-int8.onnx")
+    if quantize and not os.path.exists(int8_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        logger.info("Quantizing ONNX model weights to int8")
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+
+    config_path = os.path.join(export_dir, "config.json")
+    config = {}
+    if os.path.exists(config_path):
+        with open(config_path) as f:
+            config = json.load(f)
+    config.update({
+        "model_name": model_name,
+        "pooling": pooling,
+        "normalize": any(isinstance(m, models.Normalize) for m in modules),
+        "max_seq_length": reference.max_seq_length,
+        "dim": reference.get_sentence_embedding_dimension(),
+    })
+    with open(config_path, "w") as f:
+        json.dump(config, f, indent=2)
+
+    # Parity against the torch model, recorded per variant
+    expected = reference.encode(PARITY_SAMPLE, convert_to_numpy=True)
+    variants = ["fp32", "int8"] if quantize else ["fp32"]
+    for variant in variants:
+        candidate = OnnxEncoder(export_dir, quantized=variant == "int8")
+        drift = cosine_drift(expected, candidate.encode(PARITY_SAMPLE))
+        config.setdefault("parity", {})[variant] = drift
+        logger.info(f"ONNX {variant} parity vs torch: {drift}")
+    with open(config_path, "w") as f:
+        json.dump(config, f, indent=2)
+    return config
+
+
+def load(
+    model_name: str,
+    root: str,
+    quantize: bool = False,
+    threads: int = 0,
+    max_drift: float = 0.02,
+    tokenization_cache_size: int = 50000,
+) -> OnnxEncoder:
+    export_dir = export_dir_for(model_name, root)
+    variant = "int8" if quantize else "fp32"
+    config_path = os.path.join(export_dir, "config.json")
+
+    config = None
+    if os.path.exists(config_path):
+        with open(config_path) as f:
+            config = json.load(f)
+    if config is None or variant not in config.get("parity", {}):
+        config = export(model_name, export_dir, quantize)
+
+    drift = config["parity"][variant]["max_drift"]
+    if drift > max_drift:
+        raise ValueError(
+            f"ONNX {variant} drift {drift} exceeds the allowed {max_drift}"
+        )
+    return OnnxEncoder(
+        export_dir,
+        quantized=quantize,
+        threads=threads,
+        tokenization_cache_size=tokenization_cache_size,
+    )
+
+
+def main():
+    # python -m app.core.onnx_encoder [--quantize]: export and print parity
+    from app.core.config import settings
+
+    parser = argparse.ArgumentParser(description="Export the embedding model to ONNX")
+    parser.add_argument("--model", default=settings.embedding_model)
+    parser.add_argument("--quantize", action="store_true")
+    parser.add_argument("--output", default=settings.onnx_model_dir)
+    args = parser.parse_args()
+
+    config = export(
+        args.model, export_dir_for(args.model, args.output), args.quantize
+    )
+    print(json.dumps(config["parity"], indent=2))
+
+
+if __name__ == "__main__":
+    main()
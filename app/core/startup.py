@@ -0,0 +1,106 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+from loguru import logger
+from app.core.tracing import startup_seconds
+
+# Set when this module is first imported, which the API does before its
+# heavier imports, so mark() can time them
+_IMPORTED_AT = time.perf_counter()
+
+
+class NotReady(Exception):
+    pass
+
+
+# Runs the expensive part of process startup (opening the store, loading
+# models, warm-up) on a background thread so the server can accept
+# connections and answer liveness probes immediately. Each phase's duration
+# is kept for /health/ready and exported as rag_startup_seconds{phase}.
+class Startup:
+    def __init__(self):
+        self.timings_ms: dict[str, float] = {}
+        self._last_mark = _IMPORTED_AT
+        self._phase = None
+        self._done = threading.Event()
+        self._finished = Future()  # mirrors _done for async waiters
+        self._thread = None
+        self._result = None
+        self._error = None
+
+    def mark(self, name: str) -> None:
+        # Records the time since the previous mark (or this module's import)
+        now = time.perf_counter()
+        self._record(name, now - self._last_mark)
+        self._last_mark = now
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        self._phase = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, time.perf_counter() - start)
+
+    def start(self, build: Callable[["Startup"], Any]) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, args=(build,), name="startup", daemon=True
+            )
+            self._thread.start()
+
+    @property
+    def ready(self) -> bool:
+        return self._done.is_set() and self._error is None
+
+    def get(self, timeout: float = 0) -> Any:
+        if not self._done.wait(timeout):
+            raise NotReady(f"Service is starting up ({self._phase})")
+        if self._error is not None:
+            raise NotReady(f"Startup failed: {self._error}")
+        return self._result
+
+    async def aget(self, timeout: float = 0) -> Any:
+        # Like get(), but waits on the event loop instead of holding a thread
+        if not self._done.is_set():
+            try:
+                await asyncio.wait_for(
+                    asyncio.shield(asyncio.wrap_future(self._finished)), timeout
+                )
+            except asyncio.TimeoutError:
+                pass
+        return self.get()
+
+    def status(self) -> dict:
+        if not self._done.is_set():
+            status = "starting"
+        else:
+            status = "failed" if self._error is not None else "ready"
+        return {
+            "status": status,
+            "phase": self._phase if status == "starting" else None,
+            "error": self._error,
+            "timings_ms": dict(self.timings_ms),
+        }
+
+    def _run(self, build: Callable[["Startup"], Any]) -> None:
+        start = time.perf_counter()
+        try:
+            self._result = build(self)
+        except Exception as e:
+            logger.exception(f"Startup failed in phase {self._phase}: {e}")
+            self._error = str(e)
+        else:
+            self._record("total", time.perf_counter() - start)
+        finally:
+            self._done.set()
+            self._finished.set_result(None)
+
+    def _record(self, name: str, seconds: float) -> None:
+        self.timings_ms[name] = round(seconds * 1000, 1)
+        startup_seconds.set(seconds, phase=name)
+        logger.info(f"Startup phase {name}: {seconds * 1000:.0f}ms")
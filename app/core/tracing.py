@@ -0,0 +1,232 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterator
+
+# Latency buckets in seconds, from sub-millisecond cache hits to slow LLM calls
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0, 30.0,
+)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in key + extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self, name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        # label key -> (per-bucket counts incl. +Inf, sum, count)
+        self._values: dict[tuple, tuple[list[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            counts, total, n = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0.0, 0)
+            )
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value, n + 1)
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            for key, (counts, total, n) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    lines.append(
+                        f"{self.name}_bucket"
+                        f"{_format_labels(key, (('le', bound),))} {cumulative}"
+                    )
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {n}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, Counter | Gauge | Histogram] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._register(name, lambda: Counter(name, help_text))
+
+    def gauge(self, name: str, help_text: str) -> Gauge:
+        return self._register(name, lambda: Gauge(name, help_text))
+
+    def histogram(
+        self, name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(name, lambda: Histogram(name, help_text, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for m in metrics for line in m.render()) + "\n"
+
+    def _register(self, name: str, factory):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = factory()
+            return self._metrics[name]
+
+
+metrics = MetricsRegistry()
+
+stage_seconds = metrics.histogram(
+    "rag_stage_duration_seconds", "Time spent in each pipeline stage"
+)
+stage_items = metrics.histogram(
+    "rag_stage_batch_size", "Items handled per stage call", SIZE_BUCKETS
+)
+llm_tokens = metrics.counter("rag_llm_tokens_total", "LLM tokens by kind")
+cache_events = metrics.counter(
+    "rag_cache_events_total", "Cache lookups by cache and result"
+)
+shard_seconds = metrics.histogram(
+    "rag_shard_search_seconds", "Vector search time per shard"
+)
+llm_skipped = metrics.counter(
+    "rag_llm_calls_skipped_total", "LLM calls avoided by early exits, by reason"
+)
+llm_seconds_saved = metrics.counter(
+    "rag_llm_seconds_saved_total",
+    "LLM latency avoided by early exits, estimated from the mean LLM call",
+)
+startup_seconds = metrics.gauge(
+    "rag_startup_seconds", "Time spent in each startup phase"
+)
+
+
+@dataclass
+class Span:
+    name: str
+    start: float
+    duration_ms: float = 0.0
+    attrs: dict = field(default_factory=dict)
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+
+# Spans recorded while handling one request. Stored in a context variable,
+# so work submitted through BoundedExecutor (which copies the context)
+# reports into the same trace.
+@dataclass
+class Trace:
+    start: float = field(default_factory=time.perf_counter)
+    spans: list[Span] = field(default_factory=list)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def breakdown(self) -> dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        return {
+            "total_ms": round((time.perf_counter() - self.start) * 1000, 2),
+            "spans": [
+                {
+                    "name": s.name,
+                    "offset_ms": round((s.start - self.start) * 1000, 2),
+                    "duration_ms": round(s.duration_ms, 2),
+                    **s.attrs,
+                }
+                for s in spans
+            ],
+        }
+
+
+_current_trace: contextvars.ContextVar[Trace | None] = contextvars.ContextVar(
+    "current_trace", default=None
+)
+
+
+@contextmanager
+def start_trace() -> Iterator[Trace]:
+    trace = Trace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Span]:
+    current = Span(name=name, start=time.perf_counter(), attrs=attrs)
+    try:
+        yield current
+    finally:
+        record(current, time.perf_counter() - current.start)
+
+
+def record(current: Span, seconds: float) -> None:
+    # For stages that can't be wrapped in a with-block (e.g. generators)
+    current.duration_ms = seconds * 1000
+    stage_seconds.observe(seconds, stage=current.name)
+    items = current.attrs.get("batch_size")
+    if items is not None:
+        stage_items.observe(items, stage=current.name)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(current)
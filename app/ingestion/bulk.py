@@ -0,0 +1,329 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import queue
+import time
+from multiprocessing import resource_tracker, shared_memory
+from pathlib import Path
+import numpy as np
+from loguru import logger
+from app.core.config import settings
+from app.ingestion.chunker import Chunk, DocumentChunker
+from app.ingestion.pdf_processor import PDFProcessor
+from app.ingestion.pipeline import record_partial
+
+# Bulk backfill: python -m app.ingestion.bulk <pdfs or dirs> [--workers N]
+#
+# Each worker process loads the embedding model once (intra-op threads
+# pinned to --threads) and takes whole files off a task queue: extract,
+# chunk the pages whose hash changed, embed. Embedding batches are written
+# into shared-memory buffers and only their names travel over the result
+# queue. The parent is the single writer: it batches upserts into the
+# vector store and BM25 index, fills the embedding cache, then updates the
+# manifest and removes stale chunks per file, exactly as IngestionPipeline
+# does for one upload. A file that fails after some of its chunks were
+# stored gets a partial manifest entry, so the next run re-indexes those
+# pages. Workers only read the embedding cache, without LRU touches.
+#
+# Stop the API first on VECTOR_BACKEND=numpy: the index takes a writer
+# lock per process, and the backfill refuses to start while it is held.
+
+
+def _worker(
+    task_q: mp.Queue, result_q: mp.Queue, threads: int, batch_size: int
+) -> None:
+    from app.core.embeddings import EmbeddingModel
+    from app.ingestion.pipeline import file_hash, page_hash
+    from app.retrieval.manifest import SourceManifest
+
+    settings.embedding_threads = threads
+    settings.query_batch_max_wait_ms = 0
+    embedder = EmbeddingModel()
+    _ = embedder.model
+
+    manifest = SourceManifest(settings.manifest_path)
+    chunker = DocumentChunker(settings.chunk_size, settings.chunk_overlap)
+
+    def send(file_name: str, chunks: list[Chunk]) -> float:
+        start = time.perf_counter()
+        # The parent writes new vectors to the cache once they are stored
+        embeddings = np.asarray(
+            embedder.embed_texts([c.text for c in chunks], write_cache=False),
+            dtype=np.float32,
+        )
+        elapsed = time.perf_counter() - start
+        shm = shared_memory.SharedMemory(create=True, size=embeddings.nbytes)
+        np.ndarray(embeddings.shape, np.float32, buffer=shm.buf)[:] = embeddings
+        shm.close()
+        # Hand the segment to the parent, which registers it on attach and
+        # unregisters it on unlink. Dropping this process's registration
+        # first keeps the resource tracker from reporting it as leaked.
+        resource_tracker.unregister(shm._name, "shared_memory")
+        result_q.put((
+            "batch", file_name, chunks,
+            (shm.name, embeddings.shape, embedder.model_id),
+        ))
+        return elapsed
+
+    while True:
+        file_path = task_q.get()
+        if file_path is None:
+            return
+        file_name = Path(file_path).name
+        try:
+            previous = manifest.get_pages(file_name)
+            current: dict[int, tuple[str, list[str]]] = {}
+            pending: list[Chunk] = []
+            stats = {"pages": 0, "pages_unchanged": 0, "chunks": 0, "embed_s": 0.0}
+            for page in PDFProcessor.iter_pages(file_path, workers=1):
+                stats["pages"] += 1
+                new_hash = page_hash(page, chunker)
+                old = previous.get(page.page_number)
+                if old is not None and old[0] == new_hash:
+                    current[page.page_number] = old
+                    stats["pages_unchanged"] += 1
+                    continue
+
+                chunks = chunker.chunk_page(page)
+                current[page.page_number] = (
+                    new_hash, [c.chunk_id for c in chunks]
+                )
+                pending.extend(chunks)
+                while len(pending) >= batch_size:
+                    stats["embed_s"] += send(file_name, pending[:batch_size])
+                    stats["chunks"] += batch_size
+                    pending = pending[batch_size:]
+            if pending:
+                stats["embed_s"] += send(file_name, pending)
+                stats["chunks"] += len(pending)
+            result_q.put(
+                ("done", file_name, (current, file_hash(file_path)), stats)
+            )
+        except Exception as e:
+            logger.error(f"Bulk ingest of {file_name} failed: {e}")
+            result_q.put(("failed", file_name, str(e), None))
+
+
+def _read_batch(name: str, shape: tuple) -> np.ndarray:
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, np.float32, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def discover(paths: list[str]) -> list[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(str(p) for p in Path(path).rglob("*.pdf")))
+        elif path.lower().endswith(".pdf"):
+            files.append(path)
+        else:
+            logger.warning(f"Skipping {path}: not a PDF or directory")
+    return files
+
+
+def run_bulk(
+    paths: list[str],
+    workers: int = None,
+    threads: int = 1,
+    batch_size: int = None,
+    write_batch: int = 1024,
+) -> dict:
+    from app.core.embedding_cache import EmbeddingCache
+    from app.retrieval.vector_store import VectorStore
+
+    files = discover(paths)
+    threads = max(1, threads)
+    workers = workers or max(1, (os.cpu_count() or 1) // threads)
+    batch_size = batch_size or settings.ingest_batch_size
+    if not files:
+        return {"files": 0, "failed": []}
+
+    store = VectorStore()
+    cache = (
+        EmbeddingCache(
+            settings.embedding_cache_path, settings.embedding_cache_max_entries
+        )
+        if settings.embedding_cache_enabled else None
+    )
+    ctx = mp.get_context("spawn")  # torch and fork don't mix
+    task_q = ctx.Queue()
+    # Bounds how many embedded batches (and shared-memory buffers) are in flight
+    result_q = ctx.Queue(maxsize=workers * 4)
+    for file_path in files:
+        task_q.put(file_path)
+    for _ in range(workers):
+        task_q.put(None)
+
+    start = time.perf_counter()
+    procs = [
+        ctx.Process(
+            target=_worker,
+            args=(task_q, result_q, threads, batch_size),
+            name=f"bulk-embed-{i}",
+            daemon=True,
+        )
+        for i in range(workers)
+    ]
+    for p in procs:
+        p.start()
+    logger.info(
+        f"Bulk ingesting {len(files)} files with {workers} workers "
+        f"x {threads} threads"
+    )
+
+    pending_chunks: list[Chunk] = []
+    pending_embeddings: list[np.ndarray] = []
+    pending_models: list[str] = []
+    finished: list[tuple[str, dict, str]] = []
+    # Chunk IDs received per file and page until the file finishes
+    received: dict[str, dict[int, list[str]]] = {}
+    partial: list[tuple[str, dict[int, list[str]]]] = []
+    totals = {"pages": 0, "pages_unchanged": 0, "chunks": 0, "removed": 0}
+    embed_s = 0.0
+    failed = []
+    terminal = 0
+
+    def write() -> None:
+        nonlocal pending_chunks, pending_embeddings, pending_models
+        if pending_chunks:
+            embeddings = np.vstack(pending_embeddings)
+            store.upsert_embedded(pending_chunks, embeddings)
+            if cache is not None:
+                cache.put_many({
+                    EmbeddingCache.key(model_id, chunk.text): vector
+                    for chunk, vector, model_id in zip(
+                        pending_chunks, embeddings, pending_models
+                    )
+                })
+            pending_chunks, pending_embeddings, pending_models = [], [], []
+        # Manifest updates wait until all of a file's chunks are persisted
+        if finished or partial:
+            store.flush()
+        for file_name, pages in partial:
+            record_partial(
+                store, file_name, store.manifest.get_pages(file_name),
+                {page: ("", ids) for page, ids in pages.items()},
+                {cid for ids in pages.values() for cid in ids},
+            )
+        partial.clear()
+        for file_name, current, content_hash in finished:
+            previous = store.manifest.get_pages(file_name)
+            live = {cid for _, ids in current.values() for cid in ids}
+            stale = [
+                cid for _, ids in previous.values() for cid in ids
+                if cid not in live
+            ]
+            totals["removed"] += store.delete_chunks(file_name, stale)
+            store.manifest.replace_source(file_name, current)
+            store.catalog.set_content_hash(file_name, content_hash)
+        finished.clear()
+
+    try:
+        while terminal < len(files):
+            try:
+                kind, file_name, payload, extra = result_q.get(timeout=0.5)
+            except queue.Empty:
+                if not any(p.is_alive() for p in procs):
+                    lost = len(files) - terminal
+                    logger.error(f"Workers exited with {lost} files unfinished")
+                    failed.append({"file": None, "error": f"{lost} files lost"})
+                    break
+                continue
+
+            if kind == "batch":
+                pages = received.setdefault(file_name, {})
+                for chunk in payload:
+                    pages.setdefault(chunk.page_number, []).append(chunk.chunk_id)
+                pending_chunks.extend(payload)
+                name, shape, model_id = extra
+                pending_embeddings.append(_read_batch(name, shape))
+                pending_models.extend([model_id] * len(payload))
+                if len(pending_chunks) >= write_batch:
+                    write()
+            elif kind == "done":
+                terminal += 1
+                received.pop(file_name, None)
+                finished.append((file_name, *payload))
+                embed_s += extra.pop("embed_s")
+                for key, value in extra.items():
+                    totals[key] += value
+                logger.info(
+                    f"[{terminal}/{len(files)}] {file_name}: {extra['pages']} "
+                    f"pages, {extra['chunks']} chunks embedded"
+                )
+            else:
+                terminal += 1
+                failed.append({"file": file_name, "error": payload})
+                if file_name in received:
+                    partial.append((file_name, received.pop(file_name)))
+        # Files whose worker died mid-way are recorded like failed ones
+        partial.extend(received.items())
+        received.clear()
+        write()
+        store.flush()
+    finally:
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+        # Free buffers of batches that were never stored
+        while True:
+            try:
+                kind, _, _, extra = result_q.get_nowait()
+            except (queue.Empty, OSError, EOFError):
+                break
+            if kind == "batch":
+                _read_batch(*extra[:2])
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        "files": len(files),
+        "failed": failed,
+        "workers": workers,
+        "threads": threads,
+        **totals,
+        "elapsed_s": round(elapsed, 2),
+        "chunks_per_s": round(totals["chunks"] / elapsed, 1) if elapsed else 0.0,
+        "embed_s": round(embed_s, 2),
+    }
+    logger.info(
+        f"Bulk ingest: {totals['chunks']} chunks from {len(files)} files in "
+        f"{elapsed:.1f}s ({summary['chunks_per_s']} chunks/s), "
+        f"{len(failed)} failed"
+    )
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-ingest PDFs in parallel")
+    parser.add_argument("paths", nargs="+", help="PDF files or directories")
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="embedding processes (default: cores / threads)",
+    )
+    parser.add_argument(
+        "--threads", type=int, default=1, help="intra-op threads per worker"
+    )
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument(
+        "--write-batch", type=int, default=1024,
+        help="chunks per vector store upsert",
+    )
+    args = parser.parse_args()
+
+    summary = run_bulk(
+        args.paths,
+        workers=args.workers,
+        threads=args.threads,
+        batch_size=args.batch_size,
+        write_batch=args.write_batch,
+    )
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 from dataclasses import dataclass
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from typing import Iterable, Iterator
 from loguru import logger
+from app.core.tracing import span
 from app.ingestion.pdf_processor import PageContent
 
 
@@ -11,9 +12,11 @@ class Chunk:
     source_file: str
     page_number: int
     chunk_index: int
+    chunk_type: str = "text"  # text | table
 
 class DocumentChunker:
     def __init__(self, chunk_size: int = 500, chunk_overlap: int = 50):
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
         self.splitter = RecursiveCharacterTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
@@ -22,26 +25,70 @@ class DocumentChunker:
         )
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
-    
-    def chunk_pages(self, pages: list[PageContent]) -> list[Chunk]:
-        all_chunks = []
 
-        for page in pages:
-            texts = self.splitter.split_text(page.text)
-
-            for idx, text in enumerate(texts):
-                chunk = Chunk(
-                    text=text,
-                    chunk_id=f"{page.source_file}_p{page.page_number}_c{idx}",
-                    source_file=page.source_file,
-                    page_number=page.page_number,
-                    chunk_index=idx,
-                )
-                all_chunks.append(chunk)
+    def chunk_pages(self, pages: list[PageContent]) -> list[Chunk]:
+        all_chunks = list(self.iter_chunks(pages))
 
         logger.info(
             f"Created {len(all_chunks)} chunks from "
             f"{len(pages)} pages "
             f"(size={self.chunk_size}, overlap={self.chunk_overlap})"
         )
-        return all_chunks
\ No newline at end of file
+        return all_chunks
+
+    def iter_chunks(self, pages: Iterable[PageContent]) -> Iterator[Chunk]:
+        for page in pages:
+            yield from self.chunk_page(page)
+
+    def chunk_page(self, page: PageContent) -> list[Chunk]:
+        with span("chunk") as current:
+            texts = self.splitter.split_text(page.text) if page.text else []
+            tables = [
+                group
+                for table in page.tables
+                for group in self._table_groups(table)
+            ]
+            current.set(batch_size=len(texts) + len(tables), tables=len(tables))
+
+        chunks = [
+            Chunk(
+                text=text,
+                chunk_id=f"{page.source_file}_p{page.page_number}_c{idx}",
+                source_file=page.source_file,
+                page_number=page.page_number,
+                chunk_index=idx,
+            )
+            for idx, text in enumerate(texts)
+        ]
+        chunks.extend(
+            Chunk(
+                text=text,
+                chunk_id=f"{page.source_file}_p{page.page_number}_c{idx}",
+                source_file=page.source_file,
+                page_number=page.page_number,
+                chunk_index=idx,
+                chunk_type="table",
+            )
+            for idx, text in enumerate(tables, start=len(texts))
+        )
+        return chunks
+
+    def _table_groups(self, rows: list[list[str]]) -> list[str]:
+        # Rows are never split; each group repeats the header so a chunk
+        # read on its own still says which column a figure belongs to
+        header = self._format_row(rows[0])
+        groups, current, size = [], [], len(header)
+        for row in rows[1:]:
+            line = self._format_row(row)
+            if current and size + len(line) + 1 > self.chunk_size:
+                groups.append("\n".join([header] + current))
+                current, size = [], len(header)
+            current.append(line)
+            size += len(line) + 1
+        if current:
+            groups.append("\n".join([header] + current))
+        return groups
+
+    @staticmethod
+    def _format_row(row: list[str]) -> str:
+        return " | ".join(row)
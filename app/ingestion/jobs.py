@@ -0,0 +1,273 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import asdict, dataclass, field, fields
+from loguru import logger
+from app.core.executors import BoundedExecutor, ExecutorBusy
+from app.ingestion.pipeline import IngestionCancelled, IngestionPipeline
+
+# Job lifecycle: queued -> running -> completed | failed | cancelled
+ACTIVE_STATUSES = ("queued", "running")
+
+
+@dataclass
+class IngestionJob:
+    job_id: str
+    filename: str
+    file_path: str
+    status: str = "queued"
+    pages_extracted: int = 0
+    chunks_embedded: int = 0
+    chunks_stored: int = 0
+    error: str | None = None
+    diff: dict | None = None
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+
+# Runs ingestion jobs on the ingest executor and persists their state to
+# SQLite so queued or in-flight jobs are picked up again after a restart.
+# Re-running a job from scratch is safe because chunk IDs are deterministic
+# and the store upserts. Resumed jobs that don't fit in the executor wait
+# in a backlog and are scheduled as running jobs finish.
+class JobManager:
+    _PERSIST_INTERVAL = 0.5  # seconds between progress writes per job
+
+    def __init__(
+        self,
+        pipeline: IngestionPipeline,
+        executor: BoundedExecutor,
+        db_path: str,
+    ):
+        self.pipeline = pipeline
+        self.executor = executor
+        self._jobs: dict[str, IngestionJob] = {}
+        self._futures: dict[str, Future] = {}
+        self._cancel_events: dict[str, threading.Event] = {}
+        self._last_persist: dict[str, float] = {}
+        self._backlog: deque[str] = deque()  # job IDs waiting for a slot
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, filename TEXT NOT NULL, "
+            "file_path TEXT NOT NULL, status TEXT NOT NULL, "
+            "pages_extracted INTEGER NOT NULL, "
+            "chunks_embedded INTEGER NOT NULL, "
+            "chunks_stored INTEGER NOT NULL, error TEXT, diff TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        columns = {
+            row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")
+        }
+        if "diff" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN diff TEXT")
+        self._conn.commit()
+
+    def submit(self, filename: str, file_path: str) -> IngestionJob:
+        job = IngestionJob(
+            job_id=uuid.uuid4().hex,
+            filename=filename,
+            file_path=file_path,
+        )
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._persist(job)
+        self._drain_backlog()
+        try:
+            self._schedule(job)
+        except Exception as e:
+            with self._lock:
+                job.error = str(e)
+                self._finish(job, "failed")
+            raise
+        logger.info(f"Queued ingestion job {job.job_id} for {filename}")
+        return job
+
+    def get(self, job_id: str) -> IngestionJob | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return IngestionJob(**asdict(job))
+
+            row = self._conn.execute(
+                f"SELECT {self._columns()} FROM jobs WHERE job_id = ?",
+                (job_id,),
+            ).fetchone()
+        return self._from_row(row) if row else None
+
+    def cancel(self, job_id: str) -> IngestionJob | None:
+        freed = False
+        with self._lock:
+            job = self._jobs.get(job_id)
+            active = job is not None and job.status in ACTIVE_STATUSES
+            if active:
+                future = self._futures.get(job_id)
+                if job_id in self._backlog:
+                    self._backlog.remove(job_id)
+                    self._finish(job, "cancelled")
+                elif future is not None and future.cancel():
+                    # Never started, so nothing else will update it
+                    self._finish(job, "cancelled")
+                    freed = True
+                elif job_id in self._cancel_events:
+                    self._cancel_events[job_id].set()
+                else:
+                    # Taken off the backlog but not submitted yet
+                    self._finish(job, "cancelled")
+
+        if freed:
+            # The slot it held can take a backlogged job
+            self._drain_backlog()
+        if active:
+            logger.info(f"Cancellation requested for ingestion job {job_id}")
+        return self.get(job_id)
+
+    def resume(self) -> int:
+        placeholders = ",".join("?" * len(ACTIVE_STATUSES))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {self._columns()} FROM jobs "
+                f"WHERE status IN ({placeholders}) ORDER BY created_at",
+                ACTIVE_STATUSES,
+            ).fetchall()
+
+        for row in rows:
+            job = self._from_row(row)
+            job.status = "queued"
+            with self._lock:
+                self._jobs[job.job_id] = job
+                if not os.path.exists(job.file_path):
+                    job.error = "Uploaded file no longer exists"
+                    self._finish(job, "failed")
+                    continue
+                self._persist(job)
+                self._backlog.append(job.job_id)
+        self._drain_backlog()
+
+        if rows:
+            logger.info(
+                f"Resumed {len(rows)} unfinished ingestion jobs "
+                f"({len(self._backlog)} waiting for a free slot)"
+            )
+        return len(rows)
+
+    def _schedule(self, job: IngestionJob) -> None:
+        cancel = threading.Event()
+        with self._lock:
+            self._cancel_events[job.job_id] = cancel
+        try:
+            future = self.executor.submit(self._run, job.job_id, cancel)
+        except Exception:
+            with self._lock:
+                self._cancel_events.pop(job.job_id, None)
+            raise
+        # Runs after the executor has released the job's slot. A cancelled
+        # future runs it inside cancel(), which holds the lock and drains
+        # once it has let go.
+        future.add_done_callback(
+            lambda f: f.cancelled() or self._drain_backlog()
+        )
+        with self._lock:
+            if job.status in ACTIVE_STATUSES:
+                self._futures[job.job_id] = future
+
+    def _drain_backlog(self) -> None:
+        while True:
+            with self._lock:
+                if not self._backlog:
+                    return
+                job = self._jobs[self._backlog.popleft()]
+            try:
+                self._schedule(job)
+            except ExecutorBusy:
+                with self._lock:
+                    # Unless it was cancelled in the meantime
+                    if job.status in ACTIVE_STATUSES:
+                        self._backlog.appendleft(job.job_id)
+                return
+            except Exception as e:
+                with self._lock:
+                    job.error = str(e)
+                    self._finish(job, "failed")
+
+    def _run(self, job_id: str, cancel: threading.Event) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status not in ACTIVE_STATUSES:
+                return  # cancelled while it was being scheduled
+            job.status = "running"
+            self._persist(job)
+
+        error = None
+        diff = None
+        try:
+            result = self.pipeline.run(
+                job.file_path,
+                progress=lambda counts: self._on_progress(job_id, counts),
+                cancel=cancel,
+            )
+            diff = asdict(result.diff)
+            status = "completed"
+        except IngestionCancelled:
+            status = "cancelled"
+        except Exception as e:
+            logger.error(f"Ingestion job {job_id} failed: {e}")
+            status = "failed"
+            error = str(e)
+
+        with self._lock:
+            job.error = error
+            job.diff = diff
+            self._finish(job, status)
+        logger.info(f"Ingestion job {job_id} {status}")
+
+    def _on_progress(self, job_id: str, counts: dict) -> None:
+        with self._lock:
+            job = self._jobs[job_id]
+            for key, value in counts.items():
+                setattr(job, key, value)
+            job.updated_at = time.time()
+            if job.updated_at - self._last_persist.get(job_id, 0) >= self._PERSIST_INTERVAL:
+                self._persist(job)
+
+    def _finish(self, job: IngestionJob, status: str) -> None:
+        # Caller holds self._lock. Finished jobs are only kept in SQLite,
+        # where get() finds them
+        job.status = status
+        self._persist(job)
+        self._jobs.pop(job.job_id, None)
+        self._futures.pop(job.job_id, None)
+        self._cancel_events.pop(job.job_id, None)
+        self._last_persist.pop(job.job_id, None)
+
+    def _persist(self, job: IngestionJob) -> None:
+        # Caller holds self._lock
+        job.updated_at = time.time()
+        values = asdict(job)
+        values["diff"] = json.dumps(job.diff) if job.diff is not None else None
+        self._conn.execute(
+            f"INSERT OR REPLACE INTO jobs ({self._columns()}) "
+            f"VALUES ({','.join('?' * len(values))})",
+            tuple(values.values()),
+        )
+        self._conn.commit()
+        self._last_persist[job.job_id] = job.updated_at
+
+    @staticmethod
+    def _columns() -> str:
+        return ", ".join(f.name for f in fields(IngestionJob))
+
+    @staticmethod
+    def _from_row(row: tuple) -> IngestionJob:
+        job = IngestionJob(*row)
+        if job.diff is not None:
+            job.diff = json.loads(job.diff)
+        return job
@@ -1,7 +1,15 @@
+import multiprocessing as mp
+import threading
+import time
 import pdfplumber
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
+from typing import Iterator
 from loguru import logger
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from app.core.config import settings
+from app.core.tracing import Span, record
 
 @dataclass
 class PageContent:
@@ -9,47 +17,178 @@ class PageContent:
     page_number: int
     source_file: str
     total_pages: int
+    # Each table is a list of rows of cleaned cell text, header row first
+    tables: list[list[list[str]]] = field(default_factory=list)
+
+
+def _iter_range(file_path: str, start: int, end: int) -> Iterator[PageContent]:
+    file_name = Path(file_path).name
+
+    with pdfplumber.open(file_path) as pdf:
+        total_pages = len(pdf.pages)
+
+        for i in range(start, min(end, total_pages)):
+            page_start = time.perf_counter()
+            page = pdf.pages[i]
+            tables = []
+            if settings.extract_tables:
+                text, tables = _extract_with_tables(page)
+            else:
+                text = page.extract_text()
+            # Drop pdfplumber's per-page object cache so memory stays flat
+            page.close()
+            logger.debug(
+                f"Page {i+1} of {file_name} extracted in "
+                f"{(time.perf_counter() - page_start) * 1000:.1f}ms"
+            )
+            if (text and text.strip()) or tables:
+                # Clean the extracted text
+                cleaned = PDFProcessor._clean_text(text or "")
+
+                yield PageContent(
+                    text=cleaned,
+                    page_number=i + 1,
+                    source_file=file_name,
+                    total_pages=total_pages,
+                    tables=tables,
+                )
+            else:
+                logger.warning(
+                    f"Page {i+1} of {file_name}: no text extracted"
+                )
+
+
+def _extract_with_tables(page) -> tuple[str, list[list[list[str]]]]:
+    # Tables come out as cell grids; the text pass then only reads what lies
+    # outside their bounding boxes, so table figures aren't indexed twice
+    tables = []
+    text_page = page
+    for table in page.find_tables():
+        rows = [
+            [_clean_cell(cell) for cell in row]
+            for row in table.extract()
+        ]
+        rows = [row for row in rows if any(row)]
+        if len(rows) < 2 or max(len(row) for row in rows) < 2:
+            continue  # not a real grid; leave it to the text pass
+        tables.append(rows)
+        text_page = text_page.outside_bbox(table.bbox)
+    return text_page.extract_text(), tables
+
+
+def _clean_cell(cell: str | None) -> str:
+    return " ".join((cell or "").split())
+
+
+def _extract_range(file_path: str, start: int, end: int) -> list[PageContent]:
+    # Runs inside a worker process, so each worker opens its own handle
+    return list(_iter_range(file_path, start, end))
+
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def _extraction_pool() -> ProcessPoolExecutor:
+    # One pool reused across documents. Workers are spawned: the API process
+    # is multi-threaded and may have torch loaded, and fork doesn't mix
+    # with either.
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=max(settings.extraction_workers, 1),
+                mp_context=mp.get_context("spawn"),
+            )
+        return _pool
+
+
+def shutdown_extraction_pool(pool: ProcessPoolExecutor = None) -> None:
+    # With a pool given, only that pool is dropped if it is still current
+    global _pool
+    with _pool_lock:
+        if pool is not None and pool is not _pool:
+            return
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
 
 class PDFProcessor:
     @staticmethod
-    def extract_pages( file_path : str) -> list[PageContent]:
-        pages = []
+    def extract_pages(file_path: str, workers: int = None) -> list[PageContent]:
+        return list(PDFProcessor.iter_pages(file_path, workers))
+
+    @staticmethod
+    def iter_pages(file_path: str, workers: int = None) -> Iterator[PageContent]:
+        workers = workers or settings.extraction_workers
         file_name = Path(file_path).name
+        start = time.perf_counter()
+        extracted = 0
+        extract_span = Span(name="extract", start=start)
+
         try:
             with pdfplumber.open(file_path) as pdf:
                 total_pages = len(pdf.pages)
-                logger.info(f"Processing {file_name}: {total_pages} pages")
-
-                for i,page in enumerate(pdf.pages):
-                    text = page.extract_text()
-                    if text and text.strip():
-                        # Clean the extracted text
-                        cleaned = PDFProcessor._clean_text(text)
-
-                        pages.append(PageContent(
-                            text=cleaned,
-                            page_number=i + 1,
-                            source_file=file_name,
-                            total_pages=total_pages,
-                        ))
-                    else:
-                        logger.warning(
-                            f"Page {i+1} of {file_name}: no text extracted"
-                        )
+            logger.info(f"Processing {file_name}: {total_pages} pages")
+
+            ranges = PDFProcessor._page_ranges(total_pages, workers)
+            if len(ranges) <= 1:
+                for page in _iter_range(file_path, 0, total_pages):
+                    extracted += 1
+                    yield page
+            else:
+                logger.info(
+                    f"Extracting {file_name} with {len(ranges)} workers"
+                )
+                pool = _extraction_pool()
+                futures = [
+                    pool.submit(_extract_range, file_path, *r) for r in ranges
+                ]
+                try:
+                    # Collected in submission order, so pages stay sorted
+                    for future in futures:
+                        for page in future.result():
+                            extracted += 1
+                            yield page
+                except BrokenProcessPool:
+                    # A dead worker breaks the pool for good; start afresh
+                    # on the next document
+                    shutdown_extraction_pool(pool)
+                    raise
+                finally:
+                    for future in futures:
+                        future.cancel()
         except Exception as e:
             logger.error(f"Failed to process {file_name}: {e}")
             raise
 
+        elapsed = time.perf_counter() - start
+        extract_span.set(batch_size=extracted, pages=total_pages, workers=len(ranges))
+        record(extract_span, elapsed)
         logger.info(
-            f"Extracted {len(pages)} pages with text from {file_name}"
+            f"Extracted {extracted} pages with text from {file_name} "
+            f"in {elapsed:.2f}s "
+            f"({elapsed * 1000 / max(total_pages, 1):.1f}ms/page)"
+        )
+
+    @staticmethod
+    def _page_ranges(total_pages: int, workers: int) -> list[tuple[int, int]]:
+        # Contiguous ranges keep each worker's reads local to one part of the file
+        per_worker = max(
+            -(-total_pages // max(workers, 1)),
+            settings.extraction_min_pages_per_worker,
         )
-        return pages
+        return [
+            (start, min(start + per_worker, total_pages))
+            for start in range(0, total_pages, per_worker)
+        ]
 
+    @staticmethod
     def _clean_text(text: str) -> str:
         import re
         text = re.sub(r'\n{3,}', '\n\n', text)
         text = re.sub(r' {2,}', ' ', text)
         lines = [line.strip() for line in text.split('\n')]
         text = '\n'.join(lines)
-        return text.strip()        
-    
\ No newline at end of file
+        return text.strip()
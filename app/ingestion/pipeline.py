@@ -0,0 +1,281 @@
+import hashlib
+import json
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+from loguru import logger
+from app.core.config import settings
+from app.ingestion.pdf_processor import PDFProcessor, PageContent
+from app.ingestion.chunker import Chunk, DocumentChunker
+from app.retrieval.vector_store import VectorStore
+
+_DONE = object()
+
+
+def page_hash(page: PageContent, chunker: DocumentChunker) -> str:
+    # Chunking settings are part of the hash so changing them re-chunks.
+    # Tables are hashed too (pages without any hash as before), so turning
+    # table extraction on re-indexes exactly the pages that have tables.
+    content = page.text
+    if page.tables:
+        content += "\0" + json.dumps(page.tables)
+    return hashlib.sha256(
+        f"{chunker.chunk_size}:{chunker.chunk_overlap}\0"
+        f"{content}".encode("utf-8")
+    ).hexdigest()
+
+
+def file_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def record_partial(
+    vector_store: VectorStore,
+    file_name: str,
+    previous: dict[int, tuple[str, list[str]]],
+    current: dict[int, tuple[str, list[str]]],
+    stored: set[str],
+) -> None:
+    # A cancelled or failed run has already overwritten some pages'
+    # chunks. Those pages get an empty hash so the next run re-indexes
+    # them, and keep both their old and newly stored chunk IDs so that
+    # run deletes whichever turn out stale. Untouched pages keep their
+    # previous entry.
+    pages = dict(previous)
+    for page_number, (_, chunk_ids) in current.items():
+        written = [cid for cid in chunk_ids if cid in stored]
+        if written:
+            old_ids = previous.get(page_number, ("", []))[1]
+            pages[page_number] = (
+                "", old_ids + [cid for cid in written if cid not in old_ids]
+            )
+    vector_store.flush()
+    vector_store.manifest.replace_source(file_name, pages)
+    logger.info(
+        f"Ingestion of {file_name} stopped after storing {len(stored)} "
+        f"chunks; their pages will be re-indexed on the next run"
+    )
+
+
+class IngestionCancelled(Exception):
+    pass
+
+
+@dataclass
+class IndexDiff:
+    pages_added: int = 0
+    pages_changed: int = 0
+    pages_unchanged: int = 0
+    pages_removed: int = 0
+    chunks_added: int = 0
+    chunks_removed: int = 0
+
+
+@dataclass
+class IngestionResult:
+    source_file: str
+    pages_extracted: int
+    chunks_created: int
+    diff: IndexDiff = field(default_factory=IndexDiff)
+
+
+# Pages -> chunk batches -> embeddings -> upserts. Extraction/chunking,
+# embedding and storage each run on their own thread and hand batches over
+# bounded queues, so the stages overlap and memory is bounded by
+# batch_size * queue_size rather than by the document. Pages whose hash
+# matches the source manifest are skipped, and chunks left over from
+# removed or shrunk pages are deleted once the new ones are stored.
+class IngestionPipeline:
+    def __init__(
+        self,
+        vector_store: VectorStore,
+        chunker: DocumentChunker,
+        batch_size: int = None,
+        queue_size: int = None,
+    ):
+        self.vector_store = vector_store
+        self.chunker = chunker
+        self.batch_size = batch_size or settings.ingest_batch_size
+        self.queue_size = queue_size or settings.ingest_queue_size
+
+    def run(
+        self,
+        file_path: str,
+        progress: Callable[[dict], None] = None,
+        cancel: threading.Event = None,
+    ) -> IngestionResult:
+        file_name = Path(file_path).name
+        start = time.perf_counter()
+
+        chunk_q = queue.Queue(maxsize=self.queue_size)
+        embed_q = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        errors = []
+        counts = {"pages_extracted": 0, "chunks_embedded": 0, "chunks_stored": 0}
+        counts_lock = threading.Lock()
+
+        previous = self.vector_store.manifest.get_pages(file_name)
+        current: dict[int, tuple[str, list[str]]] = {}
+        stored: set[str] = set()
+        diff = IndexDiff()
+
+        def advance(stage: str, n: int) -> None:
+            if cancel is not None and cancel.is_set():
+                raise IngestionCancelled(f"Ingestion of {file_name} cancelled")
+            with counts_lock:
+                counts[stage] += n
+                snapshot = dict(counts)
+            if progress is not None:
+                progress(snapshot)
+
+        def changed_chunks() -> Iterator[Chunk]:
+            for page in PDFProcessor.iter_pages(file_path):
+                advance("pages_extracted", 1)
+                page_hash = self._page_hash(page)
+                old = previous.get(page.page_number)
+                if old is not None and old[0] == page_hash:
+                    current[page.page_number] = old
+                    diff.pages_unchanged += 1
+                    continue
+
+                if old is None:
+                    diff.pages_added += 1
+                else:
+                    diff.pages_changed += 1
+                chunks = self.chunker.chunk_page(page)
+                current[page.page_number] = (
+                    page_hash, [c.chunk_id for c in chunks]
+                )
+                yield from chunks
+
+        def produce():
+            try:
+                for batch in self._batches(changed_chunks()):
+                    if not self._put(chunk_q, batch, stop):
+                        return
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+            finally:
+                self._put(chunk_q, _DONE, stop)
+
+        def embed():
+            try:
+                while True:
+                    batch = self._get(chunk_q, stop)
+                    if batch is _DONE or batch is None:
+                        return
+                    embeddings = self.vector_store.embedder.embed_texts(
+                        [c.text for c in batch]
+                    )
+                    advance("chunks_embedded", len(batch))
+                    if not self._put(embed_q, (batch, embeddings), stop):
+                        return
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+            finally:
+                self._put(embed_q, _DONE, stop)
+
+        workers = [
+            threading.Thread(target=produce, name=f"ingest-extract-{file_name}"),
+            threading.Thread(target=embed, name=f"ingest-embed-{file_name}"),
+        ]
+        for w in workers:
+            w.start()
+
+        try:
+            while True:
+                item = self._get(embed_q, stop)
+                if item is _DONE or item is None:
+                    break
+                batch, embeddings = item
+                n = self.vector_store.upsert_embedded(batch, embeddings)
+                stored.update(c.chunk_id for c in batch)
+                advance("chunks_stored", n)
+                logger.debug(
+                    f"Stored batch of {n} chunks from {file_name} "
+                    f"({counts['chunks_stored']} so far)"
+                )
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            for w in workers:
+                w.join()
+
+        if errors:
+            if stored:
+                record_partial(
+                    self.vector_store, file_name, previous, current, stored
+                )
+            raise errors[0]
+
+        live = {cid for _, chunk_ids in current.values() for cid in chunk_ids}
+        stale = [
+            cid
+            for _, chunk_ids in previous.values()
+            for cid in chunk_ids
+            if cid not in live
+        ]
+        diff.pages_removed = len(previous.keys() - current.keys())
+        diff.chunks_added = counts["chunks_stored"]
+        diff.chunks_removed = self.vector_store.delete_chunks(file_name, stale)
+        # The manifest only vouches for chunks that are already persisted
+        self.vector_store.flush()
+        self.vector_store.manifest.replace_source(file_name, current)
+        self.vector_store.catalog.set_content_hash(file_name, file_hash(file_path))
+
+        logger.info(
+            f"Ingested {file_name}: {counts['pages_extracted']} pages "
+            f"({diff.pages_added} added, {diff.pages_changed} changed, "
+            f"{diff.pages_unchanged} unchanged, {diff.pages_removed} removed), "
+            f"{diff.chunks_added} chunks stored, {diff.chunks_removed} removed "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
+        return IngestionResult(
+            source_file=file_name,
+            pages_extracted=counts["pages_extracted"],
+            chunks_created=sum(len(ids) for _, ids in current.values()),
+            diff=diff,
+        )
+
+    def _page_hash(self, page: PageContent) -> str:
+        return page_hash(page, self.chunker)
+
+    def _batches(self, chunks: Iterable[Chunk]) -> Iterator[list[Chunk]]:
+        batch = []
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @staticmethod
+    def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+        # Poll so a failed downstream stage can't leave us blocked forever
+        while True:
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                if stop.is_set():
+                    return False
+
+    @staticmethod
+    def _get(q: queue.Queue, stop: threading.Event):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
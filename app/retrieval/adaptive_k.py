@@ -0,0 +1,59 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class Cutoff:
+    results: list[dict]
+    candidates: int
+    gap: float  # score drop at the cut; 0.0 when nothing was cut
+    reason: str  # "gap", "flat" or "few"
+
+    @property
+    def k(self) -> int:
+        return len(self.results)
+
+
+# Picks how many retrieved chunks reach the prompt from the shape of the
+# score curve instead of a fixed top_k. With scores sorted, the largest drop
+# between neighbours at positions min_k..max_k is found: if it is at least
+# min_gap everything below it is cut (a few clearly relevant chunks, then a
+# cliff); otherwise the curve is flat and up to max_k chunks are kept.
+# Scores are rerank_score when every candidate has one, then rrf_score
+# (hybrid mode, as a fraction of the top score since RRF values sit close
+# together), else cosine; kept chunks stay in the order they arrived in.
+class AdaptiveTopK:
+    def __init__(self, min_k: int, max_k: int, min_gap: float):
+        self.min_k = max(1, min_k)
+        self.max_k = max(self.min_k, max_k)
+        self.min_gap = min_gap
+
+    def select(self, results: list[dict]) -> Cutoff:
+        if len(results) <= self.min_k:
+            return Cutoff(results, len(results), 0.0, "few")
+
+        key = next(
+            (
+                k for k in ("rerank_score", "rrf_score")
+                if all(k in r for r in results)
+            ),
+            "score",
+        )
+        scores = sorted((r[key] for r in results), reverse=True)
+        if key == "rrf_score" and scores[0] > 0:
+            scores = [s / scores[0] for s in scores]
+        limit = min(self.max_k, len(scores))
+        # Cutting at i keeps scores[:i]; the first of equal gaps wins
+        gap, cut = max(
+            ((scores[i - 1] - scores[i], i) for i in range(self.min_k, limit)),
+            key=lambda item: item[0],
+            default=(0.0, limit),
+        )
+        if gap >= self.min_gap:
+            k, reason = cut, "gap"
+        else:
+            k, reason, gap = limit, "flat", 0.0
+
+        ranked = sorted(results, key=lambda r: r[key], reverse=True)
+        kept_ids = {id(r) for r in ranked[:k]}
+        kept = [r for r in results if id(r) in kept_ids]
+        return Cutoff(kept, len(results), round(gap, 4), reason)
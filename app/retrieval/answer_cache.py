@@ -0,0 +1,101 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+import numpy as np
+from loguru import logger
+
+
+@dataclass
+class _Entry:
+    embedding: np.ndarray
+    chunk_ids: frozenset
+    sources: frozenset
+    response: Any
+
+
+# Semantic cache of generated answers. A hit needs both a question embedding
+# within the cosine threshold and exactly the same retrieved chunk set, so a
+# paraphrase only reuses an answer that was grounded in identical context.
+class AnswerCache:
+    def __init__(self, threshold: float, max_entries: int):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, embedding: list[float], chunk_ids: list[str]) -> Any:
+        query = self._normalize(embedding)
+        chunk_set = frozenset(chunk_ids)
+
+        with self._lock:
+            best_id, best_score = None, self.threshold
+            for entry_id, entry in self._entries.items():
+                if entry.chunk_ids != chunk_set:
+                    continue
+                score = float(np.dot(query, entry.embedding))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+
+            if best_id is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            logger.info(f"Answer cache hit (cosine={best_score:.4f})")
+            return self._entries[best_id].response
+
+    def store(
+        self,
+        embedding: list[float],
+        chunk_ids: list[str],
+        sources: list[str],
+        response: Any,
+    ) -> None:
+        if self.max_entries <= 0:
+            return
+        entry = _Entry(
+            embedding=self._normalize(embedding),
+            chunk_ids=frozenset(chunk_ids),
+            sources=frozenset(sources),
+            response=response,
+        )
+        with self._lock:
+            self._entries[self._next_id] = entry
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_sources(self, sources: set[str]) -> None:
+        with self._lock:
+            stale = [
+                entry_id for entry_id, entry in self._entries.items()
+                if entry.sources & sources
+            ]
+            for entry_id in stale:
+                del self._entries[entry_id]
+        if stale:
+            logger.info(
+                f"Answer cache: dropped {len(stale)} entries for "
+                f"{', '.join(sorted(sources))}"
+            )
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    @staticmethod
+    def _normalize(embedding: list[float]) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
@@ -0,0 +1,263 @@
+import os
+from typing import Iterator
+from app.core.config import settings
+from app.retrieval.numpy_index import NumpyBackend
+from app.retrieval.sharding import ShardedBackend
+
+
+# Storage and nearest-neighbour search for embedded chunks. VectorStore owns
+# caching, BM25 and change notification; a backend only stores and searches.
+# query() returns, per query embedding, dicts with text, source_file,
+# page_number, chunk_index, chunk_type, chunk_id and cosine score, best
+# first.
+class ChromaBackend:
+    name = "chroma"
+
+    def __init__(self, persist_dir: str, collection_name: str):
+        import chromadb  # deferred: slow to import and unused by other backends
+        try:
+            os.makedirs(persist_dir, exist_ok=True)
+            self.client = chromadb.PersistentClient(path=persist_dir)
+        except Exception:
+            self.client = chromadb.Client()
+
+        self.collection = self.client.get_or_create_collection(
+            name=collection_name,
+            metadata={"hnsw:space": "cosine"},
+        )
+
+    def upsert(
+        self,
+        ids: list[str],
+        documents: list[str],
+        embeddings: list[list[float]],
+        metadatas: list[dict],
+    ) -> None:
+        self.collection.upsert(
+            ids=ids,
+            documents=documents,
+            embeddings=embeddings,
+            metadatas=metadatas,
+        )
+
+    def query(
+        self,
+        query_embeddings: list[list[float]],
+        n_results: int,
+        source_filter: str = None,
+        chunk_type: str = None,
+    ) -> list[list[dict]]:
+        conditions = []
+        if source_filter:
+            conditions.append({"source_file": source_filter})
+        if chunk_type == "text":
+            # Chunks stored before chunk types existed have no chunk_type
+            conditions.append({"chunk_type": {"$ne": "table"}})
+        elif chunk_type:
+            conditions.append({"chunk_type": chunk_type})
+        where_filter = None
+        if len(conditions) == 1:
+            where_filter = conditions[0]
+        elif conditions:
+            where_filter = {"$and": conditions}
+
+        results = self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            where=where_filter,
+            include=["documents", "metadatas", "distances"],
+        )
+        return [
+            self._format_results(results, q)
+            for q in range(len(query_embeddings))
+        ]
+
+    def get(self, ids: list[str], source_file: str = None) -> list[dict]:
+        # source_file is a routing hint for ShardedBackend; IDs are unique
+        got = self.collection.get(
+            ids=ids, include=["documents", "metadatas", "embeddings"]
+        )
+        return [
+            {
+                "text": got["documents"][i],
+                "source_file": got["metadatas"][i]["source_file"],
+                "page_number": got["metadatas"][i]["page_number"],
+                "chunk_index": got["metadatas"][i].get("chunk_index", 0),
+                "chunk_type": got["metadatas"][i].get("chunk_type", "text"),
+                "chunk_id": chunk_id,
+                "embedding": got["embeddings"][i],
+            }
+            for i, chunk_id in enumerate(got["ids"])
+        ]
+
+    def iter_records(
+        self, page_size: int = 5000, source_file: str = None
+    ) -> Iterator[list[dict]]:
+        offset = 0
+        while True:
+            page = self.collection.get(
+                where={"source_file": source_file} if source_file else None,
+                include=["documents", "metadatas"],
+                limit=page_size,
+                offset=offset,
+            )
+            if not page["ids"]:
+                return
+            yield [
+                {
+                    "chunk_id": chunk_id,
+                    "text": text,
+                    "source_file": meta["source_file"],
+                    "page_number": meta["page_number"],
+                    "chunk_type": meta.get("chunk_type", "text"),
+                }
+                for chunk_id, text, meta in zip(
+                    page["ids"], page["documents"], page["metadatas"]
+                )
+            ]
+            offset += len(page["ids"])
+
+    def sources(self) -> list[str]:
+        all_metadata = self.collection.get(include=["metadatas"])
+        sources = set()
+        for m in all_metadata["metadatas"]:
+            sources.add(m["source_file"])
+        return sorted(list(sources))
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def delete(self, ids: list[str], source_file: str = None) -> None:
+        self.collection.delete(ids=ids)
+
+    def delete_source(self, source_file: str) -> None:
+        self.collection.delete(
+            where={"source_file": source_file}
+        )
+
+    def flush(self) -> None:
+        pass  # Chroma persists on write
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "count": self.collection.count()}
+
+    @staticmethod
+    def _format_results(results: dict, q: int) -> list[dict]:
+        formatted = []
+        for i in range(len(results["ids"][q])):
+            formatted.append({
+                "text": results["documents"][q][i],
+                "source_file": results["metadatas"][q][i]["source_file"],
+                "page_number": results["metadatas"][q][i]["page_number"],
+                "chunk_index": results["metadatas"][q][i].get("chunk_index", 0),
+                "chunk_type": results["metadatas"][q][i].get("chunk_type", "text"),
+                "chunk_id": results["ids"][q][i],
+                "score": round(1 - results["distances"][q][i], 4),
+            })
+        return formatted
+
+
+def _chroma_shards() -> ShardedBackend:
+    prefix = f"{settings.collection_name}-"
+
+    def discover() -> list[str]:
+        import chromadb
+        try:
+            client = chromadb.PersistentClient(path=settings.chroma_persist_dir)
+            collections = client.list_collections()
+        except Exception:
+            return []
+        # Older clients return Collection objects, newer ones plain names
+        names = [getattr(c, "name", c) for c in collections]
+        return [n[len(prefix):] for n in names if n.startswith(prefix)]
+
+    return _sharded(
+        lambda shard: ChromaBackend(
+            persist_dir=settings.chroma_persist_dir,
+            collection_name=f"{prefix}{shard}",
+        ),
+        discover,
+        # Chroma caps collection names, prefix included, at 63 characters
+        max_name_length=63 - len(prefix),
+        layout_path=os.path.join(
+            settings.chroma_persist_dir, f"{prefix}layout.json"
+        ),
+    )
+
+
+def _numpy_shards() -> ShardedBackend:
+    root = settings.numpy_index_dir
+
+    def discover() -> list[str]:
+        if not os.path.isdir(root):
+            return []
+        return sorted(
+            name for name in os.listdir(root)
+            if os.path.exists(os.path.join(root, name, "records.db"))
+        )
+
+    return _sharded(
+        lambda shard: NumpyBackend.open(
+            path=os.path.join(root, shard),
+            dtype=settings.numpy_vector_dtype,
+            rescore_factor=settings.numpy_rescore_factor,
+            ivf_lists=settings.numpy_ivf_lists,
+            ivf_probe=settings.numpy_ivf_probe,
+            ivf_min_rows=settings.numpy_ivf_min_rows,
+        ),
+        discover,
+        layout_path=os.path.join(root, "layout.json"),
+    )
+
+
+def _sharded(make_shard, discover, **options) -> ShardedBackend:
+    return ShardedBackend(
+        make_shard=make_shard,
+        discover=discover,
+        shard_by=settings.shard_by,
+        shard_count=settings.shard_count,
+        tenant_separator=settings.shard_tenant_separator,
+        search_workers=settings.shard_search_workers,
+        **options,
+    )
+
+
+_SHARD_BACKENDS = {
+    ChromaBackend.name: _chroma_shards,
+    NumpyBackend.name: _numpy_shards,
+}
+
+
+def _sharded_backend() -> ShardedBackend:
+    if settings.shard_backend not in _SHARD_BACKENDS:
+        raise ValueError(
+            f"Unknown shard backend '{settings.shard_backend}'. "
+            f"Choose one of: {', '.join(_SHARD_BACKENDS)}"
+        )
+    return _SHARD_BACKENDS[settings.shard_backend]()
+
+
+_BACKENDS = {
+    ChromaBackend.name: lambda: ChromaBackend(
+        persist_dir=settings.chroma_persist_dir,
+        collection_name=settings.collection_name,
+    ),
+    NumpyBackend.name: lambda: NumpyBackend.open(
+        path=settings.numpy_index_dir,
+        dtype=settings.numpy_vector_dtype,
+        rescore_factor=settings.numpy_rescore_factor,
+        ivf_lists=settings.numpy_ivf_lists,
+        ivf_probe=settings.numpy_ivf_probe,
+        ivf_min_rows=settings.numpy_ivf_min_rows,
+    ),
+    ShardedBackend.name: _sharded_backend,
+}
+
+
+def get_backend(name: str):
+    if name not in _BACKENDS:
+        raise ValueError(
+            f"Unknown vector backend '{name}'. "
+            f"Choose one of: {', '.join(_BACKENDS)}"
+        )
+    return _BACKENDS[name]()
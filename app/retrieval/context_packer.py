@@ -0,0 +1,163 @@
+import math
+import zlib
+from dataclasses import dataclass, field
+import numpy as np
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English prose; avoids loading a tokenizer
+    return math.ceil(len(text) / 4)
+
+
+@dataclass
+class ContextBlock:
+    text: str
+    source_file: str
+    page_number: int
+    score: float
+    chunk_ids: list[str] = field(default_factory=list)
+
+
+@dataclass
+class PackedContext:
+    blocks: list[ContextBlock]
+    tokens_in: int
+    tokens_out: int
+    merged: int = 0
+    duplicates: int = 0
+    over_budget: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_in - self.tokens_out
+
+
+# Turns ranked search results into prompt context under a token budget:
+# neighbouring chunks of the same page are stitched back together (dropping
+# the splitter's overlap), near-duplicate passages are removed by MinHash
+# similarity, and the remaining blocks are added greedily by score.
+class ContextPacker:
+    def __init__(
+        self,
+        token_budget: int,
+        dedup_threshold: float = 0.8,
+        max_overlap: int = 200,
+        num_perm: int = 64,
+        shingle_size: int = 5,
+    ):
+        self.token_budget = token_budget
+        self.dedup_threshold = dedup_threshold
+        self.max_overlap = max_overlap
+        self.shingle_size = shingle_size
+        # a, b < 2^32 keep a * x + b inside uint64 for 32-bit shingle hashes
+        rng = np.random.default_rng(1)
+        self._perm_a = rng.integers(1, _MAX_HASH, num_perm, dtype=np.uint64)
+        self._perm_b = rng.integers(0, _MAX_HASH, num_perm, dtype=np.uint64)
+
+    def pack(self, results: list[dict]) -> PackedContext:
+        tokens_in = sum(estimate_tokens(r["text"]) for r in results)
+        blocks = self._merge_adjacent(results)
+        merged = len(results) - len(blocks)
+
+        blocks.sort(key=lambda b: b.score, reverse=True)
+        kept = self._drop_near_duplicates(blocks)
+        duplicates = len(blocks) - len(kept)
+
+        packed, used, over_budget = [], 0, 0
+        for block in kept:
+            tokens = estimate_tokens(block.text)
+            if used + tokens <= self.token_budget:
+                packed.append(block)
+                used += tokens
+            elif not packed:
+                # Never send an empty context because the best block is long
+                block.text = block.text[:self.token_budget * 4]
+                packed.append(block)
+                used += estimate_tokens(block.text)
+                over_budget += 1
+            else:
+                over_budget += 1
+
+        return PackedContext(
+            blocks=packed,
+            tokens_in=tokens_in,
+            tokens_out=used,
+            merged=merged,
+            duplicates=duplicates,
+            over_budget=over_budget,
+        )
+
+    def _merge_adjacent(self, results: list[dict]) -> list[ContextBlock]:
+        by_page: dict[tuple[str, int], list[dict]] = {}
+        for r in results:
+            by_page.setdefault((r["source_file"], r["page_number"]), []).append(r)
+
+        blocks = []
+        for (source_file, page_number), hits in by_page.items():
+            hits.sort(key=lambda r: r.get("chunk_index", 0))
+            block, last_index = None, None
+            for r in hits:
+                index = r.get("chunk_index", 0)
+                # Table chunks already carry their header; keep them whole
+                table = r.get("chunk_type", "text") == "table"
+                if block is not None and not table and index == last_index + 1:
+                    block.text = self._stitch(block.text, r["text"])
+                    block.score = max(block.score, r["score"])
+                    block.chunk_ids.append(r["chunk_id"])
+                else:
+                    block = ContextBlock(
+                        text=r["text"],
+                        source_file=source_file,
+                        page_number=page_number,
+                        score=r["score"],
+                        chunk_ids=[r["chunk_id"]],
+                    )
+                    blocks.append(block)
+                last_index = index
+                if table:
+                    block = None
+        return blocks
+
+    def _stitch(self, left: str, right: str) -> str:
+        # Longest suffix of left that is a prefix of right is the overlap
+        limit = min(len(left), len(right), self.max_overlap)
+        for size in range(limit, 0, -1):
+            if left.endswith(right[:size]):
+                return left + right[size:]
+        return f"{left} {right}"
+
+    def _drop_near_duplicates(
+        self, blocks: list[ContextBlock]
+    ) -> list[ContextBlock]:
+        # Blocks arrive best-first, so the higher-scored copy survives
+        kept, signatures = [], []
+        for block in blocks:
+            signature = self._minhash(block.text)
+            if any(
+                float(np.mean(signature == other)) >= self.dedup_threshold
+                for other in signatures
+            ):
+                continue
+            kept.append(block)
+            signatures.append(signature)
+        return kept
+
+    def _minhash(self, text: str) -> np.ndarray:
+        words = text.lower().split()
+        n = self.shingle_size
+        shingles = {
+            " ".join(words[i:i + n])
+            for i in range(max(len(words) - n + 1, 1))
+        }
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode()) for s in shingles),
+            dtype=np.uint64,
+            count=len(shingles),
+        )
+        permuted = (
+            np.outer(hashes, self._perm_a) + self._perm_b
+        ) % _MERSENNE_PRIME
+        return (permuted & _MAX_HASH).min(axis=0)
@@ -0,0 +1,562 @@
+import fcntl
+import heapq
+import math
+import os
+import re
+import threading
+import time
+import zipfile
+from collections import Counter
+import numpy as np
+from loguru import logger
+
+# Keeps figures like "10.2" and "391,035" as single tokens
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.,][0-9]+)*")
+
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that "
+    "the this to was were what which who will with".split()
+)
+
+# Documents held in the dict-based delta before they are folded into arrays
+_COMPACT_AT = 2048
+
+_ARRAYS = (
+    "doc_len", "doc_source", "doc_type", "offsets", "post_docs", "post_tf",
+    "max_tf",
+)
+# String columns, held as lists and saved as UTF-8 bytes plus an offsets
+# table, since a fixed-width unicode array pads every entry to the longest
+_STRINGS = ("ids", "sources", "types", "terms")
+
+
+def tokenize(text: str) -> list[str]:
+    return [
+        token.replace(",", "")
+        for token in _TOKEN_RE.findall(text.lower())
+        if token not in _STOPWORDS
+    ]
+
+
+def _pack(strings: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), np.uint8), offsets
+
+
+def _unpack(data: np.ndarray, offsets: np.ndarray) -> list[str]:
+    blob = data.tobytes()
+    bounds = offsets.tolist()
+    return [blob[a:b].decode("utf-8") for a, b in zip(bounds, bounds[1:])]
+
+
+def _index(names: list[str]) -> tuple[list[str], np.ndarray]:
+    # Distinct names, sorted, and each entry's position among them
+    distinct = sorted(set(names))
+    position = {name: i for i, name in enumerate(distinct)}
+    return distinct, np.array([position[n] for n in names], np.int32)
+
+
+def _empty_arrays() -> dict:
+    return {
+        "ids": [],
+        "doc_len": np.zeros(0, np.int32),
+        "doc_source": np.zeros(0, np.int32),
+        "sources": [],
+        "doc_type": np.zeros(0, np.int32),
+        "types": [],
+        "terms": [],
+        "offsets": np.zeros(1, np.int64),
+        "post_docs": np.zeros(0, np.int32),
+        "post_tf": np.zeros(0, np.uint16),
+        "max_tf": np.zeros(0, np.uint16),
+    }
+
+
+# BM25 index in two parts. The base is a compacted inverted index in flat
+# arrays: posting lists are term-major slices of post_docs/post_tf (doc
+# rows ascending) with a per-term max tf, and deletes only clear an alive
+# flag. Recent adds go to a small dict delta that also maps each document
+# to its terms, so replacing or deleting it touches only its own postings.
+# The delta is folded into the arrays every _COMPACT_AT documents and on
+# save(), which writes the arrays as one uncompressed .npz.
+#
+# Search is term-at-a-time MaxScore: terms are visited in order of their
+# score upper bound, and once the bounds left can't lift an unseen
+# document past the current top_n-th score, the remaining (common) terms
+# only score documents already in the running, found by binary search,
+# instead of walking their whole posting lists.
+#
+# One instance is shared per path within a process. Writers in different
+# processes (the API, the bulk loader) serialise on a lock file; a writer
+# that finds a newer snapshot on disk adopts it and replays its own unsaved
+# adds and deletes on top before saving.
+class BM25Index:
+    _instances: dict[str, "BM25Index"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._generation = 0
+        self._touched: set[str] = set()  # chunk IDs changed since the snapshot
+        self._dirty = False
+        self._last_save = 0.0
+        self._loaded_mtime = 0.0
+        self._reset(_empty_arrays())
+        self._sync()
+
+    @classmethod
+    def open(cls, path: str) -> "BM25Index":
+        with cls._instances_lock:
+            if path not in cls._instances:
+                cls._instances[path] = cls(path)
+            return cls._instances[path]
+
+    def __len__(self) -> int:
+        return self._base_count + len(self._delta_terms)
+
+    def add(self, docs: list[tuple]) -> None:
+        # docs: (chunk_id, text, source_file[, chunk_type]); existing IDs
+        # are replaced
+        with self._lock:
+            self._remove_ids([doc[0] for doc in docs])
+            for chunk_id, text, source_file, *rest in docs:
+                self._add_doc(
+                    chunk_id,
+                    dict(Counter(tokenize(text))),
+                    source_file,
+                    rest[0] if rest else "text",
+                )
+                self._touched.add(chunk_id)
+            self._dirty = True
+            if len(self._delta_terms) >= _COMPACT_AT:
+                self._compact()
+
+    def remove(self, chunk_ids: list[str]) -> None:
+        with self._lock:
+            self._remove_ids(chunk_ids)
+            self._touched.update(chunk_ids)
+            self._dirty = True
+
+    def remove_source(self, source_file: str) -> None:
+        with self._lock:
+            chunk_ids = [
+                chunk_id for chunk_id, source in self._delta_source.items()
+                if source == source_file
+            ]
+            source = self._source_index.get(source_file)
+            if source is not None:
+                rows = np.flatnonzero(
+                    self._alive & (self._doc_source == source)
+                )
+                chunk_ids.extend(self._ids[i] for i in rows)
+            self.remove(chunk_ids)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.remove(self._live_ids())
+
+    def search(
+        self,
+        query: str,
+        top_n: int,
+        source_filter: str = None,
+        chunk_type: str = None,
+    ) -> list[tuple[str, float]]:
+        self._reload_if_stale()
+        terms = set(tokenize(query))
+
+        with self._lock:
+            n_docs = len(self)
+            if not n_docs or not terms or top_n <= 0:
+                return []
+            avg_len = self._total_len / n_docs
+            k1, b = self.k1, self.b
+
+            plan = []
+            for term in terms:
+                t = self._vocab.get(term)
+                lo, hi = (
+                    (int(self._offsets[t]), int(self._offsets[t + 1]))
+                    if t is not None else (0, 0)
+                )
+                delta = self._delta_postings.get(term, {})
+                # Deleted rows count towards df until the next compaction
+                df = min(hi - lo + len(delta), n_docs)
+                if not df:
+                    continue
+                max_tf = max(
+                    int(self._max_tf[t]) if t is not None else 0,
+                    max(delta.values(), default=0),
+                )
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                # A term can't add more than this to any score (doc length
+                # -> 0 maximises the BM25 tf part)
+                bound = idf * max_tf * (k1 + 1) / (max_tf + k1 * (1 - b))
+                plan.append((bound, idf, lo, hi, delta))
+            plan.sort(key=lambda p: p[0], reverse=True)
+
+            base_ok = self._base_filter(source_filter, chunk_type)
+            scores = np.zeros(len(self._ids))
+            candidates = np.zeros(0, np.int64)
+            delta_scores: dict[str, float] = {}
+            remaining = sum(p[0] for p in plan)
+
+            for bound, idf, lo, hi, delta in plan:
+                threshold = self._threshold(
+                    scores[candidates], delta_scores, top_n
+                )
+                essential = remaining > threshold
+                remaining -= bound
+
+                docs = self._post_docs[lo:hi]
+                tfs = self._post_tf[lo:hi]
+                if essential:
+                    keep = base_ok(docs)
+                    docs, tfs = docs[keep], tfs[keep]
+                    candidates = np.union1d(candidates, docs)
+                    items = [
+                        (chunk_id, tf) for chunk_id, tf in delta.items()
+                        if self._delta_ok(chunk_id, source_filter, chunk_type)
+                    ]
+                else:
+                    # Only documents already in the running can use this term
+                    pos = np.searchsorted(docs, candidates)
+                    hit = pos < len(docs)
+                    hit[hit] = docs[pos[hit]] == candidates[hit]
+                    docs, tfs = candidates[hit], tfs[pos[hit]]
+                    items = [
+                        (chunk_id, delta[chunk_id])
+                        for chunk_id in delta_scores if chunk_id in delta
+                    ]
+
+                if len(docs):
+                    tfs = tfs.astype(np.float64)
+                    norm = k1 * (1 - b + b * self._doc_len[docs] / avg_len)
+                    scores[docs] += idf * tfs * (k1 + 1) / (tfs + norm)
+                for chunk_id, tf in items:
+                    norm = k1 * (
+                        1 - b + b * self._delta_len[chunk_id] / avg_len
+                    )
+                    delta_scores[chunk_id] = delta_scores.get(chunk_id, 0.0) + (
+                        idf * tf * (k1 + 1) / (tf + norm)
+                    )
+
+            if len(candidates) > top_n:
+                best = np.argpartition(scores[candidates], -top_n)[-top_n:]
+                candidates = candidates[best]
+            results = [(self._ids[i], float(scores[i])) for i in candidates]
+            results.extend(delta_scores.items())
+
+        return heapq.nlargest(top_n, results, key=lambda item: item[1])
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(f"{self.path}.lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._sync()
+                self._compact()
+                self._generation += 1
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    np.savez(
+                        f, generation=np.int64(self._generation),
+                        **{name: self._arrays[name] for name in _ARRAYS},
+                        **{
+                            f"{name}_{part}": array
+                            for name in _STRINGS
+                            for part, array in zip(
+                                ("data", "offsets"), _pack(self._arrays[name])
+                            )
+                        },
+                    )
+                os.replace(tmp_path, self.path)
+            self._touched.clear()
+            self._dirty = False
+            self._last_save = time.monotonic()
+            self._loaded_mtime = os.path.getmtime(self.path)
+
+    def maybe_save(self, interval: float) -> None:
+        if self._dirty and time.monotonic() - self._last_save >= interval:
+            self.save()
+
+    def _reset(self, arrays: dict) -> None:
+        # Caller holds self._lock (or is __init__)
+        self._arrays = arrays
+        self._ids = arrays["ids"]
+        self._id_index = {chunk_id: i for i, chunk_id in enumerate(self._ids)}
+        self._doc_len = arrays["doc_len"]
+        self._doc_source = arrays["doc_source"]
+        self._sources = arrays["sources"]
+        self._source_index = {s: i for i, s in enumerate(self._sources)}
+        self._doc_type = arrays["doc_type"]
+        self._types = arrays["types"]
+        self._type_index = {t: i for i, t in enumerate(self._types)}
+        self._terms = arrays["terms"]
+        self._vocab = {term: i for i, term in enumerate(self._terms)}
+        self._offsets = arrays["offsets"]
+        self._post_docs = arrays["post_docs"]
+        self._post_tf = arrays["post_tf"]
+        self._max_tf = arrays["max_tf"]
+        self._alive = np.ones(len(self._ids), dtype=bool)
+        self._base_count = len(self._ids)
+        self._total_len = int(self._doc_len.sum())
+
+        self._delta_terms: dict[str, dict[str, int]] = {}
+        self._delta_postings: dict[str, dict[str, int]] = {}
+        self._delta_len: dict[str, int] = {}
+        self._delta_source: dict[str, str] = {}
+        self._delta_type: dict[str, str] = {}  # only non-"text" chunks
+
+    def _add_doc(
+        self, chunk_id: str, tf: dict[str, int], source_file: str, chunk_type: str
+    ) -> None:
+        # Caller holds self._lock and has removed any previous copy
+        self._delta_terms[chunk_id] = tf
+        for term, count in tf.items():
+            self._delta_postings.setdefault(term, {})[chunk_id] = count
+        length = sum(tf.values())
+        self._delta_len[chunk_id] = length
+        self._delta_source[chunk_id] = source_file
+        if chunk_type != "text":
+            self._delta_type[chunk_id] = chunk_type
+        self._total_len += length
+
+    def _remove_ids(self, chunk_ids: list[str]) -> None:
+        # Caller holds self._lock
+        for chunk_id in chunk_ids:
+            tf = self._delta_terms.pop(chunk_id, None)
+            if tf is not None:
+                for term in tf:
+                    postings = self._delta_postings[term]
+                    del postings[chunk_id]
+                    if not postings:
+                        del self._delta_postings[term]
+                self._total_len -= self._delta_len.pop(chunk_id)
+                del self._delta_source[chunk_id]
+                self._delta_type.pop(chunk_id, None)
+            row = self._id_index.get(chunk_id)
+            if row is not None and self._alive[row]:
+                self._alive[row] = False
+                self._base_count -= 1
+                self._total_len -= int(self._doc_len[row])
+
+    def _live_ids(self) -> list[str]:
+        return [self._ids[i] for i in np.flatnonzero(self._alive)] + list(
+            self._delta_terms
+        )
+
+    def _base_filter(self, source_filter: str, chunk_type: str):
+        source = type_ = None
+        if source_filter:
+            source = self._source_index.get(source_filter, -1)
+        if chunk_type:
+            type_ = self._type_index.get(chunk_type, -1)
+
+        def ok(rows: np.ndarray) -> np.ndarray:
+            keep = self._alive[rows]
+            if source is not None:
+                keep &= self._doc_source[rows] == source
+            if type_ is not None:
+                keep &= self._doc_type[rows] == type_
+            return keep
+
+        return ok
+
+    def _delta_ok(
+        self, chunk_id: str, source_filter: str, chunk_type: str
+    ) -> bool:
+        if source_filter and self._delta_source[chunk_id] != source_filter:
+            return False
+        return not chunk_type or (
+            self._delta_type.get(chunk_id, "text") == chunk_type
+        )
+
+    @staticmethod
+    def _threshold(
+        base: np.ndarray, delta: dict[str, float], top_n: int
+    ) -> float:
+        # Current top_n-th partial score: a lower bound on the final cut-off
+        if len(base) + len(delta) < top_n:
+            return -math.inf
+        values = np.concatenate(
+            [base, np.fromiter(delta.values(), np.float64, len(delta))]
+        )
+        return float(np.partition(values, len(values) - top_n)[-top_n])
+
+    def _compact(self) -> None:
+        # Caller holds self._lock. Folds the delta into the base arrays and
+        # drops deleted rows.
+        keep = np.flatnonzero(self._alive)
+        if len(keep) == len(self._ids) and not self._delta_terms:
+            return
+        row_map = np.full(len(self._ids), -1, np.int64)
+        row_map[keep] = np.arange(len(keep))
+        delta_ids = list(self._delta_terms)
+
+        terms = list(self._terms)
+        vocab = dict(self._vocab)
+        term_of = np.repeat(np.arange(len(terms)), np.diff(self._offsets))
+        new_rows = row_map[self._post_docs]
+        live = new_rows >= 0
+        delta_terms, delta_rows, delta_tfs = [], [], []
+        for j, chunk_id in enumerate(delta_ids):
+            for term, tf in self._delta_terms[chunk_id].items():
+                t = vocab.get(term)
+                if t is None:
+                    t = vocab[term] = len(terms)
+                    terms.append(term)
+                delta_terms.append(t)
+                delta_rows.append(len(keep) + j)
+                delta_tfs.append(tf)
+
+        post_terms = np.concatenate(
+            [term_of[live], np.asarray(delta_terms, np.int64)]
+        )
+        post_docs = np.concatenate(
+            [new_rows[live], np.asarray(delta_rows, np.int64)]
+        )
+        post_tf = np.concatenate([
+            self._post_tf[live],
+            np.minimum(np.asarray(delta_tfs, np.int64), 65535).astype(np.uint16),
+        ])
+        order = np.lexsort((post_docs, post_terms))
+        post_terms, post_docs, post_tf = (
+            post_terms[order], post_docs[order], post_tf[order]
+        )
+        used, counts = np.unique(post_terms, return_counts=True)
+        offsets = np.zeros(len(used) + 1, np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        max_tf = (
+            np.maximum.reduceat(post_tf, offsets[:-1])
+            if len(post_tf) else np.zeros(0, np.uint16)
+        )
+
+        sources, doc_source = _index(
+            [self._sources[s] for s in self._doc_source[keep]]
+            + [self._delta_source[c] for c in delta_ids]
+        )
+        types, doc_type = _index(
+            [self._types[t] for t in self._doc_type[keep]]
+            + [self._delta_type.get(c, "text") for c in delta_ids]
+        )
+        self._reset({
+            "ids": [self._ids[i] for i in keep] + delta_ids,
+            "doc_len": np.concatenate([
+                self._doc_len[keep],
+                np.array([self._delta_len[c] for c in delta_ids], np.int32),
+            ]).astype(np.int32),
+            "doc_source": doc_source,
+            "sources": sources,
+            "doc_type": doc_type,
+            "types": types,
+            "terms": [terms[t] for t in used.tolist()],
+            "offsets": offsets,
+            "post_docs": post_docs.astype(np.int32),
+            "post_tf": post_tf,
+            "max_tf": max_tf.astype(np.uint16),
+        })
+
+    def _export(self, chunk_ids: set[str]) -> list[tuple]:
+        # Caller holds self._lock. Current (chunk_id, tf, source, type) of
+        # the given IDs that are still indexed
+        docs = [
+            (
+                chunk_id,
+                self._delta_terms[chunk_id],
+                self._delta_source[chunk_id],
+                self._delta_type.get(chunk_id, "text"),
+            )
+            for chunk_id in chunk_ids if chunk_id in self._delta_terms
+        ]
+        rows = np.array(
+            [
+                row for row in (self._id_index.get(c) for c in chunk_ids)
+                if row is not None and self._alive[row]
+            ],
+            dtype=np.int64,
+        )
+        if len(rows):
+            term_of = np.repeat(np.arange(len(self._terms)), np.diff(self._offsets))
+            mask = np.isin(self._post_docs, rows)
+            tfs: dict[int, dict[str, int]] = {int(row): {} for row in rows}
+            for t, row, tf in zip(
+                term_of[mask], self._post_docs[mask], self._post_tf[mask]
+            ):
+                tfs[int(row)][self._terms[t]] = int(tf)
+            docs.extend(
+                (
+                    self._ids[row],
+                    tf,
+                    self._sources[self._doc_source[row]],
+                    self._types[self._doc_type[row]],
+                )
+                for row, tf in tfs.items()
+            )
+        return docs
+
+    def _read(self) -> tuple[int, dict] | None:
+        try:
+            with np.load(self.path, allow_pickle=False) as snapshot:
+                arrays = {name: snapshot[name] for name in _ARRAYS}
+                for name in _STRINGS:
+                    if f"{name}_data" in snapshot.files:
+                        arrays[name] = _unpack(
+                            snapshot[f"{name}_data"], snapshot[f"{name}_offsets"]
+                        )
+                    else:  # snapshots written as fixed-width unicode arrays
+                        arrays[name] = snapshot[name].tolist()
+                return int(snapshot["generation"]), arrays
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            logger.warning(f"Ignoring unreadable BM25 snapshot {self.path}: {e}")
+            return None
+
+    def _disk_generation(self) -> int:
+        try:
+            with np.load(self.path, allow_pickle=False) as snapshot:
+                return int(snapshot["generation"])
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            return self._generation
+
+    def _sync(self) -> None:
+        # Caller holds self._lock (or is __init__). Adopts a snapshot written
+        # by another process, replaying this process's unsaved changes
+        if self._disk_generation() == self._generation:
+            return
+        start = time.perf_counter()
+        snapshot = self._read()
+        if snapshot is None:
+            return
+        generation, arrays = snapshot
+        mine = self._export(self._touched)
+        self._reset(arrays)
+        self._remove_ids(list(self._touched))
+        for doc in mine:
+            self._add_doc(*doc)
+        self._generation = generation
+        self._loaded_mtime = os.path.getmtime(self.path)
+        logger.info(
+            f"Loaded BM25 index: {len(self._ids)} chunks, "
+            f"{len(self._terms)} terms in "
+            f"{(time.perf_counter() - start) * 1000:.0f}ms"
+        )
+
+    def _reload_if_stale(self) -> None:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime > self._loaded_mtime:
+            with self._lock:
+                if mtime > self._loaded_mtime:
+                    self._sync()
+                    self._loaded_mtime = mtime
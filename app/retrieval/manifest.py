@@ -0,0 +1,65 @@
+import json
+import os
+import sqlite3
+import threading
+
+
+# Per-source record of each indexed page's content hash and the chunk IDs
+# it produced. Lets re-uploads skip unchanged pages and find chunks that
+# no longer exist. Written only after a source's chunks are flushed, and
+# VectorStore drops pages whose chunks went missing anyway (see
+# reconcile_manifest) so they are re-indexed instead of skipped.
+class SourceManifest:
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "source_file TEXT NOT NULL, page_number INTEGER NOT NULL, "
+            "page_hash TEXT NOT NULL, chunk_ids TEXT NOT NULL, "
+            "PRIMARY KEY (source_file, page_number))"
+        )
+        self._conn.commit()
+
+    def get_pages(self, source_file: str) -> dict[int, tuple[str, list[str]]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT page_number, page_hash, chunk_ids FROM pages "
+                "WHERE source_file = ?",
+                (source_file,),
+            ).fetchall()
+        return {
+            page_number: (page_hash, json.loads(chunk_ids))
+            for page_number, page_hash, chunk_ids in rows
+        }
+
+    def chunk_counts(self) -> dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source_file, SUM(json_array_length(chunk_ids)) "
+                "FROM pages GROUP BY source_file"
+            ).fetchall()
+        return dict(rows)
+
+    def replace_source(
+        self, source_file: str, pages: dict[int, tuple[str, list[str]]]
+    ) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM pages WHERE source_file = ?", (source_file,)
+            )
+            self._conn.executemany(
+                "INSERT INTO pages (source_file, page_number, page_hash, "
+                "chunk_ids) VALUES (?, ?, ?, ?)",
+                [
+                    (source_file, page_number, page_hash, json.dumps(chunk_ids))
+                    for page_number, (page_hash, chunk_ids) in pages.items()
+                ],
+            )
+
+    def delete_source(self, source_file: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM pages WHERE source_file = ?", (source_file,)
+            )
@@ -0,0 +1,734 @@
+import fcntl
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterator
+import numpy as np
+from loguru import logger
+
+_DTYPES = {"int8": np.int8, "float16": np.float16}
+_SQL_BATCH = 500  # stays under SQLite's bound-parameter limit
+_QUERY_GROUP = 16  # queries scored together in one matrix product
+# Rows dequantized to float32 at a time, which bounds scoring memory to
+# _SCORE_BLOCK x dim x 4 bytes whatever the index size
+_SCORE_BLOCK = 8192
+# Tombstoned rows are compacted away once they are this share of all rows
+_COMPACT_RATIO = 0.25
+_COMPACT_MIN_ROWS = 1024
+_FILES = ("vectors", "scales", "full", "sources", "types", "alive", "lists")
+_CHUNK_TYPES = ("text", "table")  # stored as their index in types.bin
+
+
+# Open writer.lock handles, one per index directory held by this process
+_writer_locks: dict[str, object] = {}
+_writer_locks_lock = threading.Lock()
+
+
+def _lock_writer(path: str) -> None:
+    # Each process keeps its own row count and maps, so two processes
+    # writing one index corrupt it. The first to open the directory holds
+    # the lock until it exits; later opens in the same process share it.
+    path = os.path.abspath(path)
+    with _writer_locks_lock:
+        if path in _writer_locks:
+            return
+        lock_file = open(os.path.join(path, "writer.lock"), "a+")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.seek(0)
+            holder = lock_file.read().strip() or "unknown"
+            lock_file.close()
+            raise RuntimeError(
+                f"Vector index at {path} is in use by another process "
+                f"(pid {holder}); stop it before opening the index here"
+            ) from None
+        lock_file.truncate(0)
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        _writer_locks[path] = lock_file
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+# Flat vector index on memory-mapped files under one directory:
+#
+#   vectors.bin   (capacity, dim) int8 or float16, quantized unit vectors
+#   scales.bin    (capacity,) float32, per-vector dequantization scale
+#   full.bin      (capacity, dim) float32, used only to rescore shortlists
+#   sources.bin   (capacity,) int32, source id per row for source_filter
+#   types.bin     (capacity,) uint8, index into _CHUNK_TYPES per row
+#   alive.bin     (capacity,) uint8, 0 marks a tombstoned row
+#   lists.bin     (capacity,) int32, IVF list per row (-1 = unassigned)
+#
+# Text and metadata live in records.db keyed by row. Search scores the
+# quantized matrix in blocks of _SCORE_BLOCK rows, keeping a running
+# shortlist per query, and re-ranks the shortlist against full.bin, so only
+# the shortlist's float32 pages are touched. With ivf_lists set, a spherical
+# k-means coarse quantizer (trained on a background thread once the index
+# has ivf_min_rows live rows) restricts scoring to the rows of the nearest
+# ivf_probe lists, which are kept as per-list row arrays. Deletes tombstone
+# rows; once they pass _COMPACT_RATIO of the file the live rows are copied
+# into new files and renumbered. One instance is shared per path within a
+# process, since the in-memory row count and maps must not diverge, and
+# writer.lock keeps a second process from opening the same directory.
+class NumpyBackend:
+    name = "numpy"
+    _instances: dict[str, "NumpyBackend"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(
+        self,
+        path: str,
+        dtype: str = "int8",
+        rescore_factor: int = 4,
+        ivf_lists: int = 0,
+        ivf_probe: int = 8,
+        ivf_min_rows: int = 50000,
+    ):
+        if dtype not in _DTYPES:
+            raise ValueError(
+                f"Unknown vector dtype '{dtype}'. Choose one of: {', '.join(_DTYPES)}"
+            )
+        os.makedirs(path, exist_ok=True)
+        _lock_writer(path)
+        self.path = path
+        self.rescore_factor = rescore_factor
+        self.ivf_lists = ivf_lists
+        self.ivf_probe = ivf_probe
+        self.ivf_min_rows = ivf_min_rows
+        self._lock = threading.RLock()
+
+        self._conn = sqlite3.connect(
+            os.path.join(path, "records.db"), check_same_thread=False
+        )
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS records ("
+            "chunk_id TEXT PRIMARY KEY, row INTEGER UNIQUE NOT NULL, "
+            "text TEXT NOT NULL, source_id INTEGER NOT NULL, "
+            "page_number INTEGER NOT NULL, chunk_index INTEGER NOT NULL, "
+            "chunk_type TEXT NOT NULL DEFAULT 'text');"
+            "CREATE INDEX IF NOT EXISTS records_source ON records (source_id);"
+            "CREATE TABLE IF NOT EXISTS sources ("
+            "source_id INTEGER PRIMARY KEY, source_file TEXT UNIQUE NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);"
+        )
+        columns = {
+            name for _, name, *_ in self._conn.execute("PRAGMA table_info(records)")
+        }
+        if "chunk_type" not in columns:
+            self._conn.execute(
+                "ALTER TABLE records ADD COLUMN "
+                "chunk_type TEXT NOT NULL DEFAULT 'text'"
+            )
+        meta = dict(self._conn.execute("SELECT key, value FROM meta"))
+        stored_dtype = meta.get("dtype", dtype)
+        if stored_dtype != dtype:
+            raise ValueError(
+                f"Index at {path} stores {stored_dtype} vectors; "
+                f"delete it or set the dtype back to {stored_dtype}"
+            )
+        if meta.get("compact_pending") == "1":
+            self._finish_compaction()
+        else:
+            self._discard_compaction()
+        self.dtype = np.dtype(_DTYPES[dtype])
+        self._dim = int(meta.get("dim", 0))
+        self._rows = int(meta.get("rows", 0))
+        self._ivf_rows = int(meta.get("ivf_rows", 0))
+        self._source_ids = {
+            source_file: source_id
+            for source_id, source_file in self._conn.execute(
+                "SELECT source_id, source_file FROM sources"
+            )
+        }
+
+        self._live = self._conn.execute(
+            "SELECT COUNT(*) FROM records"
+        ).fetchone()[0]
+
+        self._capacity = 0
+        self._centroids = None
+        self._list_rows: list[list[np.ndarray]] | None = None
+        self._training: threading.Thread | None = None
+        self._retrain_rows: list[np.ndarray] | None = None
+        if self._dim:
+            self._remap(max(self._rows, 1024))
+            centroids_path = os.path.join(path, "centroids.npy")
+            if os.path.exists(centroids_path):
+                self._centroids = np.load(centroids_path)
+                self._rebuild_lists()
+            logger.info(
+                f"Opened {dtype} vector index: {self._rows} rows, "
+                f"dim={self._dim}"
+            )
+            with self._lock:
+                self._maybe_train_ivf()
+
+    @classmethod
+    def open(cls, path: str, **options) -> "NumpyBackend":
+        with cls._instances_lock:
+            if path not in cls._instances:
+                cls._instances[path] = cls(path, **options)
+            return cls._instances[path]
+
+    def upsert(
+        self,
+        ids: list[str],
+        documents: list[str],
+        embeddings: list[list[float]],
+        metadatas: list[dict],
+    ) -> None:
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+        with self._lock, self._conn:
+            if not self._dim:
+                self._dim = vectors.shape[1]
+                self._set_meta(dim=self._dim, dtype=self.dtype.name)
+                self._remap(1024)
+
+            existing = self._rows_for(ids)
+            rows = []
+            for chunk_id in ids:
+                row = existing.get(chunk_id)
+                if row is None:
+                    row = existing[chunk_id] = self._rows
+                    self._rows += 1
+                    self._live += 1
+                rows.append(row)
+            if self._rows > self._capacity:
+                self._remap(max(self._rows, self._capacity * 2))
+
+            source_ids = np.array(
+                [self._source_id(m["source_file"]) for m in metadatas],
+                dtype=np.int32,
+            )
+            rows = np.array(rows, dtype=np.int64)
+            quantized, scales = self._quantize(vectors)
+            self._vectors[rows] = quantized
+            self._scales[rows] = scales
+            self._full[rows] = vectors
+            self._sources[rows] = source_ids
+            self._types[rows] = [
+                _CHUNK_TYPES.index(m.get("chunk_type", "text")) for m in metadatas
+            ]
+            if self._centroids is not None:
+                lists = self._assign(vectors)
+                self._lists[rows] = lists
+                for c in np.unique(lists):
+                    self._list_rows[c].append(rows[lists == c])
+            else:
+                self._lists[rows] = -1
+            if self._retrain_rows is not None:
+                self._retrain_rows.append(rows)
+            self._alive[rows] = 1
+
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO records (chunk_id, row, text, "
+                "source_id, page_number, chunk_index, chunk_type) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        chunk_id, int(row), text, int(source_id),
+                        meta["page_number"], meta.get("chunk_index", 0),
+                        meta.get("chunk_type", "text"),
+                    )
+                    for chunk_id, row, text, source_id, meta in zip(
+                        ids, rows, documents, source_ids, metadatas
+                    )
+                ],
+            )
+            self._set_meta(rows=self._rows)
+            self._maybe_train_ivf()
+
+    def query(
+        self,
+        query_embeddings: list[list[float]],
+        n_results: int,
+        source_filter: str = None,
+        chunk_type: str = None,
+    ) -> list[list[dict]]:
+        queries = _normalize(np.asarray(query_embeddings, dtype=np.float32))
+        if chunk_type and chunk_type not in _CHUNK_TYPES:
+            return [[] for _ in queries]
+        type_id = _CHUNK_TYPES.index(chunk_type) if chunk_type else None
+        with self._lock:
+            if not self._live:
+                return [[] for _ in queries]
+
+            hits = []
+            if source_filter:
+                # One source is brute-forced over its rows, found from the
+                # source id column rather than a SQLite lookup per query
+                source_id = self._source_ids.get(source_filter)
+                if source_id is None:
+                    return [[] for _ in queries]
+                mask = self._sources[:self._rows] == source_id
+                mask &= self._alive[:self._rows].astype(bool)
+                if type_id is not None:
+                    mask &= self._types[:self._rows] == type_id
+                rows = np.flatnonzero(mask)
+            elif self._ivf_ready():
+                for q in queries:
+                    probe = np.argpartition(
+                        -(self._centroids @ q),
+                        min(self.ivf_probe, len(self._centroids)) - 1,
+                    )[:self.ivf_probe]
+                    # A re-upserted row can sit in two lists until the next
+                    # compaction or training run
+                    rows = np.unique(
+                        np.concatenate([self._members(c) for c in probe])
+                    )
+                    rows = rows[self._alive[rows].astype(bool)]
+                    if type_id is not None:
+                        rows = rows[self._types[rows] == type_id]
+                    hits.append(self._top_k(rows, q[None, :], n_results)[0])
+                return self._records(hits)
+            else:
+                mask = self._alive[:self._rows].astype(bool)
+                if type_id is not None:
+                    mask &= self._types[:self._rows] == type_id
+                rows = np.flatnonzero(mask)
+
+            for i in range(0, len(queries), _QUERY_GROUP):
+                hits.extend(self._top_k(
+                    rows, queries[i:i + _QUERY_GROUP], n_results
+                ))
+            return self._records(hits)
+
+    def get(self, ids: list[str], source_file: str = None) -> list[dict]:
+        # source_file is a routing hint for ShardedBackend; IDs are unique
+        with self._lock:
+            rows = self._rows_for(ids)
+            records = self._fetch("r.chunk_id", ids)
+            for record in records:
+                record["embedding"] = self._full[rows[record["chunk_id"]]].tolist()
+        return records
+
+    def iter_records(
+        self, page_size: int = 5000, source_file: str = None
+    ) -> Iterator[list[dict]]:
+        where = "WHERE s.source_file = ? " if source_file else ""
+        params = (source_file,) if source_file else ()
+        offset = 0
+        while True:
+            with self._lock:
+                page = self._conn.execute(
+                    "SELECT r.chunk_id, r.text, s.source_file, r.page_number, "
+                    "r.chunk_type FROM records r "
+                    "JOIN sources s ON s.source_id = r.source_id "
+                    f"{where}ORDER BY r.row LIMIT ? OFFSET ?",
+                    (*params, page_size, offset),
+                ).fetchall()
+            if not page:
+                return
+            yield [
+                {
+                    "chunk_id": chunk_id,
+                    "text": text,
+                    "source_file": source_file,
+                    "page_number": page_number,
+                    "chunk_type": chunk_type,
+                }
+                for chunk_id, text, source_file, page_number, chunk_type in page
+            ]
+            offset += len(page)
+
+    def sources(self) -> list[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source_file FROM sources s WHERE EXISTS ("
+                "SELECT 1 FROM records r WHERE r.source_id = s.source_id) "
+                "ORDER BY source_file"
+            ).fetchall()
+        return [source_file for (source_file,) in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def delete(self, ids: list[str], source_file: str = None) -> None:
+        with self._lock:
+            with self._conn:
+                rows = self._rows_for(ids)
+                self._tombstone(list(rows.values()))
+                for i in range(0, len(ids), _SQL_BATCH):
+                    batch = ids[i:i + _SQL_BATCH]
+                    self._conn.execute(
+                        f"DELETE FROM records WHERE chunk_id IN "
+                        f"({','.join('?' * len(batch))})",
+                        batch,
+                    )
+            self._maybe_compact()
+
+    def delete_source(self, source_file: str) -> None:
+        with self._lock:
+            source_id = self._source_ids.get(source_file)
+            if source_id is None:
+                return
+            with self._conn:
+                rows = [
+                    row for (row,) in self._conn.execute(
+                        "SELECT row FROM records WHERE source_id = ?",
+                        (source_id,),
+                    )
+                ]
+                self._tombstone(rows)
+                self._conn.execute(
+                    "DELETE FROM records WHERE source_id = ?", (source_id,)
+                )
+            self._maybe_compact()
+
+    def compact(self) -> int:
+        # Copies live rows into new files, renumbers them in records.db and
+        # swaps the files in. Returns the number of rows dropped.
+        with self._lock:
+            if self._training is not None or not self._rows:
+                return 0
+            live_rows = np.flatnonzero(self._alive[:self._rows])
+            dropped = self._rows - len(live_rows)
+            if not dropped:
+                return 0
+            start = time.perf_counter()
+            self.flush()
+            capacity = max(len(live_rows), 1024)
+            for name, array in zip(_FILES, self._arrays()):
+                shape = (capacity,) + array.shape[1:]
+                new = self._map(
+                    name, array.dtype, shape,
+                    fill=-1 if name == "lists" else 0, suffix=".new",
+                )
+                for i in range(0, len(live_rows), 65536):
+                    block = live_rows[i:i + 65536]
+                    new[i:i + len(block)] = array[block]
+                new.flush()
+                del new
+
+            # Rows only move down, so ascending updates never collide on
+            # the UNIQUE row column
+            with self._conn:
+                self._conn.executemany(
+                    "UPDATE records SET row = ? WHERE row = ?",
+                    [
+                        (new_row, int(old_row))
+                        for new_row, old_row in enumerate(live_rows)
+                        if new_row != old_row
+                    ],
+                )
+                self._set_meta(rows=len(live_rows), compact_pending=1)
+            self._finish_compaction()
+
+            self._rows = self._live = len(live_rows)
+            self._capacity = 0
+            self._remap(capacity)
+            if self._centroids is not None:
+                self._rebuild_lists()
+            logger.info(
+                f"Compacted vector index: dropped {dropped} tombstoned rows, "
+                f"{self._rows} left in "
+                f"{(time.perf_counter() - start) * 1000:.0f}ms"
+            )
+            return dropped
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._capacity:
+                for array in self._arrays():
+                    array.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": self.name,
+                "dtype": self.dtype.name,
+                "dim": self._dim,
+                "rows": self._rows,
+                "live": self._live,
+                "tombstoned": self._rows - self._live,
+                "ivf_lists": (
+                    len(self._centroids) if self._centroids is not None else 0
+                ),
+                "disk_bytes": sum(a.nbytes for a in self._arrays()) if self._capacity else 0,
+            }
+
+    def _top_k(
+        self, rows: np.ndarray, queries: np.ndarray, n_results: int
+    ) -> list[list[tuple[int, float]]]:
+        if not len(rows):
+            return [[] for _ in queries]
+        shortlist_size = min(n_results * self.rescore_factor, len(rows))
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+        for i in range(0, len(rows), _SCORE_BLOCK):
+            block = rows[i:i + _SCORE_BLOCK]
+            approx = (
+                queries @ self._vectors[block].astype(np.float32).T
+            ) * self._scales[block]
+            best_rows = np.concatenate(
+                [best_rows, np.broadcast_to(block, approx.shape)], axis=1
+            )
+            best_scores = np.concatenate([best_scores, approx], axis=1)
+            if best_scores.shape[1] > shortlist_size:
+                keep = np.argpartition(
+                    -best_scores, shortlist_size - 1, axis=1
+                )[:, :shortlist_size]
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+
+        results = []
+        for j, q in enumerate(queries):
+            candidates = np.sort(best_rows[j])
+            exact = self._full[candidates] @ q
+            order = np.argsort(-exact)[:n_results]
+            results.append([
+                (int(candidates[i]), float(exact[i])) for i in order
+            ])
+        return results
+
+    def _records(
+        self, hits: list[list[tuple[int, float]]]
+    ) -> list[list[dict]]:
+        rows = sorted({row for query_hits in hits for row, _ in query_hits})
+        by_row = {r.pop("row"): r for r in self._fetch("r.row", rows)}
+        return [
+            [
+                dict(by_row[row], score=round(score, 4))
+                for row, score in query_hits
+                if row in by_row
+            ]
+            for query_hits in hits
+        ]
+
+    def _fetch(self, column: str, keys: list) -> list[dict]:
+        records = []
+        for i in range(0, len(keys), _SQL_BATCH):
+            batch = keys[i:i + _SQL_BATCH]
+            records.extend(
+                {
+                    "row": row,
+                    "text": text,
+                    "source_file": source_file,
+                    "page_number": page_number,
+                    "chunk_index": chunk_index,
+                    "chunk_type": chunk_type,
+                    "chunk_id": chunk_id,
+                }
+                for (
+                    row, chunk_id, text, source_file, page_number, chunk_index,
+                    chunk_type,
+                ) in self._conn.execute(
+                    "SELECT r.row, r.chunk_id, r.text, s.source_file, "
+                    "r.page_number, r.chunk_index, r.chunk_type FROM records r "
+                    "JOIN sources s ON s.source_id = r.source_id "
+                    f"WHERE {column} IN ({','.join('?' * len(batch))})",
+                    batch,
+                )
+            )
+        return records
+
+    def _rows_for(self, ids: list[str]) -> dict[str, int]:
+        rows = {}
+        for i in range(0, len(ids), _SQL_BATCH):
+            batch = ids[i:i + _SQL_BATCH]
+            rows.update(self._conn.execute(
+                f"SELECT chunk_id, row FROM records WHERE chunk_id IN "
+                f"({','.join('?' * len(batch))})",
+                batch,
+            ))
+        return rows
+
+    def _source_id(self, source_file: str) -> int:
+        # Caller holds self._lock
+        if source_file not in self._source_ids:
+            cursor = self._conn.execute(
+                "INSERT INTO sources (source_file) VALUES (?)", (source_file,)
+            )
+            self._source_ids[source_file] = cursor.lastrowid
+        return self._source_ids[source_file]
+
+    def _tombstone(self, rows: list[int]) -> None:
+        # Caller holds self._lock
+        if rows:
+            rows = np.array(rows, dtype=np.int64)
+            self._live -= int(self._alive[rows].sum())
+            self._alive[rows] = 0
+
+    def _maybe_compact(self) -> None:
+        # Caller holds self._lock
+        dead = self._rows - self._live
+        if dead >= max(_COMPACT_MIN_ROWS, self._rows * _COMPACT_RATIO):
+            self.compact()
+
+    def _finish_compaction(self) -> None:
+        # records.db already points at the new rows, so the new files win,
+        # including when a crash interrupted the swap
+        for name in _FILES:
+            new_path = self._file(name, ".new")
+            if os.path.exists(new_path):
+                os.replace(new_path, self._file(name))
+        with self._conn:
+            self._set_meta(compact_pending=0)
+
+    def _discard_compaction(self) -> None:
+        # New files from a compaction that never reached records.db
+        for name in _FILES:
+            if os.path.exists(self._file(name, ".new")):
+                os.remove(self._file(name, ".new"))
+
+    def _quantize(self, vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        if self.dtype == np.int8:
+            scales = np.abs(vectors).max(axis=1) / 127
+            scales[scales == 0] = 1.0
+            quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+            return quantized, scales.astype(np.float32)
+        return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+
+    def _ivf_ready(self) -> bool:
+        # Caller holds self._lock. Until the first training run finishes,
+        # queries brute-force
+        return (
+            self._centroids is not None
+            and self._live >= self.ivf_min_rows
+        )
+
+    def _maybe_train_ivf(self) -> None:
+        # Caller holds self._lock. (Re)trains on a background thread once
+        # the index reaches ivf_min_rows and again whenever it has doubled
+        if not self.ivf_lists or self._training is not None:
+            return
+        if self._live < max(self.ivf_min_rows, self.ivf_lists):
+            return
+        if self._centroids is not None and self._live <= 2 * self._ivf_rows:
+            return
+        self._retrain_rows = []
+        self._training = threading.Thread(
+            target=self._train_ivf, name="ivf-train", daemon=True
+        )
+        self._training.start()
+
+    def _train_ivf(self, iterations: int = 10) -> None:
+        try:
+            start = time.perf_counter()
+            with self._lock:
+                n_rows = self._rows
+                live_rows = np.flatnonzero(self._alive[:n_rows])
+                rng = np.random.default_rng(0)
+                sample_rows = np.sort(rng.choice(
+                    live_rows,
+                    size=min(len(live_rows), self.ivf_lists * 64),
+                    replace=False,
+                ))
+                sample = np.asarray(self._full[sample_rows])
+                full = self._full
+
+            # k-means and the bulk assignment run without the lock; rows
+            # written meanwhile are collected in _retrain_rows
+            centroids = sample[
+                rng.choice(len(sample), self.ivf_lists, replace=False)
+            ]
+            for _ in range(iterations):
+                assignment = np.argmax(sample @ centroids.T, axis=1)
+                for c in range(self.ivf_lists):
+                    members = sample[assignment == c]
+                    if len(members):
+                        centroids[c] = members.mean(axis=0)
+                centroids = _normalize(centroids)
+            centroids = centroids.astype(np.float32)
+            lists = np.empty(n_rows, dtype=np.int32)
+            for i in range(0, n_rows, 65536):
+                block = slice(i, min(i + 65536, n_rows))
+                lists[block] = np.argmax(
+                    np.asarray(full[block]) @ centroids.T, axis=1
+                )
+
+            with self._lock:
+                self._centroids = centroids
+                self._lists[:n_rows] = lists
+                redo = np.concatenate(
+                    self._retrain_rows + [np.arange(n_rows, self._rows)]
+                ).astype(np.int64)
+                if len(redo):
+                    self._lists[redo] = self._assign(np.asarray(self._full[redo]))
+                self._rebuild_lists()
+                np.save(os.path.join(self.path, "centroids.npy"), centroids)
+                self._ivf_rows = len(live_rows)
+                with self._conn:
+                    self._set_meta(ivf_rows=self._ivf_rows)
+            logger.info(
+                f"Trained IVF with {self.ivf_lists} lists on {len(sample)} "
+                f"vectors in {(time.perf_counter() - start) * 1000:.0f}ms"
+            )
+        except Exception as e:
+            logger.error(f"IVF training failed: {e}")
+        finally:
+            with self._lock:
+                self._retrain_rows = None
+                self._training = None
+
+    def _rebuild_lists(self) -> None:
+        # Caller holds self._lock. Row IDs per IVF list, for probing
+        lists = np.asarray(self._lists[:self._rows])
+        rows = np.flatnonzero(self._alive[:self._rows].astype(bool) & (lists >= 0))
+        rows = rows[np.argsort(lists[rows], kind="stable")]
+        counts = np.bincount(lists[rows], minlength=len(self._centroids))
+        self._list_rows = [
+            [members] for members in np.split(rows, np.cumsum(counts)[:-1])
+        ]
+
+    def _members(self, c: int) -> np.ndarray:
+        # Caller holds self._lock. Rows appended since the last call are
+        # concatenated once here
+        chunks = self._list_rows[c]
+        if len(chunks) > 1:
+            chunks[:] = [np.concatenate(chunks)]
+        return chunks[0]
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        return np.argmax(vectors @ self._centroids.T, axis=1).astype(np.int32)
+
+    def _set_meta(self, **values) -> None:
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [(key, str(value)) for key, value in values.items()],
+        )
+
+    def _remap(self, capacity: int) -> None:
+        # Caller holds self._lock. Files only ever grow; existing rows keep
+        # their offsets so remapping is a truncate() plus a new mmap.
+        if self._capacity:
+            self.flush()
+        self._capacity = capacity
+        self._vectors = self._map("vectors", self.dtype, (capacity, self._dim))
+        self._scales = self._map("scales", np.float32, (capacity,))
+        self._full = self._map("full", np.float32, (capacity, self._dim))
+        self._sources = self._map("sources", np.int32, (capacity,))
+        self._types = self._map("types", np.uint8, (capacity,))
+        self._alive = self._map("alive", np.uint8, (capacity,))
+        self._lists = self._map("lists", np.int32, (capacity,), fill=-1)
+
+    def _file(self, name: str, suffix: str = "") -> str:
+        return os.path.join(self.path, f"{name}.bin{suffix}")
+
+    def _map(
+        self, name: str, dtype, shape: tuple, fill: int = 0, suffix: str = ""
+    ) -> np.memmap:
+        file_path = self._file(name, suffix)
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        current = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+        if current < size:
+            with open(file_path, "ab") as f:
+                f.truncate(size)
+        array = np.memmap(file_path, dtype=dtype, mode="r+", shape=shape)
+        if fill and current < size:
+            array.reshape(-1)[current // np.dtype(dtype).itemsize:] = fill
+        return array
+
+    def _arrays(self) -> list[np.memmap]:
+        return [
+            self._vectors, self._scales, self._full,
+            self._sources, self._types, self._alive, self._lists,
+        ]
@@ -1,14 +1,47 @@
-import anthropic
+import asyncio
+import threading
+import time
 from loguru import logger
 from app.core.config import settings
+from app.core.executors import ExecutorBusy, query_executor
+from app.core.tracing import (
+    Span,
+    cache_events,
+    llm_seconds_saved,
+    llm_skipped,
+    llm_tokens,
+    record,
+    span,
+)
+from app.retrieval.adaptive_k import AdaptiveTopK
+from app.retrieval.answer_cache import AnswerCache
+from app.retrieval.context_packer import ContextPacker
+from app.retrieval.reranker import get_reranker
 from app.retrieval.vector_store import VectorStore
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from typing import AsyncIterator, Iterator
 
 @dataclass
 class RAGResponse:
     answer: str
     sources: list[dict]  
     confidence: float
+    rerank: dict | None = None
+
+
+@dataclass
+class Retrieval:
+    results: list[dict]
+    rerank: dict | None = None
+
+LLM_ERROR_PREFIX = "Error generating answer"
+
+# What the model is told to say when the context can't answer the question
+NO_ANSWER = (
+    "I don't have enough information in the provided documents "
+    "to answer this question."
+)
 
 SYSTEM_PROMPT = """You are a precise document analysis assistant.
 You answer questions ONLY based on the provided context from the
@@ -25,20 +58,272 @@ documents. Follow these rules strictly:
 """
 
 class RAGChain:
-    def __init__(self):
-        self.vector_store = VectorStore()
-        self.client = anthropic.Anthropic(
-            api_key=settings.anthropic_api_key
+    def __init__(self, vector_store: VectorStore = None):
+        # Pass the application's store so both share one backend and index
+        self.vector_store = vector_store or VectorStore()
+        self._client = None
+        self._async_client = None
+        self._client_lock = threading.Lock()
+        self._llm_slots = asyncio.Semaphore(settings.llm_concurrency)
+        self.reranker = get_reranker(settings.reranker)
+        self.adaptive_k = None
+        if settings.adaptive_top_k:
+            self.adaptive_k = AdaptiveTopK(
+                min_k=settings.adaptive_min_k,
+                max_k=settings.adaptive_max_k,
+                min_gap=settings.adaptive_min_gap,
+            )
+        # Mean LLM latency, used to estimate what an early exit saved
+        self._llm_stats_lock = threading.Lock()
+        self._llm_calls = 0
+        self._llm_seconds = 0.0
+        self._llm_skipped: dict[str, int] = {}
+        self._llm_seconds_saved = 0.0
+        self.context_packer = ContextPacker(
+            token_budget=settings.context_token_budget,
+            dedup_threshold=settings.context_dedup_threshold,
+            max_overlap=settings.chunk_overlap * 2,
         )
-    
-    def query(self, question: str, source_filter: str = None) -> RAGResponse:
-        logger.info("Question: {question}")
-        results = self.vector_store.search(
-            query=question,
-            top_k=settings.top_k,
-            source_filter=source_filter,
+        self.answer_cache = None
+        if settings.answer_cache_enabled:
+            self.answer_cache = AnswerCache(
+                threshold=settings.answer_cache_threshold,
+                max_entries=settings.answer_cache_max_entries,
+            )
+            VectorStore.add_change_listener(
+                self.answer_cache.invalidate_sources
+            )
+
+    # The anthropic SDK is slow to import, so it loads with the first LLM call
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import anthropic
+                    self._client = anthropic.Anthropic(
+                        api_key=settings.anthropic_api_key
+                    )
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            with self._client_lock:
+                if self._async_client is None:
+                    import anthropic
+                    self._async_client = anthropic.AsyncAnthropic(
+                        api_key=settings.anthropic_api_key
+                    )
+        return self._async_client
+
+    def query(
+        self, question: str, source_filter: str = None, chunk_type: str = None
+    ) -> RAGResponse:
+        logger.info(f"Question: {question}")
+        retrieval = self._retrieve(question, source_filter, chunk_type)
+
+        early = self._early_response(question, retrieval)
+        if early is not None:
+            return early
+
+        context = self._build_context(retrieval.results)
+        answer = self._generate_answer(question, context)
+        return self._finish(question, retrieval, answer)
+
+    async def aquery(
+        self, question: str, source_filter: str = None, chunk_type: str = None
+    ) -> RAGResponse:
+        logger.info(f"Question: {question}")
+        await self._aembed_question(question)
+        # Chroma is blocking, so keep it off the event loop
+        retrieval = await query_executor.run(
+            self._retrieve, question, source_filter, chunk_type
         )
-    
+
+        early = await query_executor.run(
+            self._early_response, question, retrieval
+        )
+        if early is not None:
+            return early
+
+        context = self._build_context(retrieval.results)
+        answer = await self._agenerate_answer(question, context)
+        return await self._afinish(question, retrieval, answer)
+
+    def query_many(
+        self,
+        questions: list[str],
+        source_filter: str = None,
+        chunk_type: str = None,
+    ) -> list[RAGResponse]:
+        logger.info(f"Batch of {len(questions)} questions")
+        retrievals = self._retrieve_many(questions, source_filter, chunk_type)
+
+        def answer(item: tuple[str, Retrieval]) -> RAGResponse:
+            question, retrieval = item
+            early = self._early_response(question, retrieval)
+            if early is not None:
+                return early
+            context = self._build_context(retrieval.results)
+            return self._finish(
+                question, retrieval, self._generate_answer(question, context)
+            )
+
+        # map() keeps input order; the pool bounds concurrent LLM calls
+        with ThreadPoolExecutor(max_workers=settings.llm_concurrency) as pool:
+            return list(pool.map(answer, zip(questions, retrievals)))
+
+    async def aquery_many(
+        self,
+        questions: list[str],
+        source_filter: str = None,
+        chunk_type: str = None,
+    ) -> list[RAGResponse]:
+        logger.info(f"Batch of {len(questions)} questions")
+        retrievals = await query_executor.run(
+            self._retrieve_many, questions, source_filter, chunk_type
+        )
+        early = await query_executor.run(
+            lambda: [
+                self._early_response(q, r)
+                for q, r in zip(questions, retrievals)
+            ]
+        )
+
+        async def answer(i: int) -> RAGResponse:
+            if early[i] is not None:
+                return early[i]
+            context = self._build_context(retrievals[i].results)
+            generated = await self._agenerate_answer(questions[i], context)
+            return await self._afinish(questions[i], retrievals[i], generated)
+
+        # gather() keeps input order; _llm_slots bounds concurrent LLM calls
+        return list(await asyncio.gather(
+            *(answer(i) for i in range(len(questions)))
+        ))
+
+    def stream_query(
+        self, question: str, source_filter: str = None, chunk_type: str = None
+    ) -> Iterator[dict]:
+        # Events: one "sources" event, then "token" events, then "done"
+        logger.info(f"Question (streaming): {question}")
+        retrieval = self._retrieve(question, source_filter, chunk_type)
+
+        early = self._early_response(question, retrieval)
+        if early is not None:
+            yield from self._response_events(early)
+            return
+
+        yield self._sources_event(retrieval)
+        context = self._build_context(retrieval.results)
+        parts = []
+        for text in self._stream_answer(question, context):
+            parts.append(text)
+            yield {"type": "token", "text": text}
+
+        self._finish(question, retrieval, "".join(parts))
+        yield {"type": "done"}
+
+    async def astream_query(
+        self, question: str, source_filter: str = None, chunk_type: str = None
+    ) -> AsyncIterator[dict]:
+        logger.info(f"Question (streaming): {question}")
+        await self._aembed_question(question)
+        retrieval = await query_executor.run(
+            self._retrieve, question, source_filter, chunk_type
+        )
+
+        early = await query_executor.run(
+            self._early_response, question, retrieval
+        )
+        if early is not None:
+            for event in self._response_events(early):
+                yield event
+            return
+
+        yield self._sources_event(retrieval)
+        context = self._build_context(retrieval.results)
+        parts = []
+        async for text in self._astream_answer(question, context):
+            parts.append(text)
+            yield {"type": "token", "text": text}
+
+        await self._afinish(question, retrieval, "".join(parts))
+        yield {"type": "done"}
+
+    async def _aembed_question(self, question: str) -> None:
+        # Fills the query-embedding cache that search() reads, through the
+        # micro-batcher's async path, so no executor thread sits out the
+        # batching window
+        await self.vector_store.embedder.aembed_query(question)
+
+    def _sources_event(self, retrieval: Retrieval) -> dict:
+        return {
+            "type": "sources",
+            "sources": retrieval.results,
+            "confidence": (
+                self._confidence(retrieval.results) if retrieval.results else 0.0
+            ),
+            "rerank": retrieval.rerank,
+        }
+
+    def _response_events(self, response: RAGResponse) -> Iterator[dict]:
+        yield {
+            "type": "sources",
+            "sources": response.sources,
+            "confidence": response.confidence,
+            "rerank": response.rerank,
+        }
+        yield {"type": "token", "text": response.answer}
+        yield {"type": "done"}
+
+    def _retrieve(
+        self, question: str, source_filter: str = None, chunk_type: str = None
+    ) -> Retrieval:
+        return self._retrieve_many([question], source_filter, chunk_type)[0]
+
+    def _retrieve_many(
+        self,
+        questions: list[str],
+        source_filter: str = None,
+        chunk_type: str = None,
+    ) -> list[Retrieval]:
+        # With a reranker, over-retrieve and let it pick the final top_k.
+        # Adaptive top_k fetches up to max_k and cuts on the score curve.
+        top_k = self.adaptive_k.max_k if self.adaptive_k else settings.top_k
+        with span("retrieve", batch_size=len(questions)):
+            all_results = self.vector_store.search_many(
+                queries=questions,
+                top_k=settings.rerank_candidates if self.reranker else top_k,
+                source_filter=source_filter,
+                chunk_type=chunk_type,
+            )
+        if self.reranker is None:
+            retrievals = [Retrieval(results=results) for results in all_results]
+        else:
+            retrievals = []
+            for question, results in zip(questions, all_results):
+                reranked = self.reranker.rerank(question, results, top_k)
+                retrievals.append(
+                    Retrieval(results=reranked.results, rerank=reranked.stats)
+                )
+
+        if self.adaptive_k is not None:
+            for retrieval in retrievals:
+                with span("adaptive_k") as current:
+                    cutoff = self.adaptive_k.select(retrieval.results)
+                    current.set(
+                        k=cutoff.k, candidates=cutoff.candidates,
+                        reason=cutoff.reason,
+                    )
+                retrieval.results = cutoff.results
+        return retrievals
+
+    def _early_response(
+        self, question: str, retrieval: Retrieval
+    ) -> RAGResponse | None:
+        results = retrieval.results
         if not results:
             return RAGResponse(
                 answer="No documents have been indexed yet. "
@@ -46,31 +331,140 @@ class RAGChain:
                 sources=[],
                 confidence=0.0,
             )
-        
-        context = self._build_context(results)
-        answer = self._generate_answer(question, context)
-        avg_score = sum(r["score"] for r in results) / len(results)
 
-        return RAGResponse(
+        top_score = max(r["score"] for r in results)
+        if (
+            settings.no_answer_score_floor
+            and top_score < settings.no_answer_score_floor
+        ):
+            logger.info(
+                f"Best score {top_score} is under the floor of "
+                f"{settings.no_answer_score_floor}; skipping the LLM"
+            )
+            self._skip_llm("low_score")
+            return RAGResponse(
+                answer=NO_ANSWER,
+                sources=results,
+                confidence=self._confidence(results),
+                rerank=retrieval.rerank,
+            )
+
+        if self.answer_cache is not None:
+            # Served from the query-embedding cache warmed by search()
+            question_embedding = self.vector_store.embedder.embed_query(question)
+            cached = self.answer_cache.lookup(
+                question_embedding, [r["chunk_id"] for r in results]
+            )
+            cache_events.inc(
+                cache="answer", result="miss" if cached is None else "hit"
+            )
+            if cached is not None:
+                self._skip_llm("answer_cache")
+                return replace(
+                    cached,
+                    sources=results,
+                    confidence=self._confidence(results),
+                    rerank=retrieval.rerank,
+                )
+        return None
+
+    def _finish(
+        self,
+        question: str,
+        retrieval: Retrieval,
+        answer: str,
+        cache: bool = True,
+    ) -> RAGResponse:
+        results = retrieval.results
+        response = RAGResponse(
             answer=answer,
             sources=results,
-            confidence=round(avg_score, 4),
+            confidence=self._confidence(results),
+            rerank=retrieval.rerank,
         )
+
+        # A streamed answer can fail part-way, so check the whole text
+        if (
+            cache
+            and self.answer_cache is not None
+            and LLM_ERROR_PREFIX not in answer
+        ):
+            self.answer_cache.store(
+                self.vector_store.embedder.embed_query(question),
+                [r["chunk_id"] for r in results],
+                [r["source_file"] for r in results],
+                response,
+            )
+        return response
+
+    async def _afinish(
+        self, question: str, retrieval: Retrieval, answer: str
+    ) -> RAGResponse:
+        if self.answer_cache is None:
+            return self._finish(question, retrieval, answer)
+        # Caching embeds the question, which blocks
+        try:
+            return await query_executor.run(
+                self._finish, question, retrieval, answer
+            )
+        except ExecutorBusy:
+            # Don't fail a request whose answer is already generated
+            return self._finish(question, retrieval, answer, cache=False)
+
+    def _observe_llm(self, seconds: float) -> None:
+        with self._llm_stats_lock:
+            self._llm_calls += 1
+            self._llm_seconds += seconds
+
+    def _skip_llm(self, reason: str) -> None:
+        with self._llm_stats_lock:
+            saved = self._llm_seconds / self._llm_calls if self._llm_calls else 0.0
+            self._llm_skipped[reason] = self._llm_skipped.get(reason, 0) + 1
+            self._llm_seconds_saved += saved
+        llm_skipped.inc(reason=reason)
+        llm_seconds_saved.inc(saved, reason=reason)
+
+    def llm_stats(self) -> dict:
+        with self._llm_stats_lock:
+            return {
+                "calls": self._llm_calls,
+                "avg_ms": (
+                    round(self._llm_seconds / self._llm_calls * 1000, 1)
+                    if self._llm_calls else 0.0
+                ),
+                "skipped": dict(self._llm_skipped),
+                "seconds_saved": round(self._llm_seconds_saved, 2),
+            }
+
+    @staticmethod
+    def _confidence(results: list[dict]) -> float:
+        avg_score = sum(r["score"] for r in results) / len(results)
+        return round(avg_score, 4)
     
     def _build_context(self, results: list[dict]) -> str:
+        with span("context_pack", batch_size=len(results)) as current:
+            packed = self.context_packer.pack(results)
+            current.set(tokens_in=packed.tokens_in, tokens_out=packed.tokens_out)
+        logger.info(
+            f"Packed {len(results)} chunks into {len(packed.blocks)} blocks: "
+            f"{packed.tokens_out}/{packed.tokens_in} tokens "
+            f"({packed.tokens_saved} saved; merged={packed.merged}, "
+            f"duplicates={packed.duplicates}, over_budget={packed.over_budget})"
+        )
+
         context_parts = []
-        for i, r in enumerate(results, 1):
+        for i, block in enumerate(packed.blocks, 1):
             context_parts.append(
                 f"--- CONTEXT {i} ---\n"
-                f"Source: {r['source_file']}, Page {r['page_number']}\n"
-                f"Relevance Score: {r['score']}\n"
-                f"Content:\n{r['text']}\n"
+                f"Source: {block.source_file}, Page {block.page_number}\n"
+                f"Relevance Score: {block.score}\n"
+                f"Content:\n{block.text}\n"
             )
         return "\n".join(context_parts)
     
-    def _generate_answer(self, question: str, context: str) -> str:
-
-        user_message = (
+    @staticmethod
+    def _user_message(question: str, context: str) -> str:
+        return (
             f"CONTEXT FROM DOCUMENTS:\n\n{context}\n\n"
             f"---\n\n"
             f"QUESTION: {question}\n\n"
@@ -78,17 +472,105 @@ class RAGChain:
             f"Cite sources using [Source: filename, Page X] format."
         )
 
+    @staticmethod
+    def _record_usage(current: Span, usage) -> None:
+        current.set(
+            input_tokens=usage.input_tokens, output_tokens=usage.output_tokens
+        )
+        llm_tokens.inc(usage.input_tokens, kind="input")
+        llm_tokens.inc(usage.output_tokens, kind="output")
+
+    def _generate_answer(self, question: str, context: str) -> str:
+        try:
+            with span("llm", model=settings.llm_model) as current:
+                response = self.client.messages.create(
+                    model=settings.llm_model,
+                    max_tokens=settings.max_tokens,
+                    system=SYSTEM_PROMPT,
+                    messages=[
+                        {"role": "user", "content": self._user_message(question, context)}
+                    ],
+                )
+                self._record_usage(current, response.usage)
+            self._observe_llm(current.duration_ms / 1000)
+            return response.content[0].text
+
+        except Exception as e:
+            logger.error(f"LLM generation failed: {e}")
+            return f"{LLM_ERROR_PREFIX}: {str(e)}"
+
+    def _stream_answer(self, question: str, context: str) -> Iterator[str]:
+        # A span can't wrap a generator across yields, so time it by hand
+        current = Span(name="llm_stream", start=time.perf_counter())
         try:
-            response = self.client.messages.create(
+            with self.client.messages.stream(
                 model=settings.llm_model,
                 max_tokens=settings.max_tokens,
                 system=SYSTEM_PROMPT,
                 messages=[
-                    {"role": "user", "content": user_message}
+                    {"role": "user", "content": self._user_message(question, context)}
                 ],
-            )
+            ) as stream:
+                for text in stream.text_stream:
+                    if "ttft_ms" not in current.attrs:
+                        current.set(ttft_ms=round(
+                            (time.perf_counter() - current.start) * 1000, 2
+                        ))
+                    yield text
+                self._record_usage(current, stream.get_final_message().usage)
+            record(current, time.perf_counter() - current.start)
+            self._observe_llm(current.duration_ms / 1000)
+
+        except Exception as e:
+            logger.error(f"LLM generation failed: {e}")
+            yield f"{LLM_ERROR_PREFIX}: {str(e)}"
+
+    async def _astream_answer(
+        self, question: str, context: str
+    ) -> AsyncIterator[str]:
+        current = Span(name="llm_stream", start=time.perf_counter())
+        try:
+            async with self._llm_slots:
+                async with self.async_client.messages.stream(
+                    model=settings.llm_model,
+                    max_tokens=settings.max_tokens,
+                    system=SYSTEM_PROMPT,
+                    messages=[
+                        {"role": "user", "content": self._user_message(question, context)}
+                    ],
+                ) as stream:
+                    async for text in stream.text_stream:
+                        if "ttft_ms" not in current.attrs:
+                            current.set(ttft_ms=round(
+                                (time.perf_counter() - current.start) * 1000, 2
+                            ))
+                        yield text
+                    self._record_usage(
+                        current, (await stream.get_final_message()).usage
+                    )
+            record(current, time.perf_counter() - current.start)
+            self._observe_llm(current.duration_ms / 1000)
+
+        except Exception as e:
+            logger.error(f"LLM generation failed: {e}")
+            yield f"{LLM_ERROR_PREFIX}: {str(e)}"
+
+    async def _agenerate_answer(self, question: str, context: str) -> str:
+        try:
+            async with self._llm_slots:
+                with span("llm", model=settings.llm_model) as current:
+                    response = await self.async_client.messages.create(
+                        model=settings.llm_model,
+                        max_tokens=settings.max_tokens,
+                        system=SYSTEM_PROMPT,
+                        messages=[
+                            {"role": "user", "content": self._user_message(question, context)}
+                        ],
+                    )
+                    self._record_usage(current, response.usage)
+            self._observe_llm(current.duration_ms / 1000)
             return response.content[0].text
 
         except Exception as e:
             logger.error(f"LLM generation failed: {e}")
-            return f"Error generating answer: {str(e)}"
\ No newline at end of file
+            return f"{LLM_ERROR_PREFIX}: {str(e)}"
\ No newline at end of file
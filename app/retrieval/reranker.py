@@ -0,0 +1,124 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from loguru import logger
+from app.core.config import settings
+from app.core.tracing import span
+
+
+@dataclass
+class RerankResult:
+    results: list[dict]
+    stats: dict
+
+
+class Reranker(ABC):
+    name = "none"
+
+    @abstractmethod
+    def rerank(self, query: str, results: list[dict], top_k: int) -> RerankResult:
+        ...
+
+    def warm_up(self) -> None:
+        pass
+
+
+# Scores (query, chunk) pairs with a local cross-encoder on CPU. Candidates
+# arrive in cosine order and are scored batch by batch until the latency
+# budget runs out; anything left unscored keeps its cosine position after
+# the scored prefix, so an exhausted budget degrades to plain cosine order.
+class CrossEncoderReranker(Reranker):
+    name = "cross-encoder"
+
+    def __init__(self, model_name: str, batch_size: int, budget_ms: float):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.budget_ms = budget_ms
+        self._model = None
+        self._load_lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    logger.info(f"Loading reranker model: {self.model_name}")
+                    self._model = CrossEncoder(self.model_name)
+        return self._model
+
+    def warm_up(self) -> None:
+        self.model.predict([("warm-up", "warm-up")], show_progress_bar=False)
+
+    def rerank(self, query: str, results: list[dict], top_k: int) -> RerankResult:
+        model = self.model  # load outside the timed budget
+        with span("rerank", batch_size=len(results)) as current:
+            result = self._rerank(model, query, results, top_k)
+            current.set(scored=result.stats["scored"])
+        return result
+
+    def _rerank(
+        self, model, query: str, results: list[dict], top_k: int
+    ) -> RerankResult:
+        start = time.perf_counter()
+        deadline = start + self.budget_ms / 1000
+
+        scored: list[tuple[float, dict]] = []
+        exhausted = False
+        for i in range(0, len(results), self.batch_size):
+            if time.perf_counter() >= deadline:
+                exhausted = True
+                break
+            batch = results[i:i + self.batch_size]
+            scores = model.predict(
+                [(query, r["text"]) for r in batch],
+                batch_size=len(batch),
+                show_progress_bar=False,
+            )
+            scored.extend(zip((float(s) for s in scores), batch))
+
+        ranked = [
+            dict(r, rerank_score=round(score, 4))
+            for score, r in sorted(scored, key=lambda item: item[0], reverse=True)
+        ]
+        ranked.extend(results[len(scored):])
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if exhausted:
+            logger.warning(
+                f"Rerank budget of {self.budget_ms:.0f}ms exhausted after "
+                f"{len(scored)}/{len(results)} candidates"
+            )
+        return RerankResult(
+            results=ranked[:top_k],
+            stats={
+                "reranker": self.name,
+                "model": self.model_name,
+                "candidates": len(results),
+                "scored": len(scored),
+                "elapsed_ms": round(elapsed_ms, 1),
+                "budget_ms": self.budget_ms,
+                "budget_exhausted": exhausted,
+            },
+        )
+
+
+_RERANKERS = {
+    CrossEncoderReranker.name: lambda: CrossEncoderReranker(
+        model_name=settings.reranker_model,
+        batch_size=settings.rerank_batch_size,
+        budget_ms=settings.rerank_budget_ms,
+    ),
+}
+
+
+def get_reranker(name: str) -> Reranker | None:
+    if not name or name == "none":
+        return None
+    if name not in _RERANKERS:
+        raise ValueError(
+            f"Unknown reranker '{name}'. "
+            f"Choose one of: none, {', '.join(_RERANKERS)}"
+        )
+    return _RERANKERS[name]()
@@ -0,0 +1,266 @@
+import contextvars
+import heapq
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator
+from loguru import logger
+from app.core.tracing import shard_seconds
+
+_UNSAFE = re.compile(r"[^a-zA-Z0-9_-]+")
+
+
+# Spreads chunks over several backend instances ("shards") by source file,
+# either hash-partitioned (shard_by="hash") or one shard per tenant, where
+# the tenant is the part of the file name before tenant_separator
+# ("acme__10k.pdf" -> tenant "acme"; files without it go to "default").
+# A source_filter query, delete_source, and get/delete calls given the
+# source touch only the owning shard; unfiltered queries fan out to every
+# shard in parallel and the per-shard top-k lists are merged with a heap.
+# make_shard(name) opens one shard and discover() lists the shards already
+# on disk. Shard names stay within max_name_length and start and end with
+# a letter or digit, as Chroma collection names must. The layout (shard_by
+# and shard_count) is saved to layout_path, and opening the shards with a
+# different one is refused, since it would route sources to the wrong shard.
+class ShardedBackend:
+    name = "sharded"
+
+    def __init__(
+        self,
+        make_shard: Callable[[str], object],
+        discover: Callable[[], list[str]],
+        shard_by: str = "hash",
+        shard_count: int = 4,
+        tenant_separator: str = "__",
+        search_workers: int = 8,
+        max_name_length: int = 63,
+        layout_path: str = None,
+    ):
+        if shard_by not in ("hash", "tenant"):
+            raise ValueError(
+                f"Unknown shard_by '{shard_by}'. Choose one of: hash, tenant"
+            )
+        self.shard_by = shard_by
+        self.shard_count = max(1, shard_count)
+        self.tenant_separator = tenant_separator
+        self.max_name_length = max_name_length
+        if layout_path:
+            self._check_layout(layout_path)
+        self._make_shard = make_shard
+        self._lock = threading.Lock()
+        self._shards: dict[str, object] = {}
+        self._latency: dict[str, tuple[int, float, float]] = {}
+        self._pool = ThreadPoolExecutor(
+            max_workers=search_workers, thread_name_prefix="shard-search"
+        )
+        for shard in discover():
+            self._shards[shard] = make_shard(shard)
+        logger.info(
+            f"Opened sharded store ({shard_by}): {len(self._shards)} shards"
+        )
+
+    def shard_for(self, source_file: str) -> str:
+        if self.shard_by == "tenant":
+            tenant = "default"
+            if self.tenant_separator in source_file:
+                tenant = source_file.split(self.tenant_separator, 1)[0]
+            safe = _UNSAFE.sub("-", tenant).strip("-_") or "default"
+            name = f"tenant-{safe}"
+            if len(name) > self.max_name_length:
+                # Truncated names keep a hash of the full tenant so that
+                # tenants sharing a long prefix stay apart
+                digest = f"{zlib.crc32(tenant.encode('utf-8')):08x}"
+                keep = name[:self.max_name_length - len(digest) - 1]
+                name = f"{keep.rstrip('-_')}-{digest}"
+            return name
+        bucket = zlib.crc32(source_file.encode("utf-8")) % self.shard_count
+        return f"shard-{bucket:03d}"
+
+    def upsert(
+        self,
+        ids: list[str],
+        documents: list[str],
+        embeddings: list[list[float]],
+        metadatas: list[dict],
+    ) -> None:
+        groups: dict[str, list[int]] = {}
+        for i, meta in enumerate(metadatas):
+            groups.setdefault(self.shard_for(meta["source_file"]), []).append(i)
+        self._fan_out(
+            lambda shard, rows: shard.upsert(
+                ids=[ids[i] for i in rows],
+                documents=[documents[i] for i in rows],
+                embeddings=[embeddings[i] for i in rows],
+                metadatas=[metadatas[i] for i in rows],
+            ),
+            {
+                self._shard(name, create=True): rows
+                for name, rows in groups.items()
+            },
+        )
+
+    def query(
+        self,
+        query_embeddings: list[list[float]],
+        n_results: int,
+        source_filter: str = None,
+        chunk_type: str = None,
+    ) -> list[list[dict]]:
+        if source_filter:
+            names = [self.shard_for(source_filter)]
+        else:
+            with self._lock:
+                names = list(self._shards)
+        names = [name for name in names if name in self._shards]
+        if not names:
+            return [[] for _ in query_embeddings]
+
+        def search(name: str) -> list[list[dict]]:
+            start = time.perf_counter()
+            results = self._shards[name].query(
+                query_embeddings=query_embeddings,
+                n_results=n_results,
+                source_filter=source_filter,
+                chunk_type=chunk_type,
+            )
+            self._observe(name, time.perf_counter() - start)
+            return results
+
+        per_shard = self._map(search, names)
+        # Cosine scores are comparable across shards, so merge on them
+        return [
+            heapq.nlargest(
+                n_results,
+                (r for results in per_shard for r in results[q]),
+                key=lambda r: r["score"],
+            )
+            for q in range(len(query_embeddings))
+        ]
+
+    def get(self, ids: list[str], source_file: str = None) -> list[dict]:
+        # Chunk IDs don't name their shard, so without the source ask every
+        # shard
+        return [
+            record
+            for records in self._map(
+                lambda name: self._shards[name].get(ids), self._owners(source_file)
+            )
+            for record in records
+        ]
+
+    def iter_records(
+        self, page_size: int = 5000, source_file: str = None
+    ) -> Iterator[list[dict]]:
+        for name in self._owners(source_file):
+            yield from self._shards[name].iter_records(page_size, source_file)
+
+    def sources(self) -> list[str]:
+        return sorted({
+            source
+            for sources in self._map(lambda name: self._shards[name].sources())
+            for source in sources
+        })
+
+    def count(self) -> int:
+        return sum(self._map(lambda name: self._shards[name].count()))
+
+    def delete(self, ids: list[str], source_file: str = None) -> None:
+        self._map(
+            lambda name: self._shards[name].delete(ids), self._owners(source_file)
+        )
+
+    def delete_source(self, source_file: str) -> None:
+        shard = self._shard(self.shard_for(source_file))
+        if shard is not None:
+            shard.delete_source(source_file)
+
+    def flush(self) -> None:
+        self._map(lambda name: self._shards[name].flush())
+
+    def stats(self) -> dict:
+        with self._lock:
+            latency = dict(self._latency)
+        shards = {}
+        for name in self._names():
+            calls, total, last = latency.get(name, (0, 0.0, 0.0))
+            shards[name] = {
+                "count": self._shards[name].count(),
+                "searches": calls,
+                "avg_search_ms": round(total / calls * 1000, 2) if calls else 0.0,
+                "last_search_ms": round(last * 1000, 2),
+            }
+        return {
+            "backend": self.name,
+            "shard_by": self.shard_by,
+            "shards": shards,
+            "count": sum(s["count"] for s in shards.values()),
+        }
+
+    def _check_layout(self, path: str) -> None:
+        layout = {"shard_by": self.shard_by}
+        if self.shard_by == "hash":
+            layout["shard_count"] = self.shard_count
+        if os.path.exists(path):
+            with open(path) as f:
+                stored = json.load(f)
+            if stored != layout:
+                raise ValueError(
+                    f"Shards at {path} were laid out with {stored}, not "
+                    f"{layout}; set SHARD_BY/SHARD_COUNT back or re-ingest "
+                    f"into a new index"
+                )
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(layout, f)
+
+    def _shard(self, name: str, create: bool = False):
+        shard = self._shards.get(name)
+        if shard is None and create:
+            with self._lock:
+                if name not in self._shards:
+                    logger.info(f"Creating shard {name}")
+                    self._shards[name] = self._make_shard(name)
+                shard = self._shards[name]
+        return shard
+
+    def _owners(self, source_file: str = None) -> list[str]:
+        if source_file is None:
+            return self._names()
+        name = self.shard_for(source_file)
+        return [name] if name in self._shards else []
+
+    def _names(self) -> list[str]:
+        with self._lock:
+            return sorted(self._shards)
+
+    def _observe(self, name: str, seconds: float) -> None:
+        shard_seconds.observe(seconds, shard=name)
+        with self._lock:
+            calls, total, _ = self._latency.get(name, (0, 0.0, 0.0))
+            self._latency[name] = (calls + 1, total + seconds, seconds)
+
+    def _map(self, fn: Callable[[str], object], names: list[str] = None) -> list:
+        names = self._names() if names is None else names
+        if not names:
+            return []
+        if len(names) == 1:
+            return [fn(names[0])]
+        # Copy the context so shard work still reports into the request trace
+        futures = [
+            self._pool.submit(contextvars.copy_context().run, fn, name)
+            for name in names
+        ]
+        return [f.result() for f in futures]
+
+    def _fan_out(self, fn: Callable, work: dict) -> None:
+        futures = [
+            self._pool.submit(contextvars.copy_context().run, fn, shard, rows)
+            for shard, rows in work.items()
+        ]
+        for f in futures:
+            f.result()
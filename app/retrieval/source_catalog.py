@@ -0,0 +1,244 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, Iterator
+
+_SQL_BATCH = 500  # stays under SQLite's bound-parameter limit
+
+
+# One row per indexed source file (chunk and page counts, content hash,
+# ingest times), so listing sources reads one small table instead of every
+# chunk's metadata. The chunk_id -> source map behind it keeps the counts
+# exact under re-upserts and partial deletes. It is written after each
+# vector store write, inside writing(), which marks the sources involved
+# until the catalog has caught up. VectorStore reconciles any source still
+# marked at startup (a crash between the two writes), and rebuilds the
+# whole catalog if the chunk totals disagree.
+class SourceCatalog:
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            "source_file TEXT PRIMARY KEY, chunk_count INTEGER NOT NULL, "
+            "page_count INTEGER NOT NULL, content_hash TEXT, "
+            "ingested_at REAL NOT NULL, updated_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "chunk_id TEXT PRIMARY KEY, source_file TEXT NOT NULL, "
+            "page_number INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source_file);"
+            "CREATE TABLE IF NOT EXISTS writing ("
+            "source_file TEXT PRIMARY KEY, writers INTEGER NOT NULL);"
+        )
+        self._conn.commit()
+
+    @contextmanager
+    def writing(self, sources: set[str]) -> Iterator[None]:
+        # Wraps a backend write plus the catalog update that follows it. If
+        # the body raises, the mark stays until the next reconcile.
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO writing (source_file, writers) VALUES (?, 1) "
+                "ON CONFLICT (source_file) DO UPDATE SET writers = writers + 1",
+                [(source,) for source in sources],
+            )
+        yield
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE writing SET writers = writers - 1 WHERE source_file = ?",
+                [(source,) for source in sources],
+            )
+            self._conn.execute("DELETE FROM writing WHERE writers <= 0")
+
+    def unfinished(self) -> list[str]:
+        # Sources whose last write may not have reached the catalog
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source_file FROM writing ORDER BY source_file"
+            ).fetchall()
+        return [source_file for (source_file,) in rows]
+
+    def add(self, chunks: Iterable[tuple[str, str, int]]) -> None:
+        # chunks: (chunk_id, source_file, page_number)
+        chunks = list(chunks)
+        if not chunks:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (chunk_id, source_file, "
+                "page_number) VALUES (?, ?, ?)",
+                chunks,
+            )
+            self._refresh({source for _, source, _ in chunks})
+
+    def remove_chunks(self, chunk_ids: list[str]) -> None:
+        with self._lock, self._conn:
+            sources = set()
+            for i in range(0, len(chunk_ids), _SQL_BATCH):
+                batch = chunk_ids[i:i + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                sources.update(
+                    source for (source,) in self._conn.execute(
+                        f"SELECT DISTINCT source_file FROM chunks "
+                        f"WHERE chunk_id IN ({placeholders})",
+                        batch,
+                    )
+                )
+                self._conn.execute(
+                    f"DELETE FROM chunks WHERE chunk_id IN ({placeholders})",
+                    batch,
+                )
+            self._refresh(sources)
+
+    def remove_source(self, source_file: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM chunks WHERE source_file = ?", (source_file,)
+            )
+            self._conn.execute(
+                "DELETE FROM sources WHERE source_file = ?", (source_file,)
+            )
+
+    def set_content_hash(self, source_file: str, content_hash: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE sources SET content_hash = ? WHERE source_file = ?",
+                (content_hash, source_file),
+            )
+
+    def names(self) -> list[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source_file FROM sources ORDER BY source_file"
+            ).fetchall()
+        return [source_file for (source_file,) in rows]
+
+    def entries(self) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source_file, chunk_count, page_count, content_hash, "
+                "ingested_at, updated_at FROM sources ORDER BY source_file"
+            ).fetchall()
+        return [
+            {
+                "source_file": source_file,
+                "chunk_count": chunk_count,
+                "page_count": page_count,
+                "content_hash": content_hash,
+                "ingested_at": ingested_at,
+                "updated_at": updated_at,
+            }
+            for (
+                source_file, chunk_count, page_count, content_hash,
+                ingested_at, updated_at,
+            ) in rows
+        ]
+
+    def source_chunk_counts(self) -> dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source_file, chunk_count FROM sources"
+            ).fetchall()
+        return dict(rows)
+
+    def chunk_ids(self, source_file: str) -> set[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunk_id FROM chunks WHERE source_file = ?",
+                (source_file,),
+            ).fetchall()
+        return {chunk_id for (chunk_id,) in rows}
+
+    def chunk_count(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COALESCE(SUM(chunk_count), 0) FROM sources"
+            ).fetchone()[0]
+
+    def rebuild(self, pages: Iterable[list[dict]]) -> int:
+        # pages: backend.iter_records() output. Content hashes and first
+        # ingest times survive for sources that are still present.
+        with self._lock, self._conn:
+            kept = {
+                source_file: (content_hash, ingested_at)
+                for source_file, content_hash, ingested_at in self._conn.execute(
+                    "SELECT source_file, content_hash, ingested_at FROM sources"
+                )
+            }
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM sources")
+            self._conn.execute("DELETE FROM writing")
+            total = 0
+            for page in pages:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO chunks (chunk_id, source_file, "
+                    "page_number) VALUES (?, ?, ?)",
+                    [
+                        (r["chunk_id"], r["source_file"], r["page_number"])
+                        for r in page
+                    ],
+                )
+                total += len(page)
+            sources = {
+                source for (source,) in self._conn.execute(
+                    "SELECT DISTINCT source_file FROM chunks"
+                )
+            }
+            self._refresh(sources)
+            for source_file, (content_hash, ingested_at) in kept.items():
+                self._conn.execute(
+                    "UPDATE sources SET content_hash = ?, ingested_at = ? "
+                    "WHERE source_file = ?",
+                    (content_hash, ingested_at, source_file),
+                )
+        return total
+
+    def rebuild_source(self, source_file: str, pages: Iterable[list[dict]]) -> int:
+        # pages: backend.iter_records(source_file=...) output
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM chunks WHERE source_file = ?", (source_file,)
+            )
+            total = 0
+            for page in pages:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO chunks (chunk_id, source_file, "
+                    "page_number) VALUES (?, ?, ?)",
+                    [
+                        (r["chunk_id"], r["source_file"], r["page_number"])
+                        for r in page
+                    ],
+                )
+                total += len(page)
+            self._refresh({source_file})
+            self._conn.execute(
+                "DELETE FROM writing WHERE source_file = ?", (source_file,)
+            )
+        return total
+
+    def _refresh(self, sources: set[str]) -> None:
+        # Caller holds self._lock inside a transaction
+        now = time.time()
+        for source_file in sources:
+            chunk_count, page_count = self._conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT page_number) FROM chunks "
+                "WHERE source_file = ?",
+                (source_file,),
+            ).fetchone()
+            if not chunk_count:
+                self._conn.execute(
+                    "DELETE FROM sources WHERE source_file = ?", (source_file,)
+                )
+                continue
+            self._conn.execute(
+                "INSERT INTO sources (source_file, chunk_count, page_count, "
+                "ingested_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (source_file) DO UPDATE SET "
+                "chunk_count = excluded.chunk_count, "
+                "page_count = excluded.page_count, "
+                "updated_at = excluded.updated_at",
+                (source_file, chunk_count, page_count, now, now),
+            )
@@ -1,103 +1,376 @@
-import chromadb
-import os
-from chromadb.config import Settings as ChromaSettings
+import heapq
+import time
+import weakref
+import numpy as np
+from typing import Callable
 from loguru import logger
+from app.core.cache import TTLCache, normalize_query
 from app.core.config import settings
+from app.core.tracing import cache_events, span
 from app.core.embeddings import EmbeddingModel
 from app.ingestion.chunker import Chunk
+from app.retrieval.backends import get_backend
+from app.retrieval.lexical_index import BM25Index
+from app.retrieval.manifest import SourceManifest
+from app.retrieval.source_catalog import SourceCatalog
 
 
 
 class VectorStore:
+    # Shared by every instance in the process so a write through one store
+    # (e.g. the API's) invalidates results cached by another (RAGChain's)
+    _search_cache = TTLCache(
+        max_size=settings.search_cache_size,
+        ttl_seconds=settings.search_cache_ttl,
+    )
+    # Bumped on every write; a search only caches its results if no write
+    # landed while it ran, so a stale result can't outlive the clear
+    _write_generation = 0
+    # Callbacks notified with the set of source files whose chunks changed.
+    # Held weakly, so a listener's owner (e.g. a RAGChain's answer cache)
+    # can be garbage-collected without unregistering.
+    _change_listeners: list[weakref.ref] = []
 
     def __init__(self):
-        persist_dir = settings.chroma_persist_dir
-
-        try:
-            os.makedirs(persist_dir, exist_ok=True)
-            self.client = chromadb.PersistentClient(path=persist_dir)
-        except Exception:
-            self.client = chromadb.Client()
-
-        self.collection = self.client.get_or_create_collection(
-            name=settings.collection_name,
-            metadata={"hnsw:space": "cosine"},
-        )
+        self.backend = get_backend(settings.vector_backend)
         self.embedder = EmbeddingModel()
+        self.manifest = SourceManifest(settings.manifest_path)
+        self.catalog = SourceCatalog(settings.source_catalog_path)
+        self.lexical_index = BM25Index.open(settings.lexical_index_path)
+        count = self.backend.count()
+        # Covers a crash before the index's last save as well as a missing
+        # or unreadable snapshot
+        if len(self.lexical_index) != count:
+            self.rebuild_lexical_index()
+        if self.catalog.chunk_count() != count:
+            self.rebuild_catalog()
+            suspect = set(self.manifest.chunk_counts())
+        else:
+            # Equal totals can still hide a crash between a backend write
+            # and its catalog update (e.g. N chunks replaced by N others)
+            suspect = set(self.catalog.unfinished())
+            for source_file in suspect:
+                self.reconcile_source(source_file)
+        self.reconcile_manifest(suspect)
 
     def add_chunks(self, chunks: list[Chunk]) -> int:
         if not chunks:
             return 0
 
         texts = [c.text for c in chunks]
-        ids = [c.chunk_id for c in chunks]
-        metadatas = [
-            {
-                "source_file": c.source_file,
-                "page_number": c.page_number,
-                "chunk_index": c.chunk_index,
-            }
-            for c in chunks
-        ]
 
         logger.info(f"Generating embeddings for {len(texts)} chunks...")
         embeddings = self.embedder.embed_texts(texts)
 
-        self.collection.upsert(
-            ids=ids,
-            documents=texts,
-            embeddings=embeddings,
-            metadatas=metadatas,
-        )
+        count = self.upsert_embedded(chunks, embeddings)
+        self.flush()
+
+        logger.info(f"Stored {count} chunks in vector database")
+        return count
+
+    def upsert_embedded(
+        self, chunks: list[Chunk], embeddings: list[list[float]]
+    ) -> int:
+        if not chunks:
+            return 0
 
-        logger.info(f"Stored {len(chunks)} chunks in vector database")
+        sources = {c.source_file for c in chunks}
+        with self.catalog.writing(sources):
+            self._upsert(chunks, embeddings)
+        self._notify_changed(sources)
         return len(chunks)
 
+    def _upsert(self, chunks: list[Chunk], embeddings: list[list[float]]) -> None:
+        with span("vector_upsert", batch_size=len(chunks)):
+            self.backend.upsert(
+                ids=[c.chunk_id for c in chunks],
+                documents=[c.text for c in chunks],
+                embeddings=embeddings,
+                metadatas=[
+                    {
+                        "source_file": c.source_file,
+                        "page_number": c.page_number,
+                        "chunk_index": c.chunk_index,
+                        "chunk_type": c.chunk_type,
+                    }
+                    for c in chunks
+                ],
+            )
+        with span("lexical_upsert", batch_size=len(chunks)):
+            self.lexical_index.add(
+                [
+                    (c.chunk_id, c.text, c.source_file, c.chunk_type)
+                    for c in chunks
+                ]
+            )
+        self.lexical_index.maybe_save(settings.lexical_save_interval)
+        self.catalog.add(
+            (c.chunk_id, c.source_file, c.page_number) for c in chunks
+        )
+
+    def flush(self) -> None:
+        self.backend.flush()
+        self.lexical_index.save()
+
     def search(
-        self, query: str, top_k: int = None, source_filter: str = None
+        self,
+        query: str,
+        top_k: int = None,
+        source_filter: str = None,
+        mode: str = None,
+        chunk_type: str = None,
     ) -> list[dict]:
+        return self.search_many(
+            [query], top_k, source_filter, mode, chunk_type
+        )[0]
+
+    def search_many(
+        self,
+        queries: list[str],
+        top_k: int = None,
+        source_filter: str = None,
+        mode: str = None,
+        chunk_type: str = None,
+    ) -> list[list[dict]]:
+        # chunk_type restricts results to "text" or "table" chunks
         top_k = top_k or settings.top_k
+        mode = mode or settings.retrieval_mode
+        hybrid = mode == "hybrid"
+        # Hybrid over-fetches dense candidates so fusion has room to rerank
+        n_dense = top_k * settings.hybrid_candidate_multiplier if hybrid else top_k
 
-        
-        query_embedding = self.embedder.embed_query(query)
+        output: list[list[dict] | None] = [None] * len(queries)
+        misses: dict[tuple, list[int]] = {}
+        for i, query in enumerate(queries):
+            cache_key = (
+                settings.vector_backend,
+                settings.collection_name,
+                normalize_query(query),
+                top_k,
+                source_filter,
+                mode,
+                chunk_type,
+            )
+            cached = self._search_cache.get(cache_key)
+            if cached is not None:
+                output[i] = [dict(r) for r in cached]
+            else:
+                misses.setdefault(cache_key, []).append(i)
+        cache_events.inc(len(queries) - len(misses), cache="search", result="hit")
+        cache_events.inc(len(misses), cache="search", result="miss")
 
-        
-        where_filter = None
-        if source_filter:
-            where_filter = {"source_file": source_filter}
+        if misses:
+            generation = VectorStore._write_generation
+            # One encode batch and one multi-embedding query for all misses
+            miss_keys = list(misses)
+            query_embeddings = self.embedder.embed_queries(
+                [queries[misses[key][0]] for key in miss_keys]
+            )
 
-        
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=top_k,
-            where=where_filter,
-            include=["documents", "metadatas", "distances"],
-        )
+            with span(
+                "vector_search",
+                backend=settings.vector_backend,
+                batch_size=len(miss_keys),
+                n_results=n_dense,
+            ):
+                results = self.backend.query(
+                    query_embeddings=query_embeddings,
+                    n_results=n_dense,
+                    source_filter=source_filter,
+                    chunk_type=chunk_type,
+                )
+
+            for q, cache_key in enumerate(miss_keys):
+                formatted = results[q]
+                if hybrid:
+                    formatted = self._fuse(
+                        queries[misses[cache_key][0]],
+                        query_embeddings[q],
+                        formatted,
+                        top_k,
+                        source_filter,
+                        chunk_type,
+                    )
+                if generation == VectorStore._write_generation:
+                    self._search_cache.set(
+                        cache_key, [dict(r) for r in formatted]
+                    )
+                for i in misses[cache_key]:
+                    output[i] = [dict(r) for r in formatted]
+
+        return output
+
+    def _fuse(
+        self,
+        query: str,
+        query_embedding: list[float],
+        dense: list[dict],
+        top_k: int,
+        source_filter: str = None,
+        chunk_type: str = None,
+    ) -> list[dict]:
+        # Reciprocal rank fusion of the dense and BM25 rankings
+        with span("lexical_search"):
+            lexical = self.lexical_index.search(
+                query, max(len(dense), top_k), source_filter, chunk_type
+            )
+        fused: dict[str, float] = {}
+        for rank, r in enumerate(dense):
+            fused[r["chunk_id"]] = 1 / (settings.rrf_k + rank + 1)
+        for rank, (chunk_id, _) in enumerate(lexical):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1 / (settings.rrf_k + rank + 1)
 
-        
-        formatted = []
-        for i in range(len(results["ids"][0])):
-            formatted.append({
-                "text": results["documents"][0][i],
-                "source_file": results["metadatas"][0][i]["source_file"],
-                "page_number": results["metadatas"][0][i]["page_number"],
-                "score": round(1 - results["distances"][0][i], 4),
-            })
+        top_ids = heapq.nlargest(top_k, fused, key=fused.get)
+        by_id = {r["chunk_id"]: r for r in dense}
 
-        return formatted
+        # Lexical-only hits still need text, metadata and a cosine score
+        missing = [chunk_id for chunk_id in top_ids if chunk_id not in by_id]
+        if missing:
+            query_vec = np.asarray(query_embedding, dtype=np.float32)
+            query_vec /= np.linalg.norm(query_vec) or 1.0
+            for record in self.backend.get(missing, source_file=source_filter):
+                vec = np.asarray(record.pop("embedding"), dtype=np.float32)
+                cosine = float(vec @ query_vec) / (float(np.linalg.norm(vec)) or 1.0)
+                by_id[record["chunk_id"]] = dict(record, score=round(cosine, 4))
+
+        return [
+            dict(by_id[chunk_id], rrf_score=round(fused[chunk_id], 6))
+            for chunk_id in top_ids
+            if chunk_id in by_id
+        ]
 
     def list_sources(self) -> list[str]:
-        all_metadata = self.collection.get(include=["metadatas"])
-        sources = set()
-        for m in all_metadata["metadatas"]:
-            sources.add(m["source_file"])
-        return sorted(list(sources))
+        return self.catalog.names()
+
+    def source_details(self) -> list[dict]:
+        return self.catalog.entries()
 
     def get_doc_count(self) -> int:
-        return self.collection.count()
+        return self.backend.count()
 
     def delete_source(self, source_file: str) -> None:
-        self.collection.delete(
-            where={"source_file": source_file}
+        with self.catalog.writing({source_file}):
+            self.backend.delete_source(source_file)
+            self.backend.flush()
+            self.manifest.delete_source(source_file)
+            self.catalog.remove_source(source_file)
+        self.lexical_index.remove_source(source_file)
+        self.lexical_index.save()
+        self._notify_changed({source_file})
+        logger.info(f"Deleted all chunks from {source_file}")
+
+    def delete_chunks(self, source_file: str, chunk_ids: list[str]) -> int:
+        if not chunk_ids:
+            return 0
+        with self.catalog.writing({source_file}):
+            self.backend.delete(chunk_ids, source_file=source_file)
+            self.backend.flush()
+            self.lexical_index.remove(chunk_ids)
+            self.lexical_index.save()
+            self.catalog.remove_chunks(chunk_ids)
+        self._notify_changed({source_file})
+        logger.info(f"Deleted {len(chunk_ids)} stale chunks from {source_file}")
+        return len(chunk_ids)
+
+    def rebuild_lexical_index(self, page_size: int = 5000) -> None:
+        logger.info("Rebuilding BM25 index from the vector store...")
+        self.lexical_index.clear()
+        total = 0
+        for page in self.backend.iter_records(page_size):
+            self.lexical_index.add([
+                (r["chunk_id"], r["text"], r["source_file"], r["chunk_type"])
+                for r in page
+            ])
+            total += len(page)
+        self.lexical_index.save()
+        logger.info(f"BM25 index rebuilt with {total} chunks")
+
+    def rebuild_catalog(self, page_size: int = 5000) -> None:
+        logger.info("Rebuilding source catalog from the vector store...")
+        start = time.perf_counter()
+        total = self.catalog.rebuild(self.backend.iter_records(page_size))
+        logger.info(
+            f"Source catalog rebuilt: {len(self.catalog.names())} sources, "
+            f"{total} chunks in {time.perf_counter() - start:.2f}s"
+        )
+
+    def reconcile_source(self, source_file: str, page_size: int = 5000) -> None:
+        # Re-reads one source's chunks from the backend into the catalog
+        # and the BM25 index
+        records = [
+            r for page in self.backend.iter_records(page_size, source_file)
+            for r in page
+        ]
+        self.catalog.rebuild_source(source_file, [records])
+        self.lexical_index.remove_source(source_file)
+        self.lexical_index.add([
+            (r["chunk_id"], r["text"], r["source_file"], r["chunk_type"])
+            for r in records
+        ])
+        self.lexical_index.save()
+        logger.warning(
+            f"Reconciled {source_file} after an unfinished write: "
+            f"{len(records)} chunks"
         )
-        logger.info(f"Deleted all chunks from {source_file}")
\ No newline at end of file
+
+    def reconcile_manifest(self, verify: set[str] = frozenset()) -> None:
+        # A crash after the manifest was written but before the backend
+        # persisted a source's chunks would leave its pages skipped on every
+        # re-upload. Sources whose chunk counts agree with the catalog are
+        # taken as intact unless listed in verify; for the rest, pages with
+        # missing chunks get an empty hash (so the next ingest re-indexes
+        # them) and keep the IDs that do exist (so it can still delete them
+        # if they go stale).
+        stored = self.catalog.source_chunk_counts()
+        for source_file, expected in self.manifest.chunk_counts().items():
+            if source_file not in verify and stored.get(source_file, 0) == expected:
+                continue
+            present = self.catalog.chunk_ids(source_file)
+            pages = self.manifest.get_pages(source_file)
+            damaged = {
+                page_number: ("", [cid for cid in chunk_ids if cid in present])
+                for page_number, (_, chunk_ids) in pages.items()
+                if any(cid not in present for cid in chunk_ids)
+            }
+            if not damaged:
+                continue
+            logger.warning(
+                f"Manifest for {source_file} lists {len(damaged)} pages whose "
+                f"chunks are missing; they will be re-indexed"
+            )
+            self.manifest.replace_source(source_file, {**pages, **damaged})
+
+    @classmethod
+    def add_change_listener(cls, callback: Callable[[set[str]], None]) -> None:
+        ref = (
+            weakref.WeakMethod(callback) if hasattr(callback, "__self__")
+            else weakref.ref(callback)
+        )
+        cls._change_listeners.append(ref)
+
+    @classmethod
+    def remove_change_listener(
+        cls, callback: Callable[[set[str]], None]
+    ) -> None:
+        cls._change_listeners[:] = [
+            ref for ref in cls._change_listeners
+            if ref() is not None and ref() != callback
+        ]
+
+    def _notify_changed(self, sources: set[str]) -> None:
+        VectorStore._write_generation += 1
+        self._search_cache.clear()
+        callbacks = [ref() for ref in self._change_listeners]
+        if None in callbacks:
+            self._change_listeners[:] = [
+                ref for ref in self._change_listeners if ref() is not None
+            ]
+        for callback in callbacks:
+            if callback is not None:
+                callback(sources)
+
+    def cache_stats(self) -> dict:
+        return self._search_cache.stats()
+
+    def backend_stats(self) -> dict:
+        return self.backend.stats()
@@ -5,8 +5,8 @@ import streamlit as st
 import time
 
 from app.core.config import settings
-from app.ingestion.pdf_processor import PDFProcessor
 from app.ingestion.chunker import DocumentChunker
+from app.ingestion.pipeline import IngestionPipeline
 from app.retrieval.vector_store import VectorStore
 from app.retrieval.rag_chain import RAGChain
 from app.core.config import settings
@@ -23,12 +23,16 @@ if "vector_store" not in st.session_state:
         chunk_size=settings.chunk_size,
         chunk_overlap=settings.chunk_overlap,
     )
-    st.session_state.rag_chain = RAGChain()
+    st.session_state.rag_chain = RAGChain(st.session_state.vector_store)
+    st.session_state.pipeline = IngestionPipeline(
+        st.session_state.vector_store, st.session_state.chunker
+    )
     st.session_state.messages = []
 
 vector_store = st.session_state.vector_store
 chunker = st.session_state.chunker
 rag_chain = st.session_state.rag_chain
+pipeline = st.session_state.pipeline
 
 # --- Header ---
 st.title("📁 RAG Document Intelligence")
@@ -53,18 +57,17 @@ with st.sidebar:
                 f.write(uploaded_file.getbuffer())
 
             try:
-                # Extract text
-                pages = PDFProcessor.extract_pages(file_path)
-
-                # Chunk
-                chunks = chunker.chunk_pages(pages)
-
-                # Store in vector DB
-                count = vector_store.add_chunks(chunks)
+                # Extract, chunk, embed and store as a streaming pipeline
+                result = pipeline.run(file_path)
 
+                diff = result.diff
                 st.success(
                     f"✅ **{uploaded_file.name}**\n\n"
-                    f"Pages: {len(pages)} | Chunks: {count}"
+                    f"Pages: {result.pages_extracted} | "
+                    f"Chunks: {result.chunks_created}\n\n"
+                    f"Changed pages: {diff.pages_added + diff.pages_changed} | "
+                    f"Unchanged: {diff.pages_unchanged} | "
+                    f"Removed chunks: {diff.chunks_removed}"
                 )
             except Exception as e:
                 st.error(f"Failed to process: {e}")
@@ -111,35 +114,47 @@ if question := st.chat_input("Ask a question about your documents..."):
 
 
     with st.chat_message("assistant"):
-        with st.spinner("Searching documents and generating answer..."):
-            start = time.time()
-
-            response = rag_chain.query(question=question)
-
-            elapsed = time.time() - start
-
-            st.markdown(response.answer)
-
-            st.caption(
-                f"⏱️ {elapsed:.1f}s | "
-                f"Confidence: {response.confidence:.2%}"
-            )
-
-            # Show sources
-            if response.sources:
-                with st.expander("📚 View Sources"):
-                    for s in response.sources:
-                        st.markdown(
-                            f"**{s['source_file']}** — "
-                            f"Page {s['page_number']} "
-                            f"(relevance: {s['score']:.2%})"
-                        )
-                        st.caption(s["text"][:300] + "...")
-                        st.divider()
-
-            # Save to history
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": response.answer,
-                "sources": response.sources,
-            })
\ No newline at end of file
+        start = time.time()
+        timing = {"first_token": None}
+
+        events = rag_chain.stream_query(question=question)
+
+        # Sources arrive first; the answer then streams in token by token
+        with st.spinner("Searching documents..."):
+            retrieved = next(events)
+
+        def answer_tokens():
+            for event in events:
+                if event["type"] == "token":
+                    if timing["first_token"] is None:
+                        timing["first_token"] = time.time()
+                    yield event["text"]
+
+        answer = st.write_stream(answer_tokens())
+
+        elapsed = time.time() - start
+        ttft = (timing["first_token"] or time.time()) - start
+
+        st.caption(
+            f"⏱️ {ttft:.1f}s to first token, {elapsed:.1f}s total | "
+            f"Confidence: {retrieved['confidence']:.2%}"
+        )
+
+        # Show sources
+        if retrieved["sources"]:
+            with st.expander("📚 View Sources"):
+                for s in retrieved["sources"]:
+                    st.markdown(
+                        f"**{s['source_file']}** — "
+                        f"Page {s['page_number']} "
+                        f"(relevance: {s['score']:.2%})"
+                    )
+                    st.caption(s["text"][:300] + "...")
+                    st.divider()
+
+        # Save to history
+        st.session_state.messages.append({
+            "role": "assistant",
+            "content": answer,
+            "sources": retrieved["sources"],
+        })
@@ -0,0 +1,566 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from loguru import logger
+from app.retrieval.backends import ChromaBackend
+from app.retrieval.lexical_index import BM25Index
+from app.retrieval.numpy_index import NumpyBackend
+from app.retrieval.sharding import ShardedBackend
+
+# Offline retrieval benchmark: synthetic vectors and text, no embedding
+# model, no network, no API key. Each configuration runs in a fresh
+# process so memory numbers are not polluted by the previous one.
+# CONFIGS time raw backends; STORE_CONFIGS go through VectorStore (catalog,
+# BM25, search cache, RRF fusion) and also time source_filter searches and,
+# given --reranker-model, cross-encoder reranking of the candidates.
+#
+#   python -m tests.benchmark_retrieval --chunks 100000 --output out.json
+
+_WORDS = (
+    "revenue margin growth cost sales quarter fiscal operating income net "
+    "cash flow segment product service customer market risk tax asset debt "
+    "equity share dividend guidance forecast region america europe china "
+    "iphone mac ipad wearables services gross research development expense"
+).split()
+
+
+def _ivf_lists(n_chunks: int) -> int:
+    return max(16, int(4 * np.sqrt(n_chunks)))
+
+
+CONFIGS = {
+    "chroma": lambda path, n: ChromaBackend(path, "benchmark"),
+    "numpy-int8": lambda path, n: NumpyBackend(path, dtype="int8"),
+    "numpy-float16": lambda path, n: NumpyBackend(path, dtype="float16"),
+    "numpy-int8-ivf": lambda path, n: NumpyBackend(
+        path, dtype="int8", ivf_lists=_ivf_lists(n), ivf_probe=16,
+        ivf_min_rows=0,
+    ),
+    "numpy-int8-sharded": lambda path, n: ShardedBackend(
+        make_shard=lambda shard: NumpyBackend(
+            os.path.join(path, shard), dtype="int8"
+        ),
+        discover=lambda: [],
+        shard_count=4,
+    ),
+}
+
+
+# Settings applied before the VectorStore is built
+STORE_CONFIGS = {
+    "store-numpy-dense": {"vector_backend": "numpy", "retrieval_mode": "dense"},
+    "store-numpy-hybrid": {"vector_backend": "numpy", "retrieval_mode": "hybrid"},
+    "store-chroma-hybrid": {
+        "vector_backend": "chroma", "retrieval_mode": "hybrid",
+    },
+    "store-sharded-hybrid": {
+        "vector_backend": "sharded", "shard_backend": "numpy",
+        "retrieval_mode": "hybrid",
+    },
+}
+
+
+class _FixedEmbedder:
+    # Stands in for the embedding model: each query text maps to its
+    # synthetic query vector, so VectorStore runs without loading a model
+    def __init__(self, vectors: dict[str, list[float]]):
+        self.vectors = vectors
+
+    def embed_queries(self, queries: list[str]) -> list[list[float]]:
+        return [self.vectors[q] for q in queries]
+
+
+def make_corpus(
+    n_chunks: int,
+    n_queries: int,
+    dim: int = 384,
+    n_sources: int = 100,
+    seed: int = 0,
+) -> dict:
+    # Clustered vectors so IVF has structure to exploit, as real embeddings do
+    rng = np.random.default_rng(seed)
+    n_clusters = max(8, n_chunks // 500)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    vectors = np.empty((n_chunks, dim), dtype=np.float32)
+    for i in range(0, n_chunks, 100000):
+        n = min(100000, n_chunks - i)
+        vectors[i:i + n] = centers[rng.integers(0, n_clusters, n)]
+        vectors[i:i + n] += 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    picks = rng.integers(0, n_chunks, n_queries)
+    queries = vectors[picks] + 0.02 * rng.standard_normal(
+        (n_queries, dim)
+    ).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    # Zipf-ish word draws give BM25 realistic posting-list skew
+    weights = 1 / np.arange(1, len(_WORDS) + 1)
+    weights /= weights.sum()
+    words = np.array(_WORDS)
+    texts = [
+        " ".join(words[rng.choice(len(_WORDS), 60, p=weights)])
+        + f" figure {i}"
+        for i in range(n_chunks)
+    ]
+    query_texts = [
+        " ".join(texts[p].split()[:6]) for p in picks
+    ]
+    return {
+        "vectors": vectors,
+        "queries": queries.astype(np.float32),
+        "texts": texts,
+        "query_texts": query_texts,
+        "sources": rng.integers(0, n_sources, n_chunks),
+    }
+
+
+def save_corpus(corpus: dict, path: str) -> None:
+    np.savez(path, **{k: np.asarray(v) for k, v in corpus.items()})
+
+
+def load_corpus(path: str) -> dict:
+    data = np.load(path)
+    return {
+        "vectors": data["vectors"],
+        "queries": data["queries"],
+        "texts": data["texts"].tolist(),
+        "query_texts": data["query_texts"].tolist(),
+        "sources": data["sources"],
+    }
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    # Ground truth by brute force in float32, in row blocks to bound memory
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_ids = np.zeros((len(queries), k), dtype=np.int64)
+    for i in range(0, len(vectors), 100000):
+        scores = queries @ vectors[i:i + 100000].T
+        ids = np.broadcast_to(
+            np.arange(i, i + scores.shape[1]), scores.shape
+        )
+        scores = np.concatenate([best_scores, scores], axis=1)
+        ids = np.concatenate([best_ids, ids], axis=1)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best_ids = np.take_along_axis(ids, top, axis=1)
+    return best_ids
+
+
+def percentiles(samples_ms: list[float]) -> dict:
+    p50, p95, p99 = np.percentile(samples_ms, [50, 95, 99])
+    return {
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "mean_ms": round(float(np.mean(samples_ms)), 3),
+    }
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _dir_mb(path: str) -> float:
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total / 1024 / 1024
+
+
+def run_config(
+    name: str,
+    corpus_path: str,
+    truth: np.ndarray,
+    k: int,
+    batch_size: int,
+    reranker_model: str = None,
+    rerank_queries: int = 50,
+) -> dict:
+    if name in STORE_CONFIGS:
+        return run_store_config(
+            name, corpus_path, truth, k, batch_size, reranker_model,
+            rerank_queries,
+        )
+    corpus = load_corpus(corpus_path)
+    vectors, texts = corpus["vectors"], corpus["texts"]
+    n = len(vectors)
+    work_dir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+    rss_start = _rss_mb()
+
+    try:
+        backend = CONFIGS[name](os.path.join(work_dir, "vectors"), n)
+        lexical = BM25Index(os.path.join(work_dir, "bm25.npz"))
+
+        stage_seconds = {"vector_upsert": 0.0, "lexical_add": 0.0}
+        for i in range(0, n, batch_size):
+            ids = [f"c{j}" for j in range(i, min(i + batch_size, n))]
+            batch_texts = texts[i:i + batch_size]
+            sources = [f"doc{s}.pdf" for s in corpus["sources"][i:i + batch_size]]
+
+            start = time.perf_counter()
+            backend.upsert(
+                ids=ids,
+                documents=batch_texts,
+                embeddings=vectors[i:i + batch_size].tolist(),
+                metadatas=[
+                    {"source_file": s, "page_number": 1, "chunk_index": 0}
+                    for s in sources
+                ],
+            )
+            stage_seconds["vector_upsert"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            lexical.add(list(zip(ids, batch_texts, sources)))
+            stage_seconds["lexical_add"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        backend.flush()
+        lexical.save()
+        stage_seconds["flush"] = time.perf_counter() - start
+        rss_ingested = _rss_mb()
+
+        queries = corpus["queries"].tolist()
+        # Warm-up query so one-off costs (e.g. IVF training) are reported
+        # separately from steady-state latency
+        start = time.perf_counter()
+        backend.query(query_embeddings=queries[:1], n_results=k)
+        first_query_ms = (time.perf_counter() - start) * 1000
+
+        latencies, retrieved = [], []
+        for q in queries:
+            start = time.perf_counter()
+            hits = backend.query(query_embeddings=[q], n_results=k)[0]
+            latencies.append((time.perf_counter() - start) * 1000)
+            retrieved.append({int(h["chunk_id"][1:]) for h in hits})
+
+        start = time.perf_counter()
+        for i in range(0, len(queries), 32):
+            backend.query(query_embeddings=queries[i:i + 32], n_results=k)
+        batched_qps = len(queries) / (time.perf_counter() - start)
+
+        lexical_latencies = []
+        for text in corpus["query_texts"]:
+            start = time.perf_counter()
+            lexical.search(text, k)
+            lexical_latencies.append((time.perf_counter() - start) * 1000)
+
+        recall = np.mean([
+            len(got & set(expected.tolist())) / k
+            for got, expected in zip(retrieved, truth)
+        ])
+        total_ingest = sum(stage_seconds.values())
+        return {
+            "config": name,
+            "ingest": {
+                "total_seconds": round(total_ingest, 3),
+                "chunks_per_s": round(n / total_ingest, 1),
+                "stages_chunks_per_s": {
+                    stage: round(n / seconds, 1) if seconds else None
+                    for stage, seconds in stage_seconds.items()
+                },
+            },
+            "search": {
+                **percentiles(latencies),
+                "first_query_ms": round(first_query_ms, 3),
+                "batched_qps": round(batched_qps, 1),
+            },
+            "lexical_search": percentiles(lexical_latencies),
+            f"recall_at_{k}": round(float(recall), 4),
+            "memory": {
+                "rss_start_mb": round(rss_start, 1),
+                "rss_after_ingest_mb": round(rss_ingested, 1),
+                "rss_end_mb": round(_rss_mb(), 1),
+                "peak_rss_mb": round(
+                    resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+                ),
+                "disk_mb": round(_dir_mb(work_dir), 1),
+            },
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run_store_config(
+    name: str,
+    corpus_path: str,
+    truth: np.ndarray,
+    k: int,
+    batch_size: int,
+    reranker_model: str = None,
+    rerank_queries: int = 50,
+) -> dict:
+    from app.core.config import settings
+    from app.ingestion.chunker import Chunk
+
+    corpus = load_corpus(corpus_path)
+    vectors, texts, sources = corpus["vectors"], corpus["texts"], corpus["sources"]
+    n = len(vectors)
+    work_dir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+    for key, value in {
+        "chroma_persist_dir": os.path.join(work_dir, "chroma"),
+        "numpy_index_dir": os.path.join(work_dir, "numpy"),
+        "manifest_path": os.path.join(work_dir, "manifest.db"),
+        "source_catalog_path": os.path.join(work_dir, "catalog.db"),
+        "lexical_index_path": os.path.join(work_dir, "bm25.npz"),
+        **STORE_CONFIGS[name],
+    }.items():
+        setattr(settings, key, value)
+    from app.retrieval.vector_store import VectorStore
+
+    rss_start = _rss_mb()
+    try:
+        store = VectorStore()
+        # A marker word no chunk contains keeps query texts unique without
+        # changing their BM25 scores
+        query_texts = [f"{t} q{i}" for i, t in enumerate(corpus["query_texts"])]
+        queries = corpus["queries"]
+        store.embedder = _FixedEmbedder(dict(zip(query_texts, queries.tolist())))
+
+        start = time.perf_counter()
+        for i in range(0, n, batch_size):
+            store.upsert_embedded(
+                [
+                    Chunk(
+                        text=texts[j],
+                        chunk_id=f"c{j}",
+                        source_file=f"doc{sources[j]}.pdf",
+                        page_number=1,
+                        chunk_index=0,
+                    )
+                    for j in range(i, min(i + batch_size, n))
+                ],
+                vectors[i:i + batch_size].tolist(),
+            )
+        store.flush()
+        ingest_seconds = time.perf_counter() - start
+        rss_ingested = _rss_mb()
+
+        def timed(search) -> tuple[list[float], list[list[dict]]]:
+            store._search_cache.clear()  # every query is a cache miss
+            latencies, hits = [], []
+            for q, text in enumerate(query_texts):
+                start = time.perf_counter()
+                hits.append(search(q, text))
+                latencies.append((time.perf_counter() - start) * 1000)
+            return latencies, hits
+
+        latencies, hits = timed(lambda q, text: store.search(text, top_k=k))
+        recall = np.mean([
+            len({int(h["chunk_id"][1:]) for h in got} & set(expected.tolist())) / k
+            for got, expected in zip(hits, truth)
+        ])
+
+        # Filter on the source of a true neighbour so results aren't empty
+        filters = [int(sources[expected[0]]) for expected in truth]
+        filtered_latencies, filtered_hits = timed(
+            lambda q, text: store.search(
+                text, top_k=k, source_filter=f"doc{filters[q]}.pdf"
+            )
+        )
+        filtered_recall = []
+        for q, got in enumerate(filtered_hits):
+            rows = np.flatnonzero(sources == filters[q])
+            best = rows[np.argsort(-(vectors[rows] @ queries[q]))[:k]]
+            filtered_recall.append(
+                len({int(h["chunk_id"][1:]) for h in got} & set(best.tolist()))
+                / min(k, len(rows))
+            )
+
+        result = {
+            "config": name,
+            "store_settings": STORE_CONFIGS[name],
+            "ingest": {
+                "total_seconds": round(ingest_seconds, 3),
+                "chunks_per_s": round(n / ingest_seconds, 1),
+            },
+            "search": percentiles(latencies),
+            # Hybrid results are fused with BM25, so this is agreement with
+            # exact dense search rather than a quality score
+            f"recall_at_{k}": round(float(recall), 4),
+            "filtered_search": {
+                **percentiles(filtered_latencies),
+                f"recall_at_{k}": round(float(np.mean(filtered_recall)), 4),
+            },
+        }
+
+        if reranker_model:
+            from app.retrieval.reranker import CrossEncoderReranker
+
+            reranker = CrossEncoderReranker(
+                reranker_model, settings.rerank_batch_size,
+                settings.rerank_budget_ms,
+            )
+            reranker.warm_up()
+            store._search_cache.clear()
+            rerank_latencies, scored = [], []
+            for text in query_texts[:rerank_queries]:
+                start = time.perf_counter()
+                candidates = store.search(text, top_k=settings.rerank_candidates)
+                reranked = reranker.rerank(text, candidates, k)
+                rerank_latencies.append((time.perf_counter() - start) * 1000)
+                scored.append(reranked.stats["scored"])
+            result["rerank"] = {
+                **percentiles(rerank_latencies),
+                "candidates": settings.rerank_candidates,
+                "mean_scored": round(float(np.mean(scored)), 1),
+            }
+
+        result["memory"] = {
+            "rss_start_mb": round(rss_start, 1),
+            "rss_after_ingest_mb": round(rss_ingested, 1),
+            "rss_end_mb": round(_rss_mb(), 1),
+            "peak_rss_mb": round(
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+            ),
+            "disk_mb": round(_dir_mb(work_dir), 1),
+        }
+        return result
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def compare(results: list[dict], baseline_path: str, k: int) -> None:
+    with open(baseline_path) as f:
+        baseline = {r["config"]: r for r in json.load(f)["results"]}
+    recall_key = f"recall_at_{k}"
+    for r in results:
+        old = baseline.get(r["config"])
+        if old is None:
+            continue
+        logger.info(
+            f"{r['config']}: p95 {old['search']['p95_ms']} -> "
+            f"{r['search']['p95_ms']}ms, {recall_key} "
+            f"{old.get(recall_key)} -> {r[recall_key]}, ingest "
+            f"{old['ingest']['chunks_per_s']} -> "
+            f"{r['ingest']['chunks_per_s']} chunks/s"
+        )
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args: argparse.Namespace) -> dict:
+    work_dir = tempfile.mkdtemp(prefix="bench_corpus_")
+    try:
+        if args.corpus and os.path.exists(args.corpus):
+            logger.info(f"Loading corpus from {args.corpus}")
+            corpus = load_corpus(args.corpus)
+        else:
+            logger.info(
+                f"Generating corpus: {args.chunks} chunks, {args.queries} queries"
+            )
+            corpus = make_corpus(args.chunks, args.queries, dim=args.dim)
+            if args.corpus:
+                save_corpus(corpus, args.corpus)
+
+        corpus_path = args.corpus or os.path.join(work_dir, "corpus.npz")
+        if not args.corpus:
+            save_corpus(corpus, corpus_path)
+
+        logger.info("Computing exact top-k ground truth...")
+        truth = exact_top_k(corpus["vectors"], corpus["queries"], args.k)
+
+        results = []
+        context = multiprocessing.get_context("spawn")
+        for name in args.configs:
+            logger.info(f"Benchmarking {name}...")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                result = pool.submit(
+                    run_config, name, corpus_path, truth, args.k,
+                    args.batch_size, args.reranker_model, args.rerank_queries,
+                ).result()
+            logger.info(
+                f"{name}: {result['ingest']['chunks_per_s']} chunks/s, "
+                f"p50={result['search']['p50_ms']}ms "
+                f"p99={result['search']['p99_ms']}ms, "
+                f"recall@{args.k}={result[f'recall_at_{args.k}']}"
+            )
+            if "filtered_search" in result:
+                logger.info(
+                    f"{name} source_filter: "
+                    f"p50={result['filtered_search']['p50_ms']}ms"
+                    + (
+                        f", rerank p50={result['rerank']['p50_ms']}ms"
+                        if "rerank" in result else ""
+                    )
+                )
+            results.append(result)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_commit": _git_commit(),
+            "chunks": len(corpus["vectors"]),
+            "queries": len(corpus["queries"]),
+            "dim": corpus["vectors"].shape[1],
+            "k": args.k,
+            "batch_size": args.batch_size,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline retrieval benchmark")
+    parser.add_argument("--chunks", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument(
+        "--configs", nargs="+", default=[*CONFIGS, *STORE_CONFIGS],
+        choices=[*CONFIGS, *STORE_CONFIGS],
+    )
+    parser.add_argument(
+        "--reranker-model",
+        help="Cross-encoder to time reranking with in the store configs "
+             "(skipped when unset, since it needs a local model)",
+    )
+    parser.add_argument("--rerank-queries", type=int, default=50)
+    parser.add_argument(
+        "--corpus", help="Synthetic corpus .npz to load, or to create if missing"
+    )
+    parser.add_argument("--output", default="tests/benchmark_results.json")
+    parser.add_argument("--baseline", help="Earlier output to compare against")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Benchmark results saved to {args.output}")
+
+    if args.baseline:
+        compare(report["results"], args.baseline, args.k)
+
+
+if __name__ == "__main__":
+    main()
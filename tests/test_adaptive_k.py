@@ -0,0 +1,73 @@
+import pytest
+
+from app.retrieval.adaptive_k import AdaptiveTopK
+
+
+def _results(scores, key="score"):
+    return [{"chunk_id": f"c{i}", key: s} for i, s in enumerate(scores)]
+
+
+@pytest.fixture
+def selector():
+    return AdaptiveTopK(min_k=2, max_k=5, min_gap=0.05)
+
+
+def test_cuts_at_largest_gap(selector):
+    cutoff = selector.select(_results([0.9, 0.88, 0.86, 0.6, 0.58, 0.57]))
+    assert cutoff.reason == "gap"
+    assert [r["chunk_id"] for r in cutoff.results] == ["c0", "c1", "c2"]
+    assert cutoff.k == 3
+    assert cutoff.gap == pytest.approx(0.26)
+    assert cutoff.candidates == 6
+
+
+def test_gap_before_min_k_is_ignored(selector):
+    # The cliff after the first chunk is inside min_k
+    cutoff = selector.select(_results([0.9, 0.5, 0.49, 0.48, 0.47, 0.46]))
+    assert cutoff.reason == "flat"
+    assert cutoff.k == 5
+
+
+def test_flat_curve_keeps_max_k(selector):
+    cutoff = selector.select(_results([0.8, 0.79, 0.78, 0.77, 0.76, 0.75, 0.2]))
+    assert cutoff.reason == "flat"
+    assert cutoff.gap == 0.0
+    assert [r["chunk_id"] for r in cutoff.results] == ["c0", "c1", "c2", "c3", "c4"]
+
+
+def test_few_results_are_kept(selector):
+    cutoff = selector.select(_results([0.9, 0.1]))
+    assert cutoff.reason == "few"
+    assert cutoff.k == 2
+    assert selector.select([]).k == 0
+
+
+def test_ties_keep_arrival_order_and_higher_scores(selector):
+    # Reranked results arrive out of cosine order; ties at the cut are
+    # broken by arrival order, never at the expense of a higher score
+    results = _results([0.5, 0.5, 0.9, 0.5, 0.1])
+    cutoff = selector.select(results)
+    assert cutoff.reason == "gap"
+    assert [r["chunk_id"] for r in cutoff.results] == ["c0", "c1", "c2", "c3"]
+
+    selector = AdaptiveTopK(min_k=1, max_k=2, min_gap=0.5)
+    cutoff = selector.select(_results([0.5, 0.5, 0.9]))
+    assert [r["chunk_id"] for r in cutoff.results] == ["c0", "c2"]
+
+
+def test_prefers_rerank_then_rrf_scores(selector):
+    results = [
+        dict(r, rerank_score=s)
+        for r, s in zip(_results([0.9, 0.8, 0.7, 0.6]), [5.0, 4.9, 1.0, 0.9])
+    ]
+    assert selector.select(results).k == 2
+
+    # RRF values are close together, so gaps are relative to the top score
+    rrf = [2 / 61, 2 / 62, 1 / 61, 1 / 62, 1 / 63]
+    results = [
+        dict(r, rrf_score=s)
+        for r, s in zip(_results([0.5, 0.5, 0.5, 0.5, 0.5]), rrf)
+    ]
+    cutoff = selector.select(results)
+    assert cutoff.reason == "gap"
+    assert [r["chunk_id"] for r in cutoff.results] == ["c0", "c1"]
@@ -17,8 +17,10 @@ def evaluate_retrieval_precision(
     correct = 0
     total = 0
 
-    for test in test_set:
-        results = vector_store.search(test["question"], top_k=top_k)
+    all_results = vector_store.search_many(
+        [test["question"] for test in test_set], top_k=top_k
+    )
+    for test, results in zip(test_set, all_results):
         for r in results:
             total += 1
             if r["source_file"] == test.get("expected_source_file"):
@@ -40,8 +42,8 @@ def evaluate_answer_faithfulness(
     no_answer = 0
     results_log = []
 
-    for test in test_set:
-        response = rag_chain.query(test["question"])
+    responses = rag_chain.query_many([test["question"] for test in test_set])
+    for test, response in zip(test_set, responses):
         answer_lower = response.answer.lower()
 
         # Check if expected content is in the answer
@@ -82,7 +84,7 @@ def run_full_evaluation(test_set_path: str = "tests/test_questions.json"):
     logger.info(f"Loaded {len(test_set)} test questions")
 
     vector_store = VectorStore()
-    rag_chain = RAGChain()
+    rag_chain = RAGChain(vector_store)
 
     # Retrieval evaluation
     retrieval_results = evaluate_retrieval_precision(test_set, vector_store)
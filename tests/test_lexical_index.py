@@ -0,0 +1,190 @@
+import math
+import os
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from app.retrieval import lexical_index
+from app.retrieval.lexical_index import BM25Index, tokenize
+
+WORDS = (
+    "revenue margin cash debt equity apple iphone services growth risk "
+    "segment china europe tax lease capital dividend buyback supplier"
+).split()
+
+
+def _docs(n: int, seed: int = 0) -> list[tuple]:
+    rng = random.Random(seed)
+    return [
+        (
+            f"c{i}",
+            " ".join(rng.choices(WORDS, k=rng.randint(5, 40))),
+            f"doc{i % 3}.pdf",
+            "table" if i % 5 == 0 else "text",
+        )
+        for i in range(n)
+    ]
+
+
+def _reference(docs, query, top_n, source_filter=None, chunk_type=None):
+    # Exhaustive BM25 over the live documents
+    k1, b = 1.5, 0.75
+    tfs = {d[0]: Counter(tokenize(d[1])) for d in docs}
+    avg = sum(sum(tf.values()) for tf in tfs.values()) / len(tfs)
+    scores = {}
+    for term in set(tokenize(query)):
+        df = sum(1 for tf in tfs.values() if term in tf)
+        if not df:
+            continue
+        idf = math.log(1 + (len(tfs) - df + 0.5) / (df + 0.5))
+        for chunk_id, source, type_ in ((d[0], d[2], d[3]) for d in docs):
+            tf = tfs[chunk_id][term]
+            if not tf or (source_filter and source != source_filter):
+                continue
+            if chunk_type and type_ != chunk_type:
+                continue
+            norm = k1 * (1 - b + b * sum(tfs[chunk_id].values()) / avg)
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + (
+                idf * tf * (k1 + 1) / (tf + norm)
+            )
+    return sorted(scores.items(), key=lambda item: -item[1])[:top_n]
+
+
+def _assert_same(got, expected):
+    assert [round(s, 6) for _, s in got] == [round(s, 6) for _, s in expected]
+    assert {c for c, _ in got} == {c for c, _ in expected}
+
+
+@pytest.fixture
+def index(tmp_path):
+    return BM25Index(str(tmp_path / "bm25.npz"))
+
+
+@pytest.mark.parametrize("compacted", [False, True])
+def test_search_matches_exhaustive_bm25(index, compacted):
+    docs = _docs(300)
+    index.add(docs)
+    if compacted:
+        index.save()
+    for query in ("revenue growth", "apple iphone services risk", "tax"):
+        _assert_same(index.search(query, 10), _reference(docs, query, 10))
+    _assert_same(
+        index.search("cash debt", 5, source_filter="doc1.pdf"),
+        _reference(docs, "cash debt", 5, source_filter="doc1.pdf"),
+    )
+    _assert_same(
+        index.search("cash debt", 5, chunk_type="table"),
+        _reference(docs, "cash debt", 5, chunk_type="table"),
+    )
+
+
+def test_add_replaces_and_remove_deletes(index):
+    index.add([("a", "apple revenue", "x.pdf"), ("b", "apple margin", "x.pdf")])
+    index.save()
+    index.add([("a", "orange juice", "x.pdf")])
+    assert len(index) == 2
+    assert [c for c, _ in index.search("apple", 5)] == ["b"]
+    assert [c for c, _ in index.search("orange", 5)] == ["a"]
+
+    index.remove(["b"])
+    assert index.search("apple", 5) == []
+    assert len(index) == 1
+
+
+def test_remove_source_covers_base_and_delta(index):
+    index.add([("a", "apple", "x.pdf"), ("b", "apple", "y.pdf")])
+    index.save()
+    index.add([("c", "apple", "x.pdf")])
+    index.remove_source("x.pdf")
+    assert [c for c, _ in index.search("apple", 5)] == ["b"]
+
+
+def test_unknown_terms_and_empty_index(index):
+    assert index.search("apple", 5) == []
+    index.add([("a", "apple", "x.pdf")])
+    assert index.search("the of", 5) == []
+    assert index.search("zebra", 5) == []
+
+
+def test_delta_is_compacted(index, monkeypatch):
+    monkeypatch.setattr(lexical_index, "_COMPACT_AT", 50)
+    docs = _docs(120)
+    index.add(docs[:60])
+    index.add(docs[60:])
+    assert len(index._delta_terms) < 50
+    _assert_same(
+        index.search("revenue growth", 10),
+        _reference(docs, "revenue growth", 10),
+    )
+
+
+def test_reload_from_snapshot(tmp_path):
+    path = str(tmp_path / "bm25.npz")
+    docs = _docs(100)
+    writer = BM25Index(path)
+    writer.add(docs)
+    writer.remove(["c3"])
+    writer.save()
+
+    reader = BM25Index(path)
+    live = [d for d in docs if d[0] != "c3"]
+    assert len(reader) == len(live)
+    _assert_same(reader.search("equity", 10), _reference(live, "equity", 10))
+
+
+def test_concurrent_writers_merge(tmp_path):
+    path = str(tmp_path / "bm25.npz")
+    first, second = BM25Index(path), BM25Index(path)
+    first.add([("a", "apple", "x.pdf"), ("b", "apple", "x.pdf")])
+    first.save()
+    second.add([("c", "apple", "y.pdf")])
+    second.remove(["a"])
+    second.save()
+
+    assert {c for c, _ in BM25Index(path).search("apple", 5)} == {"b", "c"}
+    # The first writer picks up the newer snapshot before searching
+    assert {c for c, _ in first.search("apple", 5)} == {"b", "c"}
+
+
+def test_unreadable_snapshot_starts_empty(tmp_path):
+    path = tmp_path / "bm25.npz"
+    path.write_bytes(b"not a snapshot")
+    assert len(BM25Index(str(path))) == 0
+
+
+def test_string_columns_round_trip(tmp_path):
+    path = str(tmp_path / "bm25.npz")
+    long_id = "x" * 5000
+    writer = BM25Index(path)
+    writer.add(
+        [(f"c{i}", "apple pie", "x.pdf") for i in range(200)]
+        + [(long_id, "apple tart", "résumé.pdf", "table")]
+    )
+    writer.save()
+    # One long ID doesn't pad every other ID to its width
+    assert os.path.getsize(path) < 50000
+
+    reader = BM25Index(path)
+    assert dict(reader.search("tart", 1))[long_id] > 0
+    assert reader.search("apple", 5, source_filter="résumé.pdf")[0][0] == long_id
+
+
+def test_reads_fixed_width_snapshot(tmp_path):
+    path = str(tmp_path / "bm25.npz")
+    writer = BM25Index(path)
+    writer.add([("a", "apple", "x.pdf"), ("b", "banana", "y.pdf")])
+    writer.save()
+    with np.load(path) as snapshot:
+        arrays = {name: snapshot[name] for name in snapshot.files}
+    for name in ("ids", "sources", "types", "terms"):
+        data = arrays.pop(f"{name}_data")
+        offsets = arrays.pop(f"{name}_offsets")
+        arrays[name] = np.array(
+            [data[a:b].tobytes().decode() for a, b in zip(offsets, offsets[1:])],
+            dtype=str,
+        )
+    np.savez(path, **arrays)
+
+    assert [c for c, _ in BM25Index(path).search("banana", 5)] == ["b"]
@@ -0,0 +1,134 @@
+import numpy as np
+import pytest
+
+from app.retrieval import numpy_index
+from app.retrieval.numpy_index import NumpyBackend
+
+DIM = 32
+
+
+def _vectors(n: int, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).normal(size=(n, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _upsert(backend: NumpyBackend, vectors: np.ndarray, start: int = 0) -> None:
+    ids = [f"c{i}" for i in range(start, start + len(vectors))]
+    backend.upsert(
+        ids=ids,
+        documents=[f"text {chunk_id}" for chunk_id in ids],
+        embeddings=vectors.tolist(),
+        metadatas=[
+            {
+                "source_file": f"doc{i % 4}.pdf",
+                "page_number": 1,
+                "chunk_index": i,
+                "chunk_type": "table" if i % 7 == 0 else "text",
+            }
+            for i in range(start, start + len(vectors))
+        ],
+    )
+
+
+def _exact(vectors: np.ndarray, query: np.ndarray, k: int, rows=None) -> list[str]:
+    rows = np.arange(len(vectors)) if rows is None else np.asarray(rows)
+    scores = vectors[rows] @ query
+    return [f"c{rows[i]}" for i in np.argsort(-scores)[:k]]
+
+
+@pytest.fixture
+def vectors():
+    return _vectors(2000)
+
+
+@pytest.mark.parametrize("dtype", ["int8", "float16"])
+def test_query_matches_exact_search(tmp_path, vectors, dtype, monkeypatch):
+    # Small blocks so the running shortlist is merged across many blocks
+    monkeypatch.setattr(numpy_index, "_SCORE_BLOCK", 300)
+    backend = NumpyBackend(str(tmp_path), dtype=dtype, rescore_factor=8)
+    _upsert(backend, vectors)
+    queries = _vectors(5, seed=1)
+    results = backend.query(queries.tolist(), n_results=10)
+    for query, hits in zip(queries, results):
+        assert [h["chunk_id"] for h in hits] == _exact(vectors, query, 10)
+
+
+def test_filters(tmp_path, vectors):
+    backend = NumpyBackend(str(tmp_path), rescore_factor=8)
+    _upsert(backend, vectors)
+    query = _vectors(1, seed=2)[0]
+
+    hits = backend.query([query.tolist()], 5, source_filter="doc1.pdf")[0]
+    assert [h["chunk_id"] for h in hits] == _exact(
+        vectors, query, 5, rows=range(1, 2000, 4)
+    )
+    hits = backend.query([query.tolist()], 5, chunk_type="table")[0]
+    assert [h["chunk_id"] for h in hits] == _exact(
+        vectors, query, 5, rows=range(0, 2000, 7)
+    )
+    assert backend.query([query.tolist()], 5, source_filter="nope.pdf") == [[]]
+
+    # Deleted rows drop out of the source's rows
+    backend.delete([f"c{i}" for i in range(1, 1000, 4)])
+    hits = backend.query([query.tolist()], 5, source_filter="doc1.pdf")[0]
+    assert [h["chunk_id"] for h in hits] == _exact(
+        vectors, query, 5, rows=range(1001, 2000, 4)
+    )
+
+
+def test_delete_compacts_and_survives_reopen(tmp_path, vectors, monkeypatch):
+    monkeypatch.setattr(numpy_index, "_COMPACT_MIN_ROWS", 100)
+    backend = NumpyBackend(str(tmp_path), rescore_factor=8)
+    _upsert(backend, vectors)
+    backend.delete_source("doc0.pdf")
+    backend.flush()
+
+    stats = backend.stats()
+    assert stats["rows"] == stats["live"] == 1500
+    assert stats["tombstoned"] == 0
+
+    live = [i for i in range(2000) if i % 4]
+    query = _vectors(1, seed=3)[0]
+    expected = [f"c{live[i]}" for i in np.argsort(-(vectors[live] @ query))[:10]]
+    hits = backend.query([query.tolist()], 10)[0]
+    assert [h["chunk_id"] for h in hits] == expected
+    assert backend.get(["c5"])[0]["text"] == "text c5"
+
+    reopened = NumpyBackend(str(tmp_path), rescore_factor=8)
+    assert reopened.count() == 1500
+    hits = reopened.query([query.tolist()], 10)[0]
+    assert [h["chunk_id"] for h in hits] == expected
+
+
+def test_interrupted_compaction_is_finished_on_open(tmp_path, vectors, monkeypatch):
+    monkeypatch.setattr(numpy_index, "_COMPACT_MIN_ROWS", 100)
+    backend = NumpyBackend(str(tmp_path), rescore_factor=8)
+    _upsert(backend, vectors)
+    # Crash after records.db was renumbered but before the files were swapped
+    monkeypatch.setattr(NumpyBackend, "_finish_compaction", lambda self: None)
+    backend.delete_source("doc0.pdf")
+    monkeypatch.undo()
+
+    reopened = NumpyBackend(str(tmp_path), rescore_factor=8)
+    query = vectors[5]
+    assert reopened.query([query.tolist()], 1)[0][0]["chunk_id"] == "c5"
+
+
+def test_ivf_trains_in_background(tmp_path, vectors):
+    backend = NumpyBackend(
+        str(tmp_path), ivf_lists=8, ivf_probe=8, ivf_min_rows=500,
+        rescore_factor=8,
+    )
+    _upsert(backend, vectors[:1000])
+    if backend._training is not None:
+        backend._training.join()
+    assert backend.stats()["ivf_lists"] == 8
+
+    # Rows added after training are routed to their lists
+    _upsert(backend, vectors[1000:], start=1000)
+    query = vectors[1500]
+    assert backend.query([query.tolist()], 1)[0][0]["chunk_id"] == "c1500"
+    # Probing every list is exact
+    queries = _vectors(3, seed=4)
+    for q, hits in zip(queries, backend.query(queries.tolist(), 10)):
+        assert [h["chunk_id"] for h in hits] == _exact(vectors, q, 10)